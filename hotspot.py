@@ -0,0 +1,7 @@
+"""Allows running the command-line interface as `python -m hotspot` from the repository root."""
+import sys
+
+from src.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Headless entry point running download -> smooth -> LST -> UI (with aggregation) for the AOIs of a job file.
+
+Usage::
+
+    python -m hotspot run jobs.yaml --workers 4 --download-workers 8 --cache-dir cache --report report.json
+
+A job file (YAML or JSON) lists the AOIs and optional defaults shared by all of them::
+
+    defaults:
+      resolution: 10
+      filter: "eo:cloud_cover < 30"
+      steps: [download, smooth, lst, ui]
+    aois:
+      - name: goerlitz
+        bbox: [497000, 5664900, 501700, 5668400]
+        crs: 32633
+        date_range: ["2024-06-01", "2024-07-01"]
+        out_dir: runs/goerlitz
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+from src.utils.http_client import CDSE_PROCESSING_UNITS_PER_MINUTE, CDSE_REQUESTS_PER_MINUTE
+
+STEPS = ('download', 'smooth', 'lst', 'ui')
+AOI_DEFAULTS = {
+    'resolution': 10,
+    'filter': 'eo:cloud_cover < 50',
+    'steps': list(STEPS),
+    'sigma': 2,
+    'ndwi_threshold': 0.3,
+    'mndwi_threshold': 0.3,
+    'method': 'average',
+}
+
+
+def load_job_file(path):
+    """
+    Reads a YAML or JSON job file and returns its AOIs with the defaults applied.
+
+    :raises ValueError: If the file is malformed or an AOI misses a required key.
+    """
+    with open(path) as job_file:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("YAML job files need PyYAML (pip install pyyaml), or use a JSON job file.")
+            job = yaml.safe_load(job_file)
+        else:
+            job = json.load(job_file)
+
+    if not isinstance(job, dict) or not isinstance(job.get('aois'), list) or not job['aois']:
+        raise ValueError(f"{path}: expected a mapping with a non-empty 'aois' list")
+
+    defaults = dict(AOI_DEFAULTS, **job.get('defaults', {}))
+    aois = []
+    for index, aoi in enumerate(job['aois']):
+        aoi = dict(defaults, **aoi)
+        aoi.setdefault('name', f"aoi_{index}")
+        missing = [key for key in ('bbox', 'crs', 'date_range', 'out_dir') if key not in aoi]
+        if missing:
+            raise ValueError(f"{path}: AOI '{aoi['name']}' misses {', '.join(missing)}")
+        unknown = [step for step in aoi['steps'] if step not in STEPS]
+        if unknown:
+            raise ValueError(f"{path}: AOI '{aoi['name']}' has unknown steps {unknown}, expected some of {STEPS}")
+        if any(other['name'] == aoi['name'] for other in aois):
+            raise ValueError(f"{path}: AOI name '{aoi['name']}' is used twice")
+        aois.append(aoi)
+    return aois
+
+
+def run_aoi(aoi, options, download=None):
+    """
+    Runs the steps of one AOI and returns its report entry. Failures are recorded instead of raised, so one broken
+    AOI does not stop the others.
+
+    :param download: Result of the AOI in the batch download, see `BatchScheduler.run`.
+    """
+    record = {'name': aoi['name'], 'status': 'ok', 'steps': {}, 'outputs': {}}
+    out_dir = aoi['out_dir']
+    os.makedirs(out_dir, exist_ok=True)
+
+    try:
+        for step in STEPS:
+            if step not in aoi['steps']:
+                continue
+            start = time.perf_counter()
+            print(f"[{aoi['name']}] {step}")
+            if step == 'download':
+                # All AOIs are downloaded together by the batch scheduler before any AOI is processed
+                record['steps'][step] = download['seconds']
+                if download['status'] != 'ok':
+                    raise RuntimeError(download['error'])
+                continue
+            _run_step(step, aoi, options, record['outputs'])
+            record['steps'][step] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f"{type(e).__name__}: {e}"
+        print(f"[{aoi['name']}] failed: {record['error']}")
+    return record
+
+
+# Pipeline stage that brings each step up to date, with the product it leaves in the AOI directory
+STEP_TARGETS = {'smooth': ('smooth', None), 'lst': ('lst_mean', 'LST_mean.tiff'),
+                'ui': ('ui_aggregate', 'aggregated_ui.tiff')}
+
+
+def _run_step(step, aoi, options, outputs):
+    from src.utils.pipeline import build_hotspot_pipeline
+
+    # Products whose inputs and parameters are unchanged since the last run are skipped
+    pipeline = build_hotspot_pipeline(aoi['out_dir'], sigma=aoi['sigma'], smooth='smooth' in aoi['steps'],
+                                      ndwi_threshold=aoi['ndwi_threshold'], mndwi_threshold=aoi['mndwi_threshold'],
+                                      method=aoi['method'], memory_budget_mb=options.memory_budget_mb,
+                                      storage=options.storage)
+    target, product = STEP_TARGETS[step]
+    report = pipeline.run([target], max_workers=options.workers)
+    stages = outputs.setdefault('stages', {})
+    for stage, result in report.items():
+        stages[stage] = {'computed': len(result['computed']), 'skipped': len(result['skipped'])}
+
+    if product is not None:
+        output_path = os.path.join(aoi['out_dir'], product)
+        if not os.path.exists(output_path):
+            raise RuntimeError(f"{step} produced no {product}, check the downloaded rasters")
+        outputs['lst_mean' if step == 'lst' else 'aggregated_ui'] = output_path
+    if step == 'lst':
+        outputs['lst_timings'] = {os.path.basename(path): seconds for stage in ('lst_days', 'lst_mean')
+                                  for path, seconds in report[stage]['computed'].items()}
+
+
+def run_jobs(aois, options):
+    """
+    Downloads the data of all AOIs in one batch, sharing authentication, caches, searches and overlapping tiles, then
+    processes the AOIs one after the other and returns the run report.
+    """
+    started = datetime.datetime.now(datetime.timezone.utc)
+    start = time.perf_counter()
+    downloads, batch_stats, sentinel_data = {}, None, None
+    download_aois = [aoi for aoi in aois if 'download' in aoi['steps']]
+    if download_aois:
+        from src.utils.batch_scheduler import BatchScheduler
+        sentinel_data = _create_sentinel_data(options)
+        scheduler = BatchScheduler(sentinel_data, max_workers=options.download_workers,
+                                   max_requests_per_host=options.download_workers, fused=options.fused_download,
+                                   sentinel3_resolution=options.sentinel3_resolution,
+                                   sentinel3_kernel=options.sentinel3_kernel)
+        for aoi in download_aois:
+            # Daily S2 + S3 pairs feed smoothing and LST, weekly S2 composites feed UI
+            scheduler.add_aoi(aoi['name'], [float(c) for c in aoi['bbox']], int(aoi['crs']),
+                              tuple(aoi['date_range']), aoi['resolution'], aoi['out_dir'], filter=aoi['filter'],
+                              daily=bool({'smooth', 'lst'} & set(aoi['steps'])), weekly='ui' in aoi['steps'])
+        downloads = scheduler.run(progress=lambda done, total, item: print(f"Downloaded {done}/{total}: {item}"))
+        batch_stats = scheduler.stats
+
+    records = [run_aoi(aoi, options, downloads.get(aoi['name'])) for aoi in aois]
+    report = {
+        'started': started.isoformat(),
+        'seconds': round(time.perf_counter() - start, 3),
+        'status': 'ok' if all(record['status'] == 'ok' for record in records) else 'failed',
+        'aois': records,
+    }
+    if batch_stats is not None:
+        report['download'] = batch_stats
+    if sentinel_data is not None and sentinel_data.cache is not None:
+        report['download_cache'] = sentinel_data.cache.stats()
+    if sentinel_data is not None:
+        report['rate_limit'] = dict(sentinel_data.rate_limiter.stats)
+    return report
+
+
+def _create_sentinel_data(options):
+    from src.utils.catalog_index import CatalogIndex
+    from src.utils.download_cache import DownloadCache
+    from src.utils.http_client import RateLimiter
+    from src.utils.sentinel_data import SentinelData
+    from src.utils.token_manager import DEFAULT_TOKEN_CACHE_DIR
+
+    # Credentials from the environment take precedence over sentinel_secrets.py
+    api_keys = False
+    if os.environ.get('HOTSPOT_CLIENT_ID') and os.environ.get('HOTSPOT_CLIENT_SECRET'):
+        api_keys = {'client_name': os.environ['HOTSPOT_CLIENT_ID'],
+                    'client_secret': os.environ['HOTSPOT_CLIENT_SECRET']}
+    cache, catalog_index = None, None
+    if options.cache_dir:
+        cache = DownloadCache(os.path.join(options.cache_dir, 'downloads'),
+                              max_bytes=int(options.cache_max_gb * 1024 ** 3))
+        catalog_index = CatalogIndex(os.path.join(options.cache_dir, 'catalog.sqlite'))
+    return SentinelData(api_keys=api_keys, cache=cache, catalog_index=catalog_index,
+                        output_profile=options.output_profile, storage=options.storage,
+                        token_cache_dir=DEFAULT_TOKEN_CACHE_DIR,
+                        rate_limiter=RateLimiter(options.requests_per_minute, options.processing_units_per_minute))
+
+
+def _sentinel3_resolution(value):
+    if value == 'native':
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a resolution or 'native', got '{value}'")
+
+
+def build_parser():
+    from src.utils.gis_helpers import OUTPUT_PROFILES
+
+    parser = argparse.ArgumentParser(prog='hotspot', description="Headless LST and UI processing of Sentinel data.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the pipeline for the AOIs of a YAML/JSON job file")
+    run_parser.add_argument('job_file')
+    run_parser.add_argument('--workers', type=int, default=1,
+                            help="Threads computing the products of a processing stage in parallel")
+    run_parser.add_argument('--download-workers', type=int, default=4,
+                            help="Parallel download requests, shared by all AOIs")
+    run_parser.add_argument('--fused-download', action='store_true',
+                            help="Download the daily Sentinel-2 and Sentinel-3 rasters in one request per day")
+    run_parser.add_argument('--sentinel3-resolution', type=_sentinel3_resolution, default=None,
+                            help="Download Sentinel-3 at this coarser resolution, or 'native' (1 km), and upsample "
+                                 "it locally")
+    run_parser.add_argument('--sentinel3-kernel', choices=('nearest', 'bilinear', 'cubic'), default='bilinear',
+                            help="Kernel upsampling the coarse Sentinel-3 rasters")
+    run_parser.add_argument('--requests-per-minute', type=float, default=CDSE_REQUESTS_PER_MINUTE,
+                            help="Request quota of the Sentinel Hub account, 0 for no limit")
+    run_parser.add_argument('--processing-units-per-minute', type=float, default=CDSE_PROCESSING_UNITS_PER_MINUTE,
+                            help="Processing unit quota of the Sentinel Hub account, 0 for no limit")
+    run_parser.add_argument('--cache-dir', default=None,
+                            help="Directory for the download cache and the catalog search index")
+    run_parser.add_argument('--cache-max-gb', type=float, default=5, help="Size limit of the download cache")
+    run_parser.add_argument('--memory-budget-mb', type=float, default=None,
+                            help="Working memory budget of the raster calculations per process")
+    run_parser.add_argument('--output-profile', choices=list(OUTPUT_PROFILES), default=None,
+                            help="Raster output profile")
+    run_parser.add_argument('--storage', choices=('float32', 'scaled'), default='float32',
+                            help="Store downloads and daily LST rasters as float32 or as scaled UINT16")
+    run_parser.add_argument('--report', default=None, help="Write the JSON run report to this file")
+    return parser
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+
+    try:
+        aois = load_job_file(options.job_file)
+    except (OSError, ValueError) as e:
+        print(f"Invalid job file: {e}", file=sys.stderr)
+        return 2
+
+    if options.output_profile:
+        from src.utils.gis_helpers import set_default_output_profile
+        set_default_output_profile(options.output_profile)
+
+    report = run_jobs(aois, options)
+    report_json = json.dumps(report, indent=2)
+    if options.report:
+        with open(options.report, 'w') as report_file:
+            report_file.write(report_json)
+        print(f"Run report saved to {options.report}")
+    else:
+        print(report_json)
+    return 0 if report['status'] == 'ok' else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,15 @@
+import multiprocessing
 import os
 import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
+import requests
+from PIL import Image, ImageTk
 from tkintermapview import TkinterMapView
-from geopy.geocoders import Nominatim
-from src.utils.gis_helpers import plot_geotiff, convert_bbox_to_utm, smooth_raster
-from src.utils.lst_calculator import calculate_lst
-from src.utils.sentinel_data import SentinelData
-from src.utils.ui_calculator import calculate_ui  # Assuming a new UI calculation function
+from src.utils.background_jobs import BackgroundJobRunner
+
+# The processing modules pull in rasterio, pyproj, scipy, matplotlib and sentinelhub. They are imported inside the
+# methods that use them, so the window shows up without waiting for them.
 
 if getattr(sys, 'frozen', False):
     base_path = sys._MEIPASS  # For PyInstaller bundles
@@ -18,6 +20,45 @@ else:
 os.environ['GDAL_DATA'] = os.path.join(base_path, 'gdal_data')
 os.environ['PROJ_LIB'] = os.path.join(base_path)
 
+class RasterOverlayMapView(TkinterMapView):
+    """Map widget that draws the tiles of a `TileRenderer` over the basemap tiles."""
+
+    def __init__(self, *args, **kwargs):
+        self.raster_overlay = None
+        super().__init__(*args, **kwargs)
+
+    def set_raster_overlay(self, renderer):
+        self.raster_overlay = renderer
+        # Drop the cached tiles and redraw the map with the new overlay
+        self.set_tile_server(self.tile_server, self.tile_size, self.max_zoom)
+
+    def request_image(self, zoom, x, y, db_cursor=None):
+        overlay = None
+        if self.raster_overlay is not None:
+            try:
+                overlay = self.raster_overlay.render_tile(zoom, x, y)
+            except Exception as e:
+                # An error here would end the tile loader thread of the map, e.g. for a raster removed while panning
+                print(f"Overlay tile {zoom}/{x}/{y} could not be rendered: {e}")
+        if overlay is None:
+            return super().request_image(zoom, x, y, db_cursor)
+
+        try:
+            url = self.tile_server.replace("{x}", str(x)).replace("{y}", str(y)).replace("{z}", str(zoom))
+            image = Image.open(requests.get(url, stream=True, headers={"User-Agent": "TkinterMapView"}).raw)
+            image = image.convert("RGBA").resize(overlay.size)
+        except Exception:
+            # Without a basemap tile the overlay is still shown
+            image = Image.new("RGBA", overlay.size)
+        image.alpha_composite(overlay)
+
+        if not self.running:
+            return self.empty_tile_image
+        image_tk = ImageTk.PhotoImage(image)
+        self.tile_image_cache[f"{zoom}{x}{y}"] = image_tk
+        return image_tk
+
+
 class SentinelDownloaderApp:
     def __init__(self, root):
         self.root = root
@@ -62,6 +103,11 @@ class SentinelDownloaderApp:
         # Create the map section
         self.setup_map_section()
 
+        # Downloads and calculations run on a worker thread, their progress is shown in the status bar
+        self.job_runner = BackgroundJobRunner()
+        self.setup_status_bar()
+        self.root.after(100, self.poll_jobs)
+
     def setup_download_tab(self):
         # Use a grid layout manager to organize widgets
         # Create a frame inside the download tab to hold all widgets
@@ -254,7 +300,7 @@ class SentinelDownloaderApp:
         self.map_frame.grid(row=0, column=1, sticky="nsew", padx=10, pady=10)
 
         # Create the map widget
-        self.map_widget = TkinterMapView(self.map_frame)
+        self.map_widget = RasterOverlayMapView(self.map_frame)
         self.map_widget.grid(row=0, column=0, sticky="nsew")
 
         # City search field and button in one row
@@ -274,10 +320,72 @@ class SentinelDownloaderApp:
                                             command=self.update_bbox_from_map)
         self.update_bbox_button.pack(side=tk.LEFT, padx=5)
 
+        self.hide_overlay_button = tk.Button(self.map_button_frame, text="Hide Result Overlay",
+                                             command=lambda: self.map_widget.set_raster_overlay(None))
+        self.hide_overlay_button.pack(side=tk.LEFT, padx=5)
+
         # Set default map position and zoom
         self.map_widget.set_position(51.155, 14.988)  # Default location Görlitz/Zgorzelec
         self.map_widget.set_zoom(10)
 
+    def setup_status_bar(self):
+        # Status bar below tabs and map: progress of the running job and a cancel button
+        self.status_frame = tk.Frame(self.main_frame)
+        self.status_frame.grid(row=1, column=0, columnspan=2, sticky="ew", padx=10, pady=5)
+        self.status_frame.columnconfigure(1, weight=1)
+
+        self.progress_bar = ttk.Progressbar(self.status_frame, mode='determinate', length=200)
+        self.progress_bar.grid(row=0, column=0, padx=5)
+        self.status_label = tk.Label(self.status_frame, text="Ready", anchor='w')
+        self.status_label.grid(row=0, column=1, padx=5, sticky="ew")
+        self.cancel_button = tk.Button(self.status_frame, text="Cancel", command=self.cancel_job, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=2, padx=5)
+
+    def poll_jobs(self):
+        # Job callbacks run here, on the Tk main thread
+        self.job_runner.poll()
+        self.root.after(100, self.poll_jobs)
+
+    def run_job(self, label, function, *args, on_success=None, error_message="An error occurred", **kwargs):
+        """Runs `function` on the background job runner and reports its progress and outcome in the GUI."""
+        if self.job_runner.busy:
+            messagebox.showerror("Error", "Another job is still running. Please wait or cancel it first.")
+            return
+
+        def finish(status):
+            self.cancel_button.configure(state=tk.DISABLED)
+            self.status_label.configure(text=status)
+
+        def show_progress(progress):
+            self.progress_bar.configure(maximum=progress.total or 1, value=progress.done)
+            self.status_label.configure(text=progress.describe())
+
+        def succeeded(result):
+            finish(f"{label}: done")
+            self.progress_bar.configure(value=self.progress_bar['maximum'])
+            if on_success is not None:
+                on_success(result)
+
+        def failed(error):
+            finish(f"{label}: failed")
+            messagebox.showerror("Error", f"{error_message}: {error}")
+
+        self.progress_bar.configure(value=0)
+        self.status_label.configure(text=f"{label}: starting")
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.job_runner.submit(label, function, *args, on_progress=show_progress, on_success=succeeded,
+                               on_error=failed, on_cancelled=lambda progress: finish(f"{label}: cancelled"), **kwargs)
+
+    def cancel_job(self):
+        self.job_runner.cancel()
+        self.status_label.configure(text="Cancelling after the current item...")
+
+    def show_raster_overlay(self, renderer):
+        """Shows a rendered result raster as overlay on the map and moves the map to it."""
+        self.map_widget.set_raster_overlay(renderer)
+        west, south, east, north = renderer.bounds_wgs84()
+        self.map_widget.fit_bounding_box((north, west), (south, east))
+
     def browse_output_dir(self):
         self.output_dir = filedialog.askdirectory()
         if self.output_dir:
@@ -305,6 +413,7 @@ class SentinelDownloaderApp:
         max_lat = max(lats)
         min_lng = min(lngs)
         max_lng = max(lngs)
+        from src.utils.gis_helpers import convert_bbox_to_utm
         bounding_box_utm, crs_info = convert_bbox_to_utm(max_lat, min_lat, max_lng, min_lng)
 
         # Convert to the bounding box format
@@ -316,6 +425,7 @@ class SentinelDownloaderApp:
         messagebox.showinfo("BBox Updated", f"New Bounding Box: {bbox_str}")
 
     def search_city(self):
+        from geopy.geocoders import Nominatim
         geolocator = Nominatim(user_agent="bbox_search")
         city_name = self.city_entry.get()
 
@@ -342,20 +452,27 @@ class SentinelDownloaderApp:
             end_date = self.end_date_entry.get()
             date_range = (start_date, end_date)
             filter_string = self.filter_entry.get()
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {e}")
+            return
 
-            # Validate output directory
-            if not self.output_dir_entry.get():
-                messagebox.showerror("Error", "Please select an output directory.")
-                return
+        # Validate output directory
+        if not self.output_dir_entry.get():
+            messagebox.showerror("Error", "Please select an output directory.")
+            return
 
+        def download(progress):
+            from src.utils.sentinel_data import SentinelData
+            from src.utils.token_manager import DEFAULT_TOKEN_CACHE_DIR
             # Create a SentinelData instance and download Sentinel-2 and Sentinel-3 data
-            sentinel_data = SentinelData(api_keys=self.api_keys if self.api_keys['client_name'] else False)
-            sentinel_data.download_s2_s3_data_pack(bbox_coords, crs, date_range, 10, self.output_dir_entry.get(),
-                                                   filter=filter_string)
+            sentinel_data = SentinelData(api_keys=self.api_keys if self.api_keys['client_name'] else False,
+                                         token_cache_dir=DEFAULT_TOKEN_CACHE_DIR)
+            sentinel_data.download_s2_s3_data_pack(bbox_coords, crs, date_range, 10, output_dir,
+                                                   filter=filter_string, progress=progress)
 
-            messagebox.showinfo("Success", "Sentinel-2 and Sentinel-3 data downloaded successfully.")
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {e}")
+        output_dir = self.output_dir_entry.get()
+        self.run_job("Downloading S2 & S3", download, on_success=lambda result: messagebox.showinfo(
+            "Success", "Sentinel-2 and Sentinel-3 data downloaded successfully."))
 
     def download_weekly_s2(self):
         try:
@@ -365,72 +482,107 @@ class SentinelDownloaderApp:
             start_date = self.start_date_entry.get()
             end_date = self.end_date_entry.get()
             date_range = (start_date, end_date)
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {e}")
+            return
 
-            # Validate output directory
-            if not self.output_dir_entry.get():
-                messagebox.showerror("Error", "Please select an output directory.")
-                return
+        # Validate output directory
+        if not self.output_dir_entry.get():
+            messagebox.showerror("Error", "Please select an output directory.")
+            return
 
+        def download(progress):
+            from src.utils.sentinel_data import SentinelData
+            from src.utils.token_manager import DEFAULT_TOKEN_CACHE_DIR
             # Create a SentinelData instance and download data for each week
-            sentinel_data = SentinelData(api_keys=self.api_keys if self.api_keys['client_name'] else False)
-            sentinel_data.download_s2_data_weekly(bbox_coords, crs, date_range, 10, self.output_dir_entry.get())
+            sentinel_data = SentinelData(api_keys=self.api_keys if self.api_keys['client_name'] else False,
+                                         token_cache_dir=DEFAULT_TOKEN_CACHE_DIR)
+            sentinel_data.download_s2_data_weekly(bbox_coords, crs, date_range, 10, output_dir, progress=progress)
 
-            messagebox.showinfo("Success", "Sentinel-2 weekly data downloaded successfully.")
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {e}")
+        output_dir = self.output_dir_entry.get()
+        self.run_job("Downloading S2 weekly", download, on_success=lambda result: messagebox.showinfo(
+            "Success", "Sentinel-2 weekly data downloaded successfully."))
 
     def calculate_lst(self):
-        try:
-            if not self.output_dir_entry.get():
-                messagebox.showerror("Error", "No output directory found. Please download the data first.")
-                return
+        if not self.output_dir_entry.get():
+            messagebox.showerror("Error", "No output directory found. Please download the data first.")
+            return
+
+        def calculate(progress):
+            from src.utils.lst_calculator import calculate_lst
+            from src.utils.tile_renderer import TileRenderer
+            # Call the function to calculate LST, the overlay is prepared on the worker thread as well
+            raster_path = calculate_lst(output_dir, progress=progress)
+            return raster_path, TileRenderer(raster_path, colormap='inferno')
 
-            # Call the function to calculate LST
-            raster_path = calculate_lst(self.output_dir_entry.get())
+        def show_result(result):
             messagebox.showinfo("Success", "LST calculation completed successfully.")
-            # Plot the generated raster on the map (if possible)
-            plot_geotiff(raster_path)
+            # Show the generated raster on the map
+            self.show_raster_overlay(result[1])
 
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred during LST calculation: {e}")
+        output_dir = self.output_dir_entry.get()
+        self.run_job("Calculating LST", calculate, on_success=show_result,
+                     error_message="An error occurred during LST calculation")
 
     def calculate_ui(self):
-        try:
-            if not self.output_dir_entry.get():
-                messagebox.showerror("Error", "No output directory found. Please download the data first.")
-                return
+        if not self.output_dir_entry.get():
+            messagebox.showerror("Error", "No output directory found. Please download the data first.")
+            return
 
+        try:
             # Get the UI calculation parameters
             ndwi_threshold = float(self.ndwi_entry.get())
             mndwi_threshold = float(self.mndwi_entry.get())
             method = self.method_combobox.get()
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred during UI calculation: {e}")
+            return
 
-            # Call the function to calculate UI (Urban Index)
-            raster_path = calculate_ui(self.output_dir_entry.get(), ndwi_threshold, mndwi_threshold, method)
-            messagebox.showinfo("Success", f"UI calculation completed. Raster saved at {raster_path}")
+        def calculate(progress):
+            from src.utils.tile_renderer import TileRenderer
+            from src.utils.ui_calculator import calculate_ui
+            # Call the function to calculate UI (Urban Index), the overlay is prepared on the worker thread as well
+            raster_path = calculate_ui(output_dir, ndwi_threshold, mndwi_threshold, method, progress=progress)
+            return raster_path, TileRenderer(raster_path, colormap='viridis')
 
-            # Plot the generated raster on the map (if possible)
-            plot_geotiff(raster_path)
+        def show_result(result):
+            messagebox.showinfo("Success", f"UI calculation completed. Raster saved at {result[0]}")
+            # Show the generated raster on the map
+            self.show_raster_overlay(result[1])
 
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred during UI calculation: {e}")
+        output_dir = self.output_dir_entry.get()
+        self.run_job("Calculating UI", calculate, on_success=show_result,
+                     error_message="An error occurred during UI calculation")
 
     def smooth_s3(self):
+        if not self.output_dir_entry.get():
+            messagebox.showerror("Error", "No output directory found. Please download the data first.")
+            return
         try:
-            if not self.output_dir_entry.get():
-                messagebox.showerror("Error", "No output directory found. Please download the data first.")
-                return
             sigma = float(self.sigma_entry.get())
-            input_path = os.path.join(self.output_dir, "Sentinel-3")  # Example input file path
-            output_path = os.path.join(self.output_dir, "Sentinel-3-smooth")  # Example output file path
-
-            smooth_raster(input_path, output_path, sigma=sigma)
-            messagebox.showinfo("Success", f"Smoothed raster saved to: {output_path}")
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred while smoothing the raster: {e}")
+            return
+        input_path = os.path.join(self.output_dir, "Sentinel-3")  # Example input file path
+        output_path = os.path.join(self.output_dir, "Sentinel-3-smooth")  # Example output file path
+
+        def smooth(progress):
+            from src.utils.gis_helpers import smooth_raster
+            smooth_raster(input_path, output_path, sigma=sigma, progress=progress)
+
+        self.run_job("Smoothing S-3", smooth,
+                     on_success=lambda result: messagebox.showinfo("Success", f"Smoothed raster saved to: {output_path}"),
+                     error_message="An error occurred while smoothing the raster")
+
+
+def main():
+    # Initialize Tkinter root and run the app
+    root = tk.Tk()
+    app = SentinelDownloaderApp(root)
+    root.mainloop()
 
 
-# Initialize Tkinter root and run the app
-root = tk.Tk()
-app = SentinelDownloaderApp(root)
-root.mainloop()
+if __name__ == "__main__":
+    # Lets the frozen application start the spawned worker processes of the LST calculation
+    multiprocessing.freeze_support()
+    main()
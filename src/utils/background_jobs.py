@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+
+
+class JobCancelled(Exception):
+    """Raised from a progress callback to stop a job that was cancelled."""
+
+
+class JobProgress:
+    """Progress of a running job: items done out of total, the last finished item and the derived throughput."""
+
+    def __init__(self, label):
+        self.label = label
+        self.done = 0
+        self.total = None
+        self.item = None
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Finished items per second."""
+        return self.done / self.elapsed if self.done else 0.0
+
+    @property
+    def eta(self):
+        """Estimated seconds until all items are finished, `None` while unknown."""
+        if not self.total or not self.done:
+            return None
+        return (self.total - self.done) / self.rate
+
+    def describe(self):
+        text = f"{self.label}: {self.done}/{self.total if self.total is not None else '?'}"
+        if self.item:
+            text += f" ({self.item})"
+        if self.done:
+            text += f", {self.rate * 60:.1f} items/min"
+        if self.eta is not None:
+            text += f", ETA {int(self.eta // 60)}:{int(self.eta % 60):02d}"
+        return text
+
+
+class BackgroundJobRunner:
+    """
+    Runs one job at a time on a worker thread and hands its progress and outcome back through a thread-safe queue.
+
+    The job function is called with a `progress(done, total, item)` keyword argument, which it calls after every
+    finished item. Calling it after `cancel()` raises `JobCancelled` inside the job. The owner of the runner (e.g. the
+    Tk main loop) calls `poll()` regularly; the `on_progress`, `on_success`, `on_error` and `on_cancelled` callbacks
+    of a job are only ever invoked from `poll()`, so they may safely touch GUI widgets.
+    """
+
+    def __init__(self):
+        self._events = queue.Queue()
+        self._cancel_event = threading.Event()
+        self._thread = None
+
+    @property
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, label, function, *args, on_progress=None, on_success=None, on_error=None, on_cancelled=None,
+               **kwargs):
+        """
+        Starts `function(*args, progress=..., **kwargs)` on a worker thread.
+
+        :raises RuntimeError: If another job is still running.
+        """
+        if self.busy:
+            raise RuntimeError("Another job is still running.")
+        self._cancel_event.clear()
+        job = {'progress': JobProgress(label), 'on_progress': on_progress, 'on_success': on_success,
+               'on_error': on_error, 'on_cancelled': on_cancelled}
+        self._thread = threading.Thread(target=self._run, args=(job, function, args, kwargs), daemon=True)
+        self._thread.start()
+        return job['progress']
+
+    def cancel(self):
+        """Asks the running job to stop at its next progress report."""
+        self._cancel_event.set()
+
+    def poll(self):
+        """Dispatches all queued events to the job callbacks and returns how many were handled."""
+        handled = 0
+        while True:
+            try:
+                kind, job, payload = self._events.get_nowait()
+            except queue.Empty:
+                return handled
+            callback = job[f"on_{kind}"]
+            if callback is not None:
+                callback(payload)
+            handled += 1
+
+    def _run(self, job, function, args, kwargs):
+        progress = job['progress']
+        lock = threading.Lock()
+
+        def report(done, total, item=None):
+            if self._cancel_event.is_set():
+                raise JobCancelled(f"{progress.label} was cancelled.")
+            with lock:
+                progress.done, progress.total, progress.item = done, total, item
+            self._events.put(('progress', job, progress))
+
+        try:
+            result = function(*args, progress=report, **kwargs)
+        except JobCancelled:
+            self._events.put(('cancelled', job, progress))
+        except Exception as e:
+            self._events.put(('error', job, e))
+        else:
+            self._events.put(('success', job, result))
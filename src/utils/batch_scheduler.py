@@ -0,0 +1,393 @@
+import math
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from rasterio.crs import CRS as rasterio_CRS
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from src.utils.download_manifest import DownloadManifest
+from src.utils.gis_helpers import get_default_output_profile, open_raster_for_write, save_metadata
+from src.utils.helper_functions import normalize_to_weeks
+from src.utils.raster_storage import encoding_of, set_encoding
+from src.utils.resampling import KERNELS, SENTINEL3_NATIVE_RESOLUTION, coarse_grid, write_upsampled
+from src.utils.sentinel_data import FUSED_BAND_SLICES, host_semaphore, select_bands
+from src.utils.tiling import MAX_TILE_PIXELS, tile_grid
+
+class BatchScheduler:
+    """
+    Downloads the Sentinel data of many AOIs in one batch, sharing one `SentinelData` (authentication, caches) and one
+    worker pool between them.
+
+    Catalog searches are deduplicated: AOIs with the same bounding box, CRS and filter are searched once over the
+    union of their date ranges. AOIs whose bounding boxes overlap (same CRS and resolution) are downloaded as tiles of
+    a fixed grid anchored at the CRS origin, so a tile below several AOIs is requested once per date and written into
+    each of their rasters. AOIs that overlap no other AOI are downloaded on their own pixel grid, split only if they
+    exceed `max_tile_pixels`. All AOIs are snapped outwards to whole pixels of their resolution, so tiles mosaic
+    without resampling. With `fused`, the Sentinel-2 and Sentinel-3 rasters of a day are cut from the tiles of one
+    data fusion request instead of two requests. With `sentinel3_resolution`, Sentinel-3 is requested once per AOI and
+    day on a coarse grid and upsampled locally onto the AOI grid.
+
+    Tile requests are scheduled round-robin over the AOIs, so every AOI makes progress instead of waiting for the
+    ones submitted before it. Downloaded tiles are kept as `.npy` files in a work directory until every raster using
+    them has been written. Written rasters are recorded in the `DownloadManifest` of their AOI directory, so a rerun
+    after an interruption only downloads the rasters that are missing.
+    """
+
+    def __init__(self, sentinel_data, max_workers=4, max_requests_per_host=4, grid_tile_pixels=512,
+                 max_tile_pixels=MAX_TILE_PIXELS, work_dir=None, resume=True, fused=False, sentinel3_resolution=None,
+                 sentinel3_kernel='bilinear'):
+        """
+        :param sentinel_data: `SentinelData` used for all searches and downloads.
+        :param max_workers: Number of tile requests run in parallel.
+        :param max_requests_per_host: Upper bound of requests in flight against the Sentinel Hub host, shared by all
+            downloads of this process.
+        :param grid_tile_pixels: Width and height in pixels of the shared tiles of overlapping AOIs.
+        :param max_tile_pixels: AOIs overlapping no other AOI and larger than this are downloaded as tiles.
+        :param work_dir: Directory for the downloaded tiles, a temporary directory by default.
+        :param resume: Skip the rasters the download manifests record as complete.
+        :param fused: Download the daily Sentinel-2 and Sentinel-3 rasters with one data fusion request per tile,
+            see `SentinelData.download_s2_s3_fused_data`.
+        :param sentinel3_resolution: Download Sentinel-3 at this coarser resolution, or `'native'`, and upsample it
+            locally, see `SentinelData.download_s2_s3_data_pack`.
+        :param sentinel3_kernel: Kernel upsampling the coarse Sentinel-3 rasters, one of `resampling.KERNELS`.
+        """
+        if sentinel3_resolution is not None and fused:
+            raise ValueError("Fused downloads return Sentinel-3 on the Sentinel-2 grid, they cannot be combined with "
+                             "a coarse sentinel3_resolution")
+        if sentinel3_kernel not in KERNELS:
+            raise ValueError(f"Unknown resampling kernel '{sentinel3_kernel}', expected one of {KERNELS}")
+        self.sentinel_data = sentinel_data
+        self.max_workers = max_workers
+        self.max_requests_per_host = max_requests_per_host
+        self.grid_tile_pixels = grid_tile_pixels
+        self.max_tile_pixels = max_tile_pixels
+        self.work_dir = work_dir
+        self.resume = resume
+        self.fused = fused
+        self.sentinel3_resolution = (SENTINEL3_NATIVE_RESOLUTION if sentinel3_resolution == 'native'
+                                     else sentinel3_resolution)
+        self.sentinel3_kernel = sentinel3_kernel
+        self.aois = {}
+        self.stats = {}
+        self._searches = {}
+
+    def add_aoi(self, name, bbox_coordinates, crs, date_range, resolution, out_dir, filter='eo:cloud_cover < 50',
+                daily=True, weekly=False):
+        """
+        Adds an AOI to the batch.
+
+        :param daily: Download Sentinel-2 and Sentinel-3 rasters for every day both have data, as
+            `SentinelData.download_s2_s3_data_pack` does.
+        :param weekly: Download weekly Sentinel-2 rasters, as `SentinelData.download_s2_data_weekly` does.
+        """
+        if name in self.aois:
+            raise ValueError(f"AOI '{name}' was added twice")
+        min_x, min_y, max_x, max_y = (float(c) for c in bbox_coordinates)
+        # Snap outwards to whole pixels, so all AOIs of a CRS and resolution share one pixel grid
+        min_x, min_y = math.floor(min_x / resolution) * resolution, math.floor(min_y / resolution) * resolution
+        max_x, max_y = math.ceil(max_x / resolution) * resolution, math.ceil(max_y / resolution) * resolution
+        self.aois[name] = {
+            'name': name, 'bbox': (min_x, min_y, max_x, max_y), 'crs': int(crs), 'resolution': resolution,
+            'date_range': tuple(str(date)[:10] for date in date_range), 'out_dir': out_dir, 'filter': filter,
+            'daily': daily, 'weekly': weekly,
+            'width': round((max_x - min_x) / resolution), 'height': round((max_y - min_y) / resolution),
+            'transform': from_origin(min_x, max_y, resolution, resolution),
+        }
+
+    def run(self, progress=None):
+        """
+        Searches, downloads and writes the rasters of all AOIs.
+
+        A failing request fails only the AOIs that need it, the other AOIs are completed.
+
+        :param progress: Optional `progress(done, total, item)` callback, called after every written raster with
+            `item` being `<aoi name>/<file name>`.
+        :return: Dictionary of AOI name to `{'status', 'seconds', 'outputs'}` and, for failed AOIs, `'error'`.
+        """
+        start = time.perf_counter()
+        results = {name: {'status': 'ok', 'seconds': 0.0, 'outputs': []} for name in self.aois}
+
+        products = []
+        for aoi in self.aois.values():
+            try:
+                products.extend(self._products(aoi))
+            except Exception as e:
+                self._fail(results[aoi['name']], e)
+        products = [product for product in products if results[product['aoi']['name']]['status'] == 'ok']
+        manifests = {aoi['out_dir']: DownloadManifest(aoi['out_dir']) for aoi in self.aois.values()}
+        remaining = []
+        for product in products:
+            product['manifest'] = manifests[product['aoi']['out_dir']]
+            if self.resume and product['manifest'].is_complete(product['output_path'], product['request_hash']):
+                results[product['aoi']['name']]['outputs'].append(product['output_path'])
+            else:
+                remaining.append(product)
+        self.stats['skipped_products'] = len(products) - len(remaining)
+        products = remaining
+        requests = self._plan_requests(products)
+
+        work_dir = self.work_dir or tempfile.mkdtemp(prefix='hotspot-batch-')
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            self._download(products, requests, results, work_dir, start, progress)
+        finally:
+            if self.work_dir is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        self.stats['seconds'] = round(time.perf_counter() - start, 3)
+        return results
+
+    def _products(self, aoi):
+        """Returns the rasters to write for an AOI, one per product and date range."""
+        sentinel2_dir = os.path.join(aoi['out_dir'], "Sentinel-2")
+        products = []
+        if aoi['daily']:
+            for day in self._common_dates(aoi):
+                day_range = (day + 'T00:00:00Z', day + 'T23:59:59.9Z')
+                products.append(self._product(aoi, 'sentinel-2', day_range,
+                                              os.path.join(sentinel2_dir, f"s2_{day}.tiff"), self.fused))
+                products.append(self._product(aoi, 'sentinel-3', day_range,
+                                              os.path.join(aoi['out_dir'], "Sentinel-3", f"s3_{day}.tiff"),
+                                              self.fused))
+        if aoi['weekly']:
+            for week in normalize_to_weeks(aoi['date_range']):
+                products.append(self._product(aoi, 'sentinel-2', week, os.path.join(
+                    aoi['out_dir'], "Sentinel-2-weeks", f"s2_{week[0]}-{week[1]}.tiff")))
+        return products
+
+    def _product(self, aoi, collection, date_range, output_path, fused=False):
+        coarse = collection == 'sentinel-3' and self.sentinel3_resolution is not None
+        request_params = {}
+        if coarse:
+            request_params = {'upsampled_from': self.sentinel3_resolution, 'kernel': self.sentinel3_kernel}
+        if self.sentinel_data.storage != 'float32':
+            request_params['storage'] = self.sentinel_data.storage
+        request_hash = DownloadManifest.request_hash(
+            product=collection, bbox=aoi['bbox'], crs=aoi['crs'], time_interval=date_range,
+            resolution=aoi['resolution'], service_url=self.sentinel_data.config.sh_base_url,
+            output_profile=self.sentinel_data.output_profile or get_default_output_profile(), **request_params)
+        # Fused products request the tiles of both collections and keep their own bands of them
+        source = 'sentinel-2+3' if fused else 'sentinel-3-coarse' if coarse else collection
+        return {'aoi': aoi, 'collection': collection, 'date_range': date_range, 'output_path': output_path,
+                'request_hash': request_hash, 'requests': [], 'pending': set(), 'source': source,
+                'bands': FUSED_BAND_SLICES[collection] if fused else None}
+
+    def _common_dates(self, aoi):
+        """Dates on which both collections have data for the AOI, searched once per bbox, CRS and filter."""
+        searches = self._searches
+        key = (aoi['bbox'], aoi['crs'], aoi['filter'])
+        if key not in searches:
+            # One search over the union of the date ranges of all AOIs with this bbox
+            same_bbox = [other['date_range'] for other in self.aois.values()
+                         if other['daily'] and (other['bbox'], other['crs'], other['filter']) == key]
+            date_range = (min(start for start, _ in same_bbox), max(end for _, end in same_bbox))
+            searches[key] = self.sentinel_data.search_data(list(aoi['bbox']), aoi['crs'], date_range,
+                                                           filter=aoi['filter'])['common_dates']
+        start, end = aoi['date_range']
+        return [day for day in searches[key] if start <= day <= end]
+
+    def _plan_requests(self, products):
+        """
+        Assigns every product its tile requests and returns the unique requests, keyed by collection, date range and
+        tile bbox.
+        """
+        groups = _overlap_groups(list({product['aoi']['name']: product['aoi'] for product in products}.values()))
+        tiles = {}
+        for aoi in self.aois.values():
+            if len(groups.get(aoi['name'], ())) > 1:
+                tiles[aoi['name']] = self._grid_tiles(aoi)
+            else:
+                tiles[aoi['name']] = [
+                    (tuple(float(c) for c in tile_bbox), (int(window.width), int(window.height)))
+                    for window, tile_bbox in tile_grid(aoi['width'], aoi['height'], aoi['transform'],
+                                                       self.max_tile_pixels)]
+
+        requests = {}
+        for product in products:
+            aoi = product['aoi']
+            resolution, product_tiles = aoi['resolution'], tiles[aoi['name']]
+            if product['source'] == 'sentinel-3-coarse':
+                # A single request on the coarse grid, a 1 km raster of even a large AOI is small
+                resolution = self.sentinel3_resolution
+                coarse_bbox, coarse_size = coarse_grid(aoi['bbox'], resolution)
+                product_tiles = [(tuple(float(c) for c in coarse_bbox), coarse_size)]
+            for tile_bbox, size in product_tiles:
+                key = (product['source'], tuple(product['date_range']), aoi['crs'], resolution, tile_bbox)
+                requests.setdefault(key, {'key': key, 'bbox': tile_bbox, 'size': size, 'consumers': []})
+                requests[key]['consumers'].append(product)
+                product['requests'].append(key)
+                product['pending'].add(key)
+
+        self.stats.update({
+            'search_requests': len(self._searches),
+            'tile_requests': sum(len(product['requests']) for product in products),
+            'unique_tile_requests': len(requests),
+        })
+        return requests
+
+    def _grid_tiles(self, aoi):
+        """Tiles of the shared grid anchored at the CRS origin that intersect the AOI."""
+        span = self.grid_tile_pixels * aoi['resolution']
+        min_x, min_y, max_x, max_y = aoi['bbox']
+        tiles = []
+        for row in range(math.floor(max_y / span), math.floor(min_y / span) - 1, -1):
+            if row * span >= max_y:
+                continue
+            for col in range(math.floor(min_x / span), math.ceil(max_x / span)):
+                tile_bbox = (col * span, row * span, (col + 1) * span, (row + 1) * span)
+                tiles.append((tuple(float(c) for c in tile_bbox), (self.grid_tile_pixels, self.grid_tile_pixels)))
+        return tiles
+
+    def _download(self, products, requests, results, work_dir, start, progress):
+        semaphore = host_semaphore(self.sentinel_data.config.sh_base_url, self.max_requests_per_host)
+        download_functions = {'sentinel-2': self.sentinel_data.download_sentinel2_data,
+                              'sentinel-3': self.sentinel_data.download_sentinel3_data,
+                              'sentinel-2+3': self.sentinel_data.download_s2_s3_fused_data,
+                              'sentinel-3-coarse': self.sentinel_data.download_sentinel3_data}
+
+        def download(request, path):
+            collection, date_range, crs = request['key'][:3]
+            with semaphore:
+                array = download_functions[collection](list(request['bbox']), crs, date_range, None,
+                                                       size=request['size'])
+            np.save(path, array)
+            return path
+
+        # One queue of requests per AOI, drained round-robin so every AOI advances at the same pace
+        queues = deque()
+        for name in self.aois:
+            keys = list(dict.fromkeys(key for product in products if product['aoi']['name'] == name
+                                      for key in product['requests']))
+            if keys:
+                queues.append((name, deque(keys)))
+        scheduled = set()
+        done_products, total_products = 0, len(products)
+
+        def next_request():
+            while queues:
+                name, keys = queues.popleft()
+                while keys and (keys[0] in scheduled or results[name]['status'] != 'ok'):
+                    keys.popleft()
+                if keys:
+                    key = keys.popleft()
+                    queues.append((name, keys))
+                    scheduled.add(key)
+                    return key
+            return None
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            in_flight = {}
+            while True:
+                while len(in_flight) < 2 * self.max_workers:
+                    key = next_request()
+                    if key is None:
+                        break
+                    path = os.path.join(work_dir, f"{len(scheduled)}.npy")
+                    in_flight[executor.submit(download, requests[key], path)] = key
+                if not in_flight:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    request = requests[in_flight.pop(future)]
+                    try:
+                        request['path'] = future.result()
+                    except Exception as e:
+                        for product in request['consumers']:
+                            self._fail(results[product['aoi']['name']], e)
+                        continue
+                    # Rasters are written from this thread, which is the only one opening output datasets
+                    for product in request['consumers']:
+                        product['pending'].discard(request['key'])
+                        result = results[product['aoi']['name']]
+                        if product['pending'] or result['status'] != 'ok':
+                            continue
+                        try:
+                            self._write_product(product, requests)
+                            product['manifest'].record(product['output_path'], product['request_hash'])
+                        except Exception as e:
+                            self._fail(result, e)
+                            continue
+                        result['outputs'].append(product['output_path'])
+                        result['seconds'] = round(time.perf_counter() - start, 3)
+                        done_products += 1
+                        if progress is not None:
+                            progress(done_products, total_products,
+                                     f"{product['aoi']['name']}/{os.path.basename(product['output_path'])}")
+                        self._release(product, requests)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _write_product(self, product, requests):
+        """Mosaics the downloaded tiles of a product into the AOI's window of each of them."""
+        aoi = product['aoi']
+        os.makedirs(os.path.dirname(product['output_path']), exist_ok=True)
+        if product['source'] == 'sentinel-3-coarse':
+            request = requests[product['requests'][0]]
+            write_upsampled(np.load(request['path']), request['bbox'], aoi['bbox'], (aoi['width'], aoi['height']),
+                            aoi['crs'], product['output_path'], self.sentinel_data.bands_metadata('sentinel-3'),
+                            self.sentinel3_kernel, self.sentinel_data.output_profile)
+            return
+        first_tile = select_bands(np.load(requests[product['requests'][0]]['path'], mmap_mode='r'), product['bands'])
+        bands_metadata = self.sentinel_data.bands_metadata(product['collection'])
+        with open_raster_for_write(product['output_path'], self.sentinel_data.output_profile, width=aoi['width'],
+                                   height=aoi['height'], count=first_tile.shape[2], dtype=first_tile.dtype,
+                                   crs=rasterio_CRS.from_epsg(aoi['crs']), transform=aoi['transform'],
+                                   tiled=True, blockxsize=256, blockysize=256) as dst:
+            set_encoding(dst, encoding_of(bands_metadata))
+            min_x, _, _, max_y = aoi['bbox']
+            for key in product['requests']:
+                request = requests[key]
+                tile = select_bands(np.load(request['path'], mmap_mode='r'), product['bands'])
+                col = round((request['bbox'][0] - min_x) / aoi['resolution'])
+                row = round((max_y - request['bbox'][3]) / aoi['resolution'])
+                # Part of the tile inside the AOI
+                col_start, row_start = max(0, -col), max(0, -row)
+                col_stop = min(tile.shape[1], aoi['width'] - col)
+                row_stop = min(tile.shape[0], aoi['height'] - row)
+                if col_start >= col_stop or row_start >= row_stop:
+                    continue
+                window = Window(col + col_start, row + row_start, col_stop - col_start, row_stop - row_start)
+                dst.write(np.moveaxis(tile[row_start:row_stop, col_start:col_stop], -1, 0), window=window)
+        save_metadata(product['output_path'], bands_metadata)
+
+    @staticmethod
+    def _release(product, requests):
+        """Deletes the tiles no other unwritten product needs."""
+        for key in product['requests']:
+            request = requests[key]
+            request['consumers'] = [consumer for consumer in request['consumers'] if consumer is not product]
+            if not request['consumers'] and os.path.exists(request.get('path', '')):
+                os.remove(request['path'])
+
+    @staticmethod
+    def _fail(result, error):
+        if result['status'] == 'ok':
+            result['status'] = 'failed'
+            result['error'] = f"{type(error).__name__}: {error}"
+            print(f"Batch download failed: {result['error']}")
+
+
+def _overlap_groups(aois):
+    """Returns a dictionary of AOI name to the set of names of all AOIs it transitively overlaps, itself included."""
+    groups = {aoi['name']: {aoi['name']} for aoi in aois}
+    for index, aoi in enumerate(aois):
+        for other in aois[index + 1:]:
+            if (aoi['crs'], aoi['resolution']) != (other['crs'], other['resolution']):
+                continue
+            if _intersects(aoi['bbox'], other['bbox']) and groups[aoi['name']] is not groups[other['name']]:
+                merged = groups[aoi['name']] | groups[other['name']]
+                for name in merged:
+                    groups[name] = merged
+    return groups
+
+
+def _intersects(bbox, other):
+    return bbox[0] < other[2] and other[0] < bbox[2] and bbox[1] < other[3] and other[1] < bbox[3]
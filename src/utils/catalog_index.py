@@ -0,0 +1,112 @@
+import datetime
+import sqlite3
+import threading
+
+
+class CatalogIndex:
+    """
+    Local SQLite index of catalog search results, per collection, AOI and filter.
+
+    It remembers which day spans have already been searched and on which days items were found, so repeated or
+    overlapping searches only need to query the catalog for the days that were never searched. Days that are less
+    than `settle_days` old are never marked as searched, because the catalog may still ingest new items for them.
+    """
+
+    def __init__(self, db_path, settle_days=2):
+        """
+        :param db_path: Path of the SQLite database file (created if missing).
+        :param settle_days: Number of most recent days that are always searched again.
+        """
+        self.db_path = db_path
+        self.settle_days = settle_days
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS searched_spans "
+                "(collection TEXT, aoi TEXT, filter TEXT, start_date TEXT, end_date TEXT)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS item_dates "
+                "(collection TEXT, aoi TEXT, filter TEXT, date TEXT, PRIMARY KEY (collection, aoi, filter, date))")
+
+    @staticmethod
+    def aoi_key(bbox_coordinates, crs):
+        """Returns a stable key for an AOI, rounded to centimetres so float noise does not split the index."""
+        return f"{crs}:" + ",".join(f"{float(coordinate):.2f}" for coordinate in bbox_coordinates)
+
+    def missing_spans(self, collection, aoi, filter, start_date, end_date):
+        """
+        Returns the list of `(start, end)` ISO date pairs (inclusive) within the given range that were never searched.
+        """
+        start, end = _to_date(start_date), _to_date(end_date)
+        with self._lock:
+            spans = self._spans(collection, aoi, filter)
+        missing = []
+        cursor = start
+        for span_start, span_end in spans:
+            if span_end < cursor:
+                continue
+            if span_start > end:
+                break
+            if span_start > cursor:
+                missing.append((cursor, min(end, span_start - datetime.timedelta(days=1))))
+            cursor = max(cursor, span_end + datetime.timedelta(days=1))
+            if cursor > end:
+                break
+        if cursor <= end:
+            missing.append((cursor, end))
+        return [(span_start.isoformat(), span_end.isoformat()) for span_start, span_end in missing]
+
+    def record(self, collection, aoi, filter, start_date, end_date, dates):
+        """Stores the dates found by a catalog search over the given span and marks the settled part as searched."""
+        start, end = _to_date(start_date), _to_date(end_date)
+        settled_end = min(end, datetime.date.today() - datetime.timedelta(days=self.settle_days))
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO item_dates VALUES (?, ?, ?, ?)",
+                [(collection, aoi, filter, date[:10]) for date in dates])
+            if settled_end < start:
+                return
+            spans = self._spans(collection, aoi, filter) + [(start, settled_end)]
+            self._connection.execute(
+                "DELETE FROM searched_spans WHERE collection = ? AND aoi = ? AND filter = ?",
+                (collection, aoi, filter))
+            self._connection.executemany(
+                "INSERT INTO searched_spans VALUES (?, ?, ?, ?, ?)",
+                [(collection, aoi, filter, span_start.isoformat(), span_end.isoformat())
+                 for span_start, span_end in _merge_spans(spans)])
+
+    def dates(self, collection, aoi, filter, start_date, end_date):
+        """Returns the set of ISO dates with items in the given range, answered from the index only."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT date FROM item_dates WHERE collection = ? AND aoi = ? AND filter = ? AND date BETWEEN ? AND ?",
+                (collection, aoi, filter, _to_date(start_date).isoformat(), _to_date(end_date).isoformat()))
+            return {row[0] for row in rows}
+
+    def close(self):
+        self._connection.close()
+
+    def _spans(self, collection, aoi, filter):
+        rows = self._connection.execute(
+            "SELECT start_date, end_date FROM searched_spans WHERE collection = ? AND aoi = ? AND filter = ? "
+            "ORDER BY start_date", (collection, aoi, filter))
+        return [(_to_date(span_start), _to_date(span_end)) for span_start, span_end in rows]
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def _merge_spans(spans):
+    merged = []
+    for span_start, span_end in sorted(spans):
+        if merged and span_start <= merged[-1][1] + datetime.timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+        else:
+            merged.append((span_start, span_end))
+    return merged
@@ -1,26 +1,40 @@
+import os
+
 from sentinelhub import SHConfig
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
-from src.utils.sentinel_secrets import client_name, client_secret
+from sentinelhub.download.sentinelhub_client import SentinelHubDownloadClient
+from src.utils.token_manager import CDSE_TOKEN_URL, get_token_manager
+
+CDSE_BASE_URL = 'https://sh.dataspace.copernicus.eu'
+
 
+def _default_credentials():
+    # Imported on first use, so importing this module does not require the secrets file
+    from src.utils.sentinel_secrets import client_name, client_secret
+    return client_name, client_secret
 
-def authenticate_session():
-    client_id = client_name
 
-    client = BackendApplicationClient(client_id=client_id)
-    oauth = OAuth2Session(client=client)
+def service_urls(base_url=None, token_url=None):
+    """
+    Returns the `(base_url, token_url)` of the Sentinel Hub service: the given URLs, else the `HOTSPOT_SH_BASE_URL`
+    and `HOTSPOT_SH_TOKEN_URL` environment variables, else CDSE. Used e.g. to target `MockSentinelHub`.
+    """
+    return (base_url or os.environ.get('HOTSPOT_SH_BASE_URL') or CDSE_BASE_URL,
+            token_url or os.environ.get('HOTSPOT_SH_TOKEN_URL') or CDSE_TOKEN_URL)
 
-    # Fetch token
-    token = oauth.fetch_token(
-        token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-        client_secret=client_secret,
-        include_client_id=True
-    )
 
-    return oauth, token
+def authenticate_session(client_id=None, secret=None, token_cache_dir=None, token_url=None):
+    """
+    Returns an OAuth session and its token. The token comes from the shared token manager, so repeated calls only
+    reach the identity service once the cached token is about to expire. Credentials default to `sentinel_secrets`.
+    """
+    if client_id is None or secret is None:
+        client_id, secret = _default_credentials()
+    token_manager = get_token_manager(client_id, secret, service_urls(token_url=token_url)[1],
+                                      cache_dir=token_cache_dir)
+    return token_manager.oauth_session(), token_manager.get_token()
 
 
-def load_config(api_keys=False):
+def load_config(api_keys=False, token_cache_dir=None, base_url=None, token_url=None):
     config = SHConfig()
 
     # Add your Sentinel Hub API credentials
@@ -28,12 +42,15 @@ def load_config(api_keys=False):
         config.sh_client_id = api_keys['client_name']
         config.sh_client_secret = api_keys['client_secret']
     else:
-        config.sh_client_id = client_name
-        config.sh_client_secret = client_secret
-    config.sh_base_url = 'https://sh.dataspace.copernicus.eu'
-    config.sh_token_url = 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token'
-    # Get the OAuth2 token
-    oauth, token = authenticate_session()
+        config.sh_client_id, config.sh_client_secret = _default_credentials()
+    config.sh_base_url, config.sh_token_url = service_urls(base_url, token_url)
+    # Get the OAuth2 token from the shared cache
+    token_manager = get_token_manager(config.sh_client_id, config.sh_client_secret, config.sh_token_url,
+                                      cache_dir=token_cache_dir)
+    token = token_manager.get_token()
+
+    # Let sentinelhub requests reuse the cached token instead of authenticating on their own
+    SentinelHubDownloadClient.cache_session(token_manager.sentinelhub_session(config))
 
     # Set the access token in the configuration
     config.instance_id = None  # If no instance ID is used
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from src.utils.helper_functions import canonical_hash
+
+
+class DownloadCache:
+    """
+    Size-bounded on-disk cache of Process API responses, addressed by a hash of the full request.
+
+    Entries are stored as `.npy` files next to an `index.json` that records their size, last access time and
+    whether they are pinned. When the cache grows beyond `max_bytes` the least recently used unpinned entries are
+    evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=5 * 1024 ** 3):
+        """
+        :param cache_dir: Directory holding the cached arrays and the index.
+        :param max_bytes: Upper bound for the summed size of all unpinned entries.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        self._index = self._load_index()
+
+    @staticmethod
+    def make_key(**request_params):
+        """
+        Returns the content address for a request, e.g. from bbox, crs, time interval, evalscript, collection,
+        mosaicking order and resolution. Parameter order does not matter.
+        """
+        return canonical_hash(**request_params)
+
+    def get(self, key):
+        """
+        Returns the cached array for `key` or `None` on a miss.
+
+        The access time is only updated in memory and written with the next change of the index (`put`, eviction,
+        pinning), so hits do not rewrite the index.
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            path = self._entry_path(key)
+            if entry is None or not os.path.exists(path):
+                self._index.pop(key, None)
+                self.misses += 1
+                return None
+            entry['last_access'] = time.time()
+        try:
+            # Loaded outside the lock, a concurrent `put` may evict the entry in the meantime
+            array = np.load(path)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, key, array, pinned=False):
+        """Stores `array` under `key` and evicts least recently used entries if the cache is over its size."""
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with open(tmp_path, 'wb') as cache_file:
+            np.save(cache_file, array)
+        os.replace(tmp_path, path)
+        with self._lock:
+            previous = self._index.get(key, {})
+            self._index[key] = {
+                'size': os.path.getsize(path),
+                'last_access': time.time(),
+                'pinned': pinned or previous.get('pinned', False),
+            }
+            self._evict()
+            self._save_index()
+
+    def pin(self, key):
+        """Protects an existing entry from eviction."""
+        self._set_pinned(key, True)
+
+    def unpin(self, key):
+        self._set_pinned(key, False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._index),
+                'bytes': sum(entry['size'] for entry in self._index.values()),
+                'pinned': sum(1 for entry in self._index.values() if entry['pinned']),
+            }
+
+    def clear(self, include_pinned=False):
+        with self._lock:
+            for key in list(self._index):
+                if include_pinned or not self._index[key]['pinned']:
+                    self._remove(key)
+            self._save_index()
+
+    def _set_pinned(self, key, pinned):
+        with self._lock:
+            if key not in self._index:
+                raise KeyError(f"No cache entry for key {key}")
+            self._index[key]['pinned'] = pinned
+            self._save_index()
+
+    def _evict(self):
+        unpinned = [(entry['last_access'], key) for key, entry in self._index.items() if not entry['pinned']]
+        total = sum(self._index[key]['size'] for _, key in unpinned)
+        for _, key in sorted(unpinned):
+            if total <= self.max_bytes:
+                break
+            total -= self._index[key]['size']
+            self._remove(key)
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        path = self._entry_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return {}
+        try:
+            with open(self._index_path) as index_file:
+                return json.load(index_file)
+        except ValueError:
+            print(f"Ignoring unreadable cache index {self._index_path}")
+            return {}
+
+    def _save_index(self):
+        tmp_path = f"{self._index_path}.part"
+        with open(tmp_path, 'w') as index_file:
+            json.dump(self._index, index_file)
+        os.replace(tmp_path, self._index_path)
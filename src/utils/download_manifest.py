@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+import time
+
+from src.utils.helper_functions import canonical_hash, file_sha256
+
+MANIFEST_NAME = 'download_manifest.json'
+
+
+class DownloadManifest:
+    """
+    Record of the completed downloads of an output directory, so an interrupted download job can be resumed.
+
+    Each product is stored under its path relative to the directory with the hash of the request that produced it,
+    its size in bytes and its SHA-256 checksum. A product counts as complete only if the request hash matches and the
+    file on disk still has the recorded size and checksum, so missing, truncated or otherwise corrupt files and files
+    downloaded with other parameters are downloaded again. The manifest is rewritten through a temporary file after
+    every recorded product, so a crash loses at most the products in flight.
+    """
+
+    def __init__(self, out_dir, verify_checksums=True):
+        """
+        :param out_dir: Output directory of the download job; the manifest is stored in it.
+        :param verify_checksums: Compare the checksum of existing files, not only their size, before skipping them.
+        """
+        self.out_dir = out_dir
+        self.verify_checksums = verify_checksums
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    @staticmethod
+    def request_hash(**request_params):
+        """Returns a stable hash of everything that determines a product, e.g. bbox, CRS, dates and resolution."""
+        return canonical_hash(**request_params)
+
+    def is_complete(self, output_path, request_hash):
+        """Returns whether `output_path` was completely downloaded by the request with `request_hash`."""
+        with self._lock:
+            entry = self._entries.get(self._key(output_path))
+        if entry is None or entry['request_hash'] != request_hash:
+            return False
+        try:
+            if os.path.getsize(output_path) != entry['size']:
+                return False
+        except OSError:
+            return False
+        return not self.verify_checksums or file_sha256(output_path) == entry['sha256']
+
+    def record(self, output_path, request_hash):
+        """Marks `output_path` as completely downloaded by the request with `request_hash`."""
+        entry = {'request_hash': request_hash, 'size': os.path.getsize(output_path),
+                 'sha256': file_sha256(output_path), 'completed_at': time.time()}
+        with self._lock:
+            self._entries[self._key(output_path)] = entry
+            self._save()
+
+    def forget(self, output_path):
+        with self._lock:
+            if self._entries.pop(self._key(output_path), None) is not None:
+                self._save()
+
+    def _key(self, output_path):
+        return os.path.relpath(os.path.abspath(output_path), os.path.abspath(self.out_dir)).replace(os.sep, '/')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as manifest_file:
+                return json.load(manifest_file)
+        except ValueError:
+            print(f"Ignoring unreadable download manifest {self.path}")
+            return {}
+
+    def _save(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        tmp_path = f"{self.path}.part"
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(self._entries, manifest_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def remove_partial_files(output_path):
+    """Removes the temporary files an interrupted write of `output_path` can leave behind."""
+    for partial_path in (f"{output_path}.part", f"{output_path}.part.tif"):
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
@@ -1,24 +1,136 @@
 #import geopandas as gpd
 import json
-from matplotlib import pyplot as plt
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
 from rasterio.crs import CRS as rasterio_CRS
+from rasterio.windows import Window
 from pyproj import Transformer
-from scipy.ndimage import gaussian_filter
 
+from src.utils.raster_storage import dataset_encoding, encode, encoding_of, read_unscaled, set_encoding
 
-def save_tiff_and_metadata(array_data, transform, crs_epsg, output_path, bands_metadata):
+
+# Creation options of the supported output profiles. "gtiff" writes plain GeoTIFFs, the "cog" profiles write
+# internally tiled, compressed Cloud-Optimized GeoTIFFs with overviews.
+OUTPUT_PROFILES = {
+    'gtiff': None,
+    'cog': {'compress': 'DEFLATE', 'predictor': 'YES', 'blocksize': 512, 'overviews': 'AUTO',
+            'overview_resampling': 'AVERAGE', 'bigtiff': 'IF_SAFER'},
+    'cog-zstd': {'compress': 'ZSTD', 'level': 9, 'predictor': 'YES', 'blocksize': 512, 'overviews': 'AUTO',
+                 'overview_resampling': 'AVERAGE', 'bigtiff': 'IF_SAFER'},
+}
+_default_output_profile = 'gtiff'
+
+
+def set_default_output_profile(output_profile):
+    """
+    Sets the output profile used by all raster writers that are not given an explicit `output_profile`.
+
+    :param output_profile: One of the keys of `OUTPUT_PROFILES`.
+    """
+    global _default_output_profile
+    if output_profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile '{output_profile}', expected one of {list(OUTPUT_PROFILES)}")
+    _default_output_profile = output_profile
+
+
+def get_default_output_profile():
+    """Returns the output profile used by raster writers that are not given an explicit `output_profile`."""
+    return _default_output_profile
+
+
+@contextmanager
+def open_raster_for_write(output_path, output_profile=None, **meta):
+    """
+    Opens a GeoTIFF for writing and moves it into place only once it is complete.
+
+    The dataset is written under a temporary name. With a COG profile it is written as a tiled GeoTIFF first and
+    then converted into a compressed Cloud-Optimized GeoTIFF with overviews. If the block raises, the temporary
+    files are removed and `output_path` is left untouched.
+
+    :param output_path: Final path of the raster.
+    :param output_profile: Key of `OUTPUT_PROFILES`, defaults to the profile set by `set_default_output_profile`.
+    :param meta: Rasterio dataset metadata (width, height, count, dtype, crs, transform, ...).
+    """
+    output_profile = output_profile or _default_output_profile
+    if output_profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile '{output_profile}', expected one of {list(OUTPUT_PROFILES)}")
+    cog_options = OUTPUT_PROFILES[output_profile]
+
+    tmp_output_path = f"{output_path}.part"
+    meta = dict(meta, driver='GTiff')
+    if cog_options is not None:
+        # Intermediate file: tiled and lightly compressed, so large rasters can be written window by window
+        tmp_output_path = f"{output_path}.part.tif"
+        for key in ('compress', 'predictor', 'zstd_level', 'zlevel', 'interleave', 'blockxsize', 'blockysize'):
+            meta.pop(key, None)
+        meta.update(tiled=True, blockxsize=cog_options['blocksize'], blockysize=cog_options['blocksize'],
+                    compress='ZSTD', zstd_level=1, bigtiff='IF_SAFER')
+
+    try:
+        with rasterio.open(tmp_output_path, 'w', **meta) as dst:
+            yield dst
+        if cog_options is not None:
+            cog_path = f"{output_path}.part"
+            rasterio_shutil.copy(tmp_output_path, cog_path, driver='COG',
+                                 **{key.upper(): value for key, value in cog_options.items()})
+            os.remove(tmp_output_path)
+            tmp_output_path = cog_path
+        os.replace(tmp_output_path, output_path)
+    finally:
+        for leftover_path in (f"{output_path}.part", f"{output_path}.part.tif"):
+            if os.path.exists(leftover_path):
+                os.remove(leftover_path)
+
+
+def iter_block_windows(dataset, memory_budget_mb=None, bytes_per_pixel=8):
+    """
+    Yields windows that cover `dataset`, aligned to its internal blocks and sized to fit a memory budget.
+
+    Windows span whole block rows (or whole blocks if a single block row does not fit), so every block is read
+    exactly once. Without a budget the whole raster is yielded as a single window.
+
+    :param dataset: Open rasterio dataset.
+    :param memory_budget_mb: Approximate working memory in MB allowed per window.
+    :param bytes_per_pixel: Working memory one pixel needs in the calling computation.
+    """
+    if memory_budget_mb is None:
+        yield Window(0, 0, dataset.width, dataset.height)
+        return
+
+    block_height, block_width = dataset.block_shapes[0]
+    max_pixels = max(1, int(memory_budget_mb * 1024 ** 2 / bytes_per_pixel))
+    if block_height * dataset.width <= max_pixels:
+        window_width = dataset.width
+        window_height = max(1, max_pixels // dataset.width // block_height) * block_height
+    else:
+        window_height = block_height
+        window_width = max(1, max_pixels // block_height // block_width) * block_width
+
+    for row_off in range(0, dataset.height, window_height):
+        for col_off in range(0, dataset.width, window_width):
+            yield Window(col_off, row_off, min(window_width, dataset.width - col_off),
+                         min(window_height, dataset.height - row_off))
+
+
+def save_tiff_and_metadata(array_data, transform, crs_epsg, output_path, bands_metadata, output_profile=None):
     """
     Saves the GeoTIFF data returned by SentinelHub and writes associated metadata to a separate JSON file.
 
+    Both files are written under a temporary name and renamed into place, so concurrent downloads never leave a
+    half-written `.tiff` behind.
+
     :param response_data: Binary content (GeoTIFF) from SentinelHub request
     :param output_path: Path to save the GeoTIFF file
-    :param bands_metadata: Dictionary containing metadata for the bands
+    :param bands_metadata: Dictionary containing metadata for the bands. With the `scale` of a scaled-integer
+        encoding (see `raster_storage.scaled_metadata`) the raster is stored in it.
+    :param output_profile: Output profile name, see `OUTPUT_PROFILES`
     """
     # Save the GeoTIFF file
     raster_crs = rasterio_CRS.from_epsg(crs_epsg)
-    with rasterio.open(
-        output_path, 'w',
-        driver='GTiff',
+    encoding = encoding_of(bands_metadata)
+    array_data = encode(array_data, encoding)
+    with open_raster_for_write(
+        output_path, output_profile,
         height=array_data.shape[0],
         width=array_data.shape[1],
         count=array_data.shape[2],
@@ -26,15 +138,103 @@ def save_tiff_and_metadata(array_data, transform, crs_epsg, output_path, bands_m
         crs=raster_crs,
         transform=transform
     ) as dst:
-        for i in range(array_data.shape[2]):
-            dst.write(array_data[:, :, i], i + 1)  # Write each band
+        set_encoding(dst, encoding)
+        dst.write(np.moveaxis(array_data, -1, 0))  # Bands are the last axis of SentinelHub responses
+
+    metadata_path = save_metadata(output_path, bands_metadata)
+    print(f"Data and metadata saved to {output_path} and {metadata_path}")
+
 
-    # Save the metadata in a JSON file
+def save_metadata(output_path, bands_metadata):
+    """
+    Writes the band metadata of a raster to its `_metadata.json` sidecar file via a temporary file.
+
+    :return: Path of the metadata file.
+    """
     metadata_path = output_path.replace('.tiff', '_metadata.json')
-    with open(metadata_path, 'w') as meta_file:
+    tmp_metadata_path = f"{metadata_path}.part"
+    with open(tmp_metadata_path, 'w') as meta_file:
         json.dump(bands_metadata, meta_file)
+    os.replace(tmp_metadata_path, metadata_path)
+    return metadata_path
 
-    print(f"Data and metadata saved to {output_path} and {metadata_path}")
+
+def get_transformer(source_crs, target_crs, always_xy=True):
+    """
+    Returns a `pyproj.Transformer` from the process-wide cache, creating it on first use.
+
+    Creating a transformer is one of the most expensive pyproj operations, while using one is cheap. Transformers
+    are thread-safe (pyproj >= 3.1), so one instance per (source, target, always_xy) is shared by all threads.
+
+    :param source_crs: EPSG code (e.g. 25833) or CRS string (e.g. "EPSG:25833").
+    :param target_crs: EPSG code or CRS string.
+    :param always_xy: Use (x, y) / (lon, lat) axis order regardless of the CRS definition.
+    """
+    return _cached_transformer(_crs_key(source_crs), _crs_key(target_crs), always_xy)
+
+
+@lru_cache(maxsize=128)
+def _cached_transformer(source_crs, target_crs, always_xy):
+    return Transformer.from_crs(source_crs, target_crs, always_xy=always_xy)
+
+
+def _crs_key(crs):
+    """
+    Normalises EPSG codes and "epsg:<code>" strings so that equal inputs share one cache entry. Other CRS strings
+    (PROJ strings, WKT) are case-sensitive and kept as they are.
+    """
+    if isinstance(crs, (int, np.integer)) or str(crs).isdigit():
+        return f"EPSG:{int(crs)}"
+    crs = str(crs).strip()
+    authority, _, code = crs.partition(':')
+    if authority.upper() == 'EPSG' and code.isdigit():
+        return f"EPSG:{int(code)}"
+    return crs
+
+
+def transform_coordinates(xs, ys, origin_epsg, target_epsg):
+    """
+    Transforms arrays of coordinates in a single call.
+
+    :return: Tuple of two numpy arrays with the transformed x and y coordinates.
+    """
+    xs, ys = get_transformer(origin_epsg, target_epsg).transform(np.asarray(xs, dtype=float),
+                                                                 np.asarray(ys, dtype=float))
+    return np.asarray(xs), np.asarray(ys)
+
+
+def transform_bboxes(bboxes, origin_epsg, target_epsg, densify_points=21):
+    """
+    Transforms many bounding boxes `(min_x, min_y, max_x, max_y)` in a single call and returns their tight enclosing
+    boxes in the target CRS.
+
+    Straight edges become curves in most projections, so transforming only two corners under- or over-covers the
+    area. Every edge is therefore densified with `densify_points` points and the enclosing box is taken over all
+    transformed points, vectorised over all boxes.
+
+    :param bboxes: Array-like of shape (N, 4).
+    :param densify_points: Points inserted between the corners of each edge, as in `pyproj`. 0 transforms the four
+        corners only.
+    :return: Numpy array of shape (N, 4) with the transformed bounding boxes.
+    """
+    bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+    xs, ys = _densify_bbox_edges(bboxes, densify_points)
+    xs, ys = transform_coordinates(xs, ys, origin_epsg, target_epsg)
+    return np.column_stack([np.nanmin(xs, axis=1), np.nanmin(ys, axis=1),
+                            np.nanmax(xs, axis=1), np.nanmax(ys, axis=1)])
+
+
+def _densify_bbox_edges(bboxes, densify_points):
+    """Returns x and y arrays of shape (N, 4 * (densify_points + 1)) tracing the outline of each box."""
+    fractions = np.arange(densify_points + 1) / (densify_points + 1)
+    min_x, min_y, max_x, max_y = (bboxes[:, [i]] for i in range(4))
+    width, height = max_x - min_x, max_y - min_y
+    # Bottom edge left to right, right edge upwards, top edge right to left, left edge downwards
+    xs = np.hstack([min_x + width * fractions, np.repeat(max_x, fractions.size, axis=1),
+                    max_x - width * fractions, np.repeat(min_x, fractions.size, axis=1)])
+    ys = np.hstack([np.repeat(min_y, fractions.size, axis=1), min_y + height * fractions,
+                    np.repeat(max_y, fractions.size, axis=1), max_y - height * fractions])
+    return xs, ys
 
 
 def convert_bbox_epsg25833_to_crs84(bbox):
@@ -43,83 +243,147 @@ def convert_bbox_epsg25833_to_crs84(bbox):
     Parameters:
     bbox (tuple): Bounding box in EPSG:25833 as (min_x, min_y, max_x, max_y).
     Returns:
-    tuple: Bounding box in EPSG:4326 as (min_lon, min_lat, max_lon, max_lat).
+    list: Tight enclosing bounding box in EPSG:4326 as (min_lon, min_lat, max_lon, max_lat).
     """
-    transformer = Transformer.from_crs("EPSG:25833", "EPSG:4326", always_xy=True)
-    min_x, min_y, max_x, max_y = bbox
-    min_lon, min_lat = transformer.transform(min_x, min_y)
-    max_lon, max_lat = transformer.transform(max_x, max_y)
-    return [min_lon, min_lat, max_lon, max_lat]
+    return [float(value) for value in transform_bboxes(bbox, "EPSG:25833", "EPSG:4326")[0]]
 
-def transform_bbox(bbox, origin_epsg, target_epsg):
+def transform_bbox(bbox, origin_epsg, target_epsg, densify_points=21):
     """
-    Convert bounding box from one EPSG to another.
+    Convert bounding box from one EPSG to another, returning the tight box enclosing the densified outline.
     """
-    transformer = Transformer.from_crs(f"EPSG:{origin_epsg}", f"EPSG:{target_epsg}", always_xy=True)
-    xmin, ymin = transformer.transform(bbox[0], bbox[1])
-    xmax, ymax = transformer.transform(bbox[2], bbox[3])
-    return xmin, ymin, xmax, ymax
-
+    xmin, ymin, xmax, ymax = transform_bboxes(bbox, origin_epsg, target_epsg, densify_points)[0]
+    return float(xmin), float(ymin), float(xmax), float(ymax)
 
 import os
 import numpy as np
 import rasterio
+from rasterio import shutil as rasterio_shutil
 from rasterio.enums import Resampling
-from scipy import stats
 
 
-def aggregate_rasters(working_dir, out_dir, method='average'):
-    ui_rasters = [os.path.join(working_dir, f) for f in os.listdir(working_dir) if f.endswith("_ui.tiff")]
+def aggregate_rasters(working_dir, out_dir, method='average', output_profile=None, memory_budget_mb=512,
+                      ui_rasters=None):
+    """
+    Aggregates the `_ui.tiff` rasters of a directory pixel-wise over time and saves `aggregated_ui.tiff`.
+
+    The rasters are streamed window by window: 'average', 'min' and 'max' are running aggregates over the rasters,
+    'median' and percentiles stack only the current window of every raster. Memory therefore scales with the window
+    size (bounded by `memory_budget_mb`) times the number of rasters instead of the full scene times the number of
+    rasters.
+
+    :param working_dir: Directory with the `_ui.tiff` rasters.
+    :param out_dir: Directory to save the aggregated raster to.
+    :param method: 'average', 'median', 'min', 'max' or a percentile such as 'p90'.
+    :param output_profile: Output profile name, see `OUTPUT_PROFILES`.
+    :param memory_budget_mb: Approximate upper bound of working memory in MB.
+    :param ui_rasters: Paths of the rasters to aggregate, all `_ui.tiff` rasters of `working_dir` by default.
+    """
+    if ui_rasters is None:
+        ui_rasters = [os.path.join(working_dir, f) for f in os.listdir(working_dir) if f.endswith("_ui.tiff")]
+    if method in ('average', 'min', 'max'):
+        percentile = None
+    elif method == 'median':
+        percentile = 50
+    elif method.startswith('p') and method[1:].replace('.', '', 1).isdigit() and 0 <= float(method[1:]) <= 100:
+        percentile = float(method[1:])
+    else:
+        raise ValueError(f"Unknown aggregation method '{method}'")
 
-    raster_stack = []
+    with ExitStack() as stack:
+        sources = []
 
-    # Read each UI raster and stack them in memory
-    for ui_raster in ui_rasters:
-        with rasterio.open(ui_raster) as src:
-            raster_data = src.read(1).astype(float)  # Read the first band
-            raster_data[raster_data == src.nodata] = np.nan  # Treat nodata as NaN
+        # Open each UI raster, all of them are read window by window below
+        for ui_raster in ui_rasters:
+            src = stack.enter_context(rasterio.open(ui_raster))
 
-            # Ensure that all rasters have the same shape by resizing (if needed)
-            if len(raster_stack) > 0:
-                if raster_data.shape != raster_stack[0].shape:
+            # Ensure that all rasters have the same shape
+            if len(sources) > 0:
+                if src.shape != sources[0].shape:
                     print(f"Skipping {ui_raster}: shape mismatch with others.")
                     continue  # Skip if shape doesn't match
 
-            raster_stack.append(raster_data)
+            sources.append(src)
 
-    # Ensure all rasters have the same shape before stacking
-    if len(raster_stack) == 0:
-        raise ValueError("No valid rasters found for aggregation.")
+        if len(sources) == 0:
+            raise ValueError("No valid rasters found for aggregation.")
 
-    # Convert list to 3D numpy array (stack of 2D rasters)
-    stacked_array = np.stack(raster_stack, axis=0)
+        out_meta = sources[0].meta.copy()
+        out_meta.update(dtype='float32')
 
-    # Aggregation based on method
-    if method == 'average':
-        aggregated_raster = np.nanmean(stacked_array, axis=0)
-    elif method == 'median':
-        aggregated_raster = np.nanmedian(stacked_array, axis=0)
-    elif method == 'max':
-        aggregated_raster = np.nanmax(stacked_array, axis=0)
-    elif method == 'min':
-        aggregated_raster = np.nanmin(stacked_array, axis=0)
+        # Stacked methods hold the window of every raster, running aggregates only a few window sized arrays
+        bytes_per_pixel = 8 * (len(sources) + 2) if percentile is not None else 8 * 4
+        output_file = os.path.join(out_dir, 'aggregated_ui.tiff')
+        with open_raster_for_write(output_file, output_profile, **out_meta) as dest:
+            for window in iter_block_windows(sources[0], memory_budget_mb, bytes_per_pixel):
+                aggregated_raster = _aggregate_window(sources, window, method, percentile)
+                dest.write(aggregated_raster.astype('float32'), 1, window=window)
 
-        # After calculating the mode, replace placeholder (-9999) back with NaN
-        aggregated_raster[aggregated_raster == -9999] = np.nan
+    return output_file
 
-    # Save the aggregated raster
-    with rasterio.open(ui_rasters[0]) as src:
-        out_meta = src.meta.copy()
-        out_meta.update(dtype='float32')
 
-    output_file = os.path.join(out_dir, 'aggregated_ui.tiff')
-    with rasterio.open(output_file, 'w', **out_meta) as dest:
-        dest.write(aggregated_raster.astype('float32'), 1)
+def _read_ui_window(src, window):
+    raster_data = src.read(1, window=window).astype(float)  # Read the first band
+    raster_data[raster_data == src.nodata] = np.nan  # Treat nodata as NaN
+    return raster_data
 
-    return output_file
+
+def _nanpercentile_sorted(stacked_array, percentile):
+    """
+    Same result as `np.nanpercentile(stacked_array, percentile, axis=0)` with linear interpolation, but vectorised:
+    sorting moves NaNs to the end, so each pixel's percentile is interpolated between its non-NaN values only.
+    Infinite values are ranked like in `np.nanpercentile`.
+    """
+    stacked_array = np.sort(stacked_array, axis=0)
+    valid_count = (~np.isnan(stacked_array)).sum(axis=0)
+    rank = (valid_count - 1).clip(min=0) * (percentile / 100)
+    lower = np.floor(rank).astype(np.intp)
+    upper = np.minimum(lower + 1, (valid_count - 1).clip(min=0))
+    lower_values = np.take_along_axis(stacked_array, lower[np.newaxis], axis=0)[0]
+    upper_values = np.take_along_axis(stacked_array, upper[np.newaxis], axis=0)[0]
+    # Interpolated from the nearer end like numpy's `_lerp`, so infinite values give the same result
+    fraction = rank - lower
+    difference = upper_values - lower_values
+    with np.errstate(invalid='ignore'):
+        result = np.where(fraction >= 0.5, upper_values - difference * (1 - fraction),
+                          lower_values + difference * fraction)
+    result[valid_count == 0] = np.nan
+    return result
+
+
+def _aggregate_window(sources, window, method, percentile):
+    """Aggregates one window of all `sources` over time."""
+    if percentile is not None:
+        stacked_array = np.stack([_read_ui_window(src, window) for src in sources], axis=0)
+        return _nanpercentile_sorted(stacked_array, percentile)
+
+    aggregated_raster = None
+    count = None
+    for src in sources:
+        raster_data = _read_ui_window(src, window)
+        if aggregated_raster is None:
+            count = np.isfinite(raster_data).astype(np.int32)
+            aggregated_raster = np.nan_to_num(raster_data, nan=0.0) if method == 'average' else raster_data
+        elif method == 'average':
+            count += np.isfinite(raster_data)
+            aggregated_raster += np.nan_to_num(raster_data, nan=0.0)
+        elif method == 'max':
+            aggregated_raster = np.fmax(aggregated_raster, raster_data)
+        else:
+            aggregated_raster = np.fmin(aggregated_raster, raster_data)
+
+    if method == 'average':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            aggregated_raster = np.where(count > 0, aggregated_raster / count, np.nan)
+    elif method == 'min':
+        # Replace placeholder (-9999) back with NaN
+        aggregated_raster[aggregated_raster == -9999] = np.nan
+    return aggregated_raster
 
 
 def plot_geotiff(tiff_file_path):
+    # matplotlib is only needed here and slow to import
+    from matplotlib import pyplot as plt
+
     # Open the GeoTIFF file
     with rasterio.open(tiff_file_path) as dataset:
         # Read the first band (for single-band GeoTIFFs)
@@ -166,16 +430,8 @@ def convert_bbox_to_utm(north_lat, south_lat, east_lng, west_lng):
     else:
         epsg_code = 32700 + utm_zone  # Southern Hemisphere
 
-    # Create a transformer object
-    transformer = Transformer.from_crs(
-        "epsg:4326",  # Source CRS (WGS 84)
-        f"epsg:{epsg_code}",  # Target CRS (UTM zone)
-        always_xy=True  # Ensure (lon, lat) order
-    )
-
-    # Convert each corner of the bounding box
-    west_x, north_y = transformer.transform(west_lng, north_lat)
-    east_x, south_y = transformer.transform(east_lng, south_lat)
+    # Convert the densified outline of the bounding box, in (lon, lat) order, and take its enclosing box
+    west_x, south_y, east_x, north_y = transform_bbox((west_lng, south_lat, east_lng, north_lat), 4326, epsg_code)
 
     # Return the UTM bounding box and CRS
     bounding_box_utm = {
@@ -194,7 +450,7 @@ def convert_bbox_to_utm(north_lat, south_lat, east_lng, west_lng):
     return bounding_box_utm, crs_info
 
 
-def smooth_raster(input_path, output_path, sigma=2, band_to_save=1):
+def smooth_raster(input_path, output_path, sigma=2, band_to_save=1, output_profile=None, progress=None):
     """
     Smooths a multi-band raster by applying a Gaussian filter to each band and saves a single-band output.
 
@@ -203,6 +459,8 @@ def smooth_raster(input_path, output_path, sigma=2, band_to_save=1):
     - output_path (str): Path to save the smoothed output raster or directory to save multiple smoothed rasters.
     - sigma (float): The standard deviation for the Gaussian filter. Higher values result in stronger smoothing.
     - band_to_save (int): The band index (1-based) to save in the output file.
+    - output_profile (str): Output profile name, see `OUTPUT_PROFILES`.
+    - progress (callable): Optional `progress(done, total, item)` callback, called after every smoothed file.
     """
     # Ensure output directory exists if processing multiple files
     if os.path.isdir(input_path) and not os.path.exists(output_path):
@@ -210,24 +468,26 @@ def smooth_raster(input_path, output_path, sigma=2, band_to_save=1):
 
     if os.path.isdir(input_path) and os.path.isdir(output_path):
         # Loop over each .tif file in the input directory
-        for filename in os.listdir(input_path):
-            if filename.endswith(".tiff"):
-                input_file = os.path.join(input_path, filename)
-                output_file = os.path.join(output_path, filename)
+        filenames = [filename for filename in os.listdir(input_path) if filename.endswith(".tiff")]
+        for done, filename in enumerate(filenames, start=1):
+            input_file = os.path.join(input_path, filename)
+            output_file = os.path.join(output_path, filename)
 
-                # Apply smoothing to the file
-                _smooth_single_raster(input_file, output_file, sigma, band_to_save)
+            # Apply smoothing to the file
+            _smooth_single_raster(input_file, output_file, sigma, band_to_save, output_profile)
+            if progress is not None:
+                progress(done, len(filenames), filename)
 
     elif os.path.isfile(input_path):
         # If input_path is a file, process it directly and check/create output directory if necessary
         if not os.path.exists(os.path.dirname(output_path)):
             os.makedirs(os.path.dirname(output_path))
-        _smooth_single_raster(input_path, output_path, sigma, band_to_save)
+        _smooth_single_raster(input_path, output_path, sigma, band_to_save, output_profile)
     else:
         print("Invalid input or output path. Please ensure both are either directories or file paths.")
 
 
-def _smooth_single_raster(input_file, output_file, sigma, band_to_save):
+def _smooth_single_raster(input_file, output_file, sigma, band_to_save, output_profile=None):
     """
     Smooths each band of a multi-band raster file and saves all bands as a multi-band output.
 
@@ -236,22 +496,29 @@ def _smooth_single_raster(input_file, output_file, sigma, band_to_save):
     - output_file (str): Path to save the smoothed output raster.
     - sigma (float): The standard deviation for the Gaussian filter.
     """
+    # scipy is only needed here and slow to import
+    from scipy.ndimage import gaussian_filter
+
     # Open the input raster file
     with rasterio.open(input_file) as src:
         profile = src.profile  # Copy the metadata profile
-        profile.update(dtype=rasterio.float32)  # Update profile for output data type
+        # Scaled-integer inputs are smoothed as values and stored in their encoding again
+        encoding = dataset_encoding(src)
+        if encoding is None:
+            profile.update(dtype=rasterio.float32)  # Update profile for output data type
 
         # Prepare an array to store all smoothed bands
         smoothed_bands = []
 
         # Read each band, apply smoothing, and append to the list
         for i in range(1, src.count + 1):
-            band_data = src.read(i)
+            band_data = read_unscaled(src, i)
             smoothed_band = gaussian_filter(band_data, sigma=sigma)
-            smoothed_bands.append(smoothed_band.astype(rasterio.float32))
+            smoothed_bands.append(encode(smoothed_band.astype(rasterio.float32), encoding))
 
         # Write all smoothed bands to the output raster file
-        with rasterio.open(output_file, 'w', **profile) as dst:
+        with open_raster_for_write(output_file, output_profile, **profile) as dst:
+            set_encoding(dst, encoding)
             for idx, band_data in enumerate(smoothed_bands, start=1):
                 dst.write(band_data, idx)
 
@@ -1,4 +1,7 @@
 import datetime
+import hashlib
+import json
+import os
 
 
 def normalize_to_weeks(date_range):
@@ -31,3 +34,27 @@ def normalize_to_weeks(date_range):
         current_week_start = current_week_start + datetime.timedelta(weeks=1)
 
     return weeks
+
+
+def product_date(path):
+    """Returns the date of a product file named "<prefix>_<date>.tiff", e.g. '2024-06-01' for "s2_2024-06-01.tiff"."""
+    return os.path.splitext(os.path.basename(path))[0].split('_')[1]
+
+
+def file_sha256(path, chunk_size=1024 ** 2):
+    """Returns the hex SHA-256 checksum of a file, read in chunks."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def canonical_hash(**params):
+    """
+    Returns the hex SHA-256 of the canonical JSON of `params`: keys sorted, no whitespace, non-JSON values as `str`.
+    Equal parameters hash equally regardless of their order, which keeps cache keys, download manifest hashes and
+    pipeline fingerprints stable.
+    """
+    canonical = json.dumps(params, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -0,0 +1,279 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Quota of a Copernicus General user account on the CDSE Sentinel Hub services
+CDSE_REQUESTS_PER_MINUTE = 300
+CDSE_PROCESSING_UNITS_PER_MINUTE = 300
+# Sentinel Hub sends `Retry-After` in milliseconds instead of the seconds of the HTTP standard
+SENTINEL_HUB_RETRY_AFTER_UNIT = 0.001
+PROCESSING_UNITS_HEADER = 'X-ProcessingUnits-Spent'
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class RetryPolicy:
+    """
+    Decides whether and how long to wait before a failed request is sent again.
+
+    Without a `Retry-After` header the delay grows exponentially with "full jitter", i.e. it is drawn uniformly between
+    zero and `base_delay * 2 ** (attempt - 1)`, so parallel downloads failing together do not retry together.
+    """
+
+    def __init__(self, max_attempts=8, base_delay=1.0, max_delay=60.0, retry_statuses=RETRY_STATUSES,
+                 retry_after_unit=1.0, seed=None):
+        """
+        :param max_attempts: Number of times a request is sent before its last error is raised.
+        :param base_delay: Upper bound in seconds of the delay after the first failure.
+        :param max_delay: Cap in seconds of every delay, including the ones requested by `Retry-After`.
+        :param retry_statuses: HTTP status codes that are retried; connection errors and timeouts always are.
+        :param retry_after_unit: Seconds per unit of a numeric `Retry-After` header, see
+            `SENTINEL_HUB_RETRY_AFTER_UNIT`.
+        :param seed: Seed of the jitter, for reproducible tests.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = tuple(retry_statuses)
+        self.retry_after_unit = retry_after_unit
+        self._random = random.Random(seed)
+
+    def should_retry(self, attempt, status_code=None):
+        """Returns whether a request failing in `attempt` (1-based) with `status_code` is sent again."""
+        if attempt >= self.max_attempts:
+            return False
+        return status_code is None or status_code in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Returns the seconds to wait after `attempt` failed.
+
+        :param retry_after: Raw `Retry-After` header of the failed response, if any.
+        """
+        seconds = parse_retry_after(retry_after, self.retry_after_unit)
+        if seconds is not None:
+            # A little jitter on top, so the requests held back by one rate limit response do not return at once
+            return min(self.max_delay, seconds * (1 + 0.1 * self._random.random()))
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+# Retry policy of requests sent to Sentinel Hub directly, e.g. by the standalone downloader scripts
+SENTINEL_HUB_RETRY_POLICY = RetryPolicy(retry_after_unit=SENTINEL_HUB_RETRY_AFTER_UNIT)
+
+
+def parse_retry_after(value, unit=1.0):
+    """
+    Returns the seconds requested by a `Retry-After` header, either a number of `unit` seconds or an HTTP date, and
+    `None` if the header is missing or malformed.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value) * unit)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: holds up to `capacity` tokens and refills `rate` tokens per second. `acquire` blocks
+    until enough tokens are available, so callers never exceed the rate on average while short bursts up to the
+    capacity pass without waiting.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, amount):
+        """A bucket allowing `amount` tokens per minute, the unit of the Sentinel Hub quotas."""
+        return cls(amount / 60, amount)
+
+    def acquire(self, amount=1):
+        """
+        Takes `amount` tokens, waiting until they are available, and returns the seconds waited. Amounts above the
+        capacity wait for a full bucket instead of forever.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self._paused_until - now, (amount - self._tokens) / self.rate if self.rate else 0.0)
+                if wait <= 0:
+                    self._tokens -= amount
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def adjust(self, amount):
+        """Adds `amount` tokens, or removes them if negative; the bucket may go into debt, delaying later callers."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def pause(self, seconds):
+        """Lets no caller acquire tokens for `seconds`, e.g. after the service answered with a rate limit error."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RateLimiter:
+    """
+    Keeps the requests of a process within a Sentinel Hub quota of requests and processing units per minute.
+
+    Every request takes one request token and its estimated processing units before it is sent. Once the service
+    reports the processing units actually spent, the difference is settled, and a rate limit response pauses all
+    requests sharing the limiter.
+    """
+
+    def __init__(self, requests_per_minute=CDSE_REQUESTS_PER_MINUTE,
+                 processing_units_per_minute=CDSE_PROCESSING_UNITS_PER_MINUTE):
+        """
+        :param requests_per_minute: Request quota, `None` for no limit.
+        :param processing_units_per_minute: Processing unit quota, `None` for no limit.
+        """
+        self.requests = TokenBucket.per_minute(requests_per_minute) if requests_per_minute else None
+        self.processing_units = (TokenBucket.per_minute(processing_units_per_minute)
+                                 if processing_units_per_minute else None)
+        self.stats = {'requests': 0, 'processing_units': 0.0, 'throttled_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def acquire(self, processing_units=0):
+        waited = self.requests.acquire() if self.requests is not None else 0.0
+        if processing_units and self.processing_units is not None:
+            waited += self.processing_units.acquire(processing_units)
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['processing_units'] += processing_units
+            self.stats['throttled_seconds'] += waited
+
+    def settle(self, estimated, spent):
+        """Corrects the processing units taken for a request by `acquire` with the ones the service reported."""
+        with self._lock:
+            self.stats['processing_units'] += spent - estimated
+        if self.processing_units is not None:
+            self.processing_units.adjust(estimated - spent)
+
+    def pause(self, seconds):
+        for bucket in (self.requests, self.processing_units):
+            if bucket is not None:
+                bucket.pause(seconds)
+
+
+def shared_rate_limiter(base_url, client_id, requests_per_minute=CDSE_REQUESTS_PER_MINUTE,
+                        processing_units_per_minute=CDSE_PROCESSING_UNITS_PER_MINUTE):
+    """
+    Returns the process-wide `RateLimiter` of a service account. The quota belongs to the account, so all downloads
+    of one client id against one host share it.
+    """
+    key = (urlparse(base_url).netloc, client_id, requests_per_minute, processing_units_per_minute)
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(requests_per_minute, processing_units_per_minute)
+        return _rate_limiters[key]
+
+
+def pooled_session(pool_maxsize=32):
+    """
+    Returns a process-wide `requests.Session` that keeps up to `pool_maxsize` connections per host open, so
+    consecutive requests reuse TCP and TLS connections instead of opening a new one each. Retries are left to
+    `request_with_retry`.
+    """
+    with _sessions_lock:
+        if pool_maxsize not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[pool_maxsize] = session
+        return _sessions[pool_maxsize]
+
+
+def request_with_retry(session, method, url, retry_policy=None, rate_limiter=None, processing_units=0, **kwargs):
+    """
+    Sends a request, retrying connection errors, timeouts and the retryable status codes of `retry_policy`. Each retry
+    is logged at debug level on the `src.utils.http_client` logger.
+
+    :param session: `requests.Session` (or OAuth session) sending the request, e.g. `pooled_session()`.
+    :param retry_policy: `RetryPolicy`, a default one if `None`.
+    :param rate_limiter: Optional `RateLimiter` every attempt waits for.
+    :param processing_units: Estimated processing units of the request, see `estimate_processing_units`.
+    :param kwargs: Passed to `session.request`, e.g. `json`, `headers` and `timeout`.
+    :return: The successful response.
+    :raises requests.HTTPError: For a non-retryable status or once the attempts are used up.
+    :raises requests.RequestException: If the connection still fails after the last attempt.
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter is not None:
+            rate_limiter.acquire(processing_units)
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if rate_limiter is not None:
+                rate_limiter.settle(processing_units, 0)
+            if not retry_policy.should_retry(attempt):
+                raise
+            delay = retry_policy.delay(attempt)
+            logger.debug("Request to %s failed (%s), retrying in %.1fs", url, type(e).__name__, delay)
+            time.sleep(delay)
+            continue
+
+        if response.ok:
+            spent = response.headers.get(PROCESSING_UNITS_HEADER)
+            if rate_limiter is not None and spent is not None:
+                rate_limiter.settle(processing_units, float(spent))
+            return response
+
+        # Failed requests are not charged
+        if rate_limiter is not None:
+            rate_limiter.settle(processing_units, 0)
+        if not retry_policy.should_retry(attempt, response.status_code):
+            response.raise_for_status()
+        delay = retry_policy.delay(attempt, response.headers.get('Retry-After'))
+        if rate_limiter is not None and response.status_code == 429:
+            # The quota is shared, so every request of the process has to back off, not only this one
+            rate_limiter.pause(delay)
+        logger.debug("Request to %s answered %d, retry %d in %.1fs", url, response.status_code, attempt, delay)
+        response.close()
+        time.sleep(delay)
+
+
+def estimate_processing_units(width, height, input_bands, sample_type='FLOAT32', data_samples=1):
+    """
+    Returns the processing units Sentinel Hub charges for a Process API request: one unit per 512 x 512 output pixels
+    (at least 0.01), per 3 input bands and per data sample, doubled for 32-bit float output.
+    """
+    area = max(0.01, width * height / (512 * 512))
+    units = area * input_bands / 3 * data_samples
+    return units * 2 if sample_type.upper() == 'FLOAT32' else units
@@ -1,9 +1,19 @@
 import glob
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import rasterio
 import numpy as np
 import os
 
+from src.utils.gis_helpers import open_raster_for_write, iter_block_windows, get_default_output_profile
+from src.utils.helper_functions import product_date
+from src.utils.raster_storage import SCALED_ENCODINGS, check_storage, encode, read_unscaled, set_encoding, write_meta
+
+# Working memory per pixel of the LST computation: three input bands plus the NDVI, PV, LSE and LST temporaries
+LST_BYTES_PER_PIXEL = 64
+
 
 def calculate_ndvi(nir_band, red_band):
     """
@@ -21,32 +31,57 @@ def calculate_ndvi(nir_band, red_band):
     return ndvi
 
 
-def calculate_lst_multiband_rasters(sentinel2_path, sentinel3_path, output_path, ndvi_s=0.2, ndvi_v=0.8):
+def calculate_lst_multiband_rasters(sentinel2_path, sentinel3_path, output_path, ndvi_s=0.2, ndvi_v=0.8,
+                                    output_profile=None, memory_budget_mb=None, storage='float32'):
     """
     Calculates LST using Sentinel-2 and Sentinel-3 data from multi-band raster files.
 
+    With a memory budget the rasters are processed window by window along their internal blocks: NDVI, PV, LSE and
+    LST are computed per window and each window is written straight to the output, so peak memory depends on the
+    budget instead of the scene size.
+
     :param sentinel2_path: Path to Sentinel-2 multi-band raster (B03, B04, B08, B11).
     :param sentinel3_path: Path to Sentinel-3 multi-band raster (S8, S9).
     :param output_path: Path to save the output LST raster.
     :param ndvi_s: Threshold for soil NDVI (default: 0.2).
     :param ndvi_v: Threshold for vegetation NDVI (default: 0.8).
+    :param output_profile: Output profile name, see `gis_helpers.OUTPUT_PROFILES`.
+    :param memory_budget_mb: Approximate upper bound of working memory in MB. `None` processes the whole scene at once.
+    :param storage: 'float32', or 'scaled' to store the LST as UINT16 at 0.01 K, see `raster_storage`. Scaled inputs
+        are read as values in both cases.
     """
+    check_storage(storage)
+    encoding = SCALED_ENCODINGS['temperature'] if storage == 'scaled' else None
 
-    # Open Sentinel-2 raster (B03, B04, B08, B11)
-    with rasterio.open(sentinel2_path) as src_sentinel2:
-        green_band = src_sentinel2.read(1)  # B03
-        red_band = src_sentinel2.read(2)  # B04
-        nir_band = src_sentinel2.read(3)  # B08
-        swir_band = src_sentinel2.read(4)  # B11
+    # Open Sentinel-2 raster (B03, B04, B08, B11) and Sentinel-3 raster (S8, S9)
+    with rasterio.open(sentinel2_path) as src_sentinel2, rasterio.open(sentinel3_path) as src_sentinel3:
         sentinel2_meta = src_sentinel2.meta
 
-    # Open Sentinel-3 raster (S8, S9)
-    with rasterio.open(sentinel3_path) as src_sentinel3:
-        s8_band = src_sentinel3.read(1)  # S8 (thermal infrared in Kelvin)
-        s9_band = src_sentinel3.read(2)  # S9 (additional band, not used here)
+        # Update metadata for output (same as input, but with a single band)
+        sentinel2_meta = write_meta(encoding, **sentinel2_meta)
+        sentinel2_meta.update(driver='GTiff', count=1)
 
-    # Calculate NDVI from Sentinel-2
+        # Save the LST raster
+        with open_raster_for_write(output_path, output_profile, **sentinel2_meta) as dst:
+            set_encoding(dst, encoding)
+            for window in iter_block_windows(src_sentinel2, memory_budget_mb, LST_BYTES_PER_PIXEL):
+                red_band = read_unscaled(src_sentinel2, 2, window=window)  # B04
+                nir_band = read_unscaled(src_sentinel2, 3, window=window)  # B08
+                s8_band = read_unscaled(src_sentinel3, 1, window=window)  # S8 (thermal infrared in Kelvin)
+
+                lst = calculate_lst_from_bands(nir_band, red_band, s8_band, ndvi_s, ndvi_v)
+                dst.write(encode(lst.astype(rasterio.float32), encoding), 1, window=window)
+
+    print(f"LST raster saved to {output_path}")
+
+
+def calculate_lst_from_bands(nir_band, red_band, s8_band, ndvi_s=0.2, ndvi_v=0.8):
+    """
+    Calculates LST from NIR and red reflectance and the S8 brightness temperature of the same pixels.
 
+    :return: LST array in Kelvin.
+    """
+    # Calculate NDVI from Sentinel-2
     ndvi = calculate_ndvi(nir_band, red_band)
 
     # Proportional Vegetation (PV)
@@ -68,23 +103,33 @@ def calculate_lst_multiband_rasters(sentinel2_path, sentinel3_path, output_path,
     bt_kelvin = s8_band
 
     # Land Surface Temperature (LST)
-    lst = bt_kelvin / (1 + (lambda_s8 * bt_kelvin / rho) * np.log(lse))
+    return bt_kelvin / (1 + (lambda_s8 * bt_kelvin / rho) * np.log(lse))
 
-    # Update metadata for output (same as input, but with a single band)
-    sentinel2_meta.update(driver='GTiff', dtype=rasterio.float32, count=1)
 
-    # Save the LST raster
-    with rasterio.open(output_path, 'w', **sentinel2_meta) as dst:
-        dst.write(lst.astype(rasterio.float32), 1)
-
-    print(f"LST raster saved to {output_path}")
+def _calculate_lst_for_date(date, sentinel2_path, sentinel3_path, output_path, output_profile, memory_budget_mb,
+                            storage='float32'):
+    """Process pool entry point: calculates the LST of one date and returns `(date, output_path, seconds)`."""
+    start = time.perf_counter()
+    calculate_lst_multiband_rasters(sentinel2_path, sentinel3_path, output_path, output_profile=output_profile,
+                                    memory_budget_mb=memory_budget_mb, storage=storage)
+    return date, output_path, time.perf_counter() - start
 
 
-def calculate_lst(working_dir):
+def calculate_lst(working_dir, output_profile=None, memory_budget_mb=None, max_workers=1, timings=None,
+                  progress=None, storage='float32'):
     """
     Calculate LST for all matched Sentinel-2 and Sentinel-3 TIFF pairs in the working directory.
 
+    The dates are independent of each other, so with `max_workers > 1` they are processed in a process pool. The
+    daily rasters are always collected in date order, so the mean does not depend on the number of workers.
+
     :param working_dir: Directory containing 'Sentinel-2' and 'Sentinel-3' subdirectories with TIFF files.
+    :param output_profile: Output profile name, see `gis_helpers.OUTPUT_PROFILES`.
+    :param memory_budget_mb: Working memory budget per scene in MB, see `calculate_lst_multiband_rasters`.
+    :param max_workers: Number of processes computing dates in parallel. 1 processes the dates serially.
+    :param timings: Optional dictionary that is filled with the seconds spent per date and on the mean ('mean').
+    :param progress: Optional `progress(done, total, item)` callback, called after every finished date.
+    :param storage: Storage of the daily LST rasters, see `calculate_lst_multiband_rasters`. The mean is float32.
     """
     sentinel2_dir = os.path.join(working_dir, 'Sentinel-2')
     sentinel3_dir = os.path.join(working_dir, 'Sentinel-3')
@@ -100,8 +145,8 @@ def calculate_lst(working_dir):
     sentinel3_files = glob.glob(os.path.join(sentinel3_dir, '*.tiff'))
 
     # Extract the dates from the filenames assuming format "s2_<date>.tiff" and "s3_<date>.tiff"
-    sentinel2_dates = {os.path.basename(f).split('_')[1]: f for f in sentinel2_files}
-    sentinel3_dates = {os.path.basename(f).split('_')[1]: f for f in sentinel3_files}
+    sentinel2_dates = {product_date(f): f for f in sentinel2_files}
+    sentinel3_dates = {product_date(f): f for f in sentinel3_files}
 
     # Find matching dates
     matching_dates = set(sentinel2_dates.keys()) & set(sentinel3_dates.keys())
@@ -110,45 +155,66 @@ def calculate_lst(working_dir):
         print("No matching dates found between Sentinel-2 and Sentinel-3 data.")
         return
 
-    lst_files = []
+    # Resolve the profile here, worker processes do not see a default set in this process
+    output_profile = output_profile or get_default_output_profile()
+    jobs = [(date, sentinel2_dates[date], sentinel3_dates[date], os.path.join(lst_dir, f"LST_{date}.tiff"),
+             output_profile, memory_budget_mb, storage) for date in sorted(matching_dates)]
+    timings = {} if timings is None else timings
 
     # For each matching date, calculate LST and save the result
-    for date in sorted(matching_dates):
-        sentinel2_path = sentinel2_dates[date]
-        sentinel3_path = sentinel3_dates[date]
-        output_path = os.path.join(lst_dir, f"LST_{date}.tiff")
+    executor = None
+    if max_workers > 1 and len(jobs) > 1:
+        # Spawned, not forked: the calling process runs other threads (GUI jobs, token refresh, rate limiters) and a
+        # forked child could inherit a lock one of them held at the time of the fork
+        executor = ProcessPoolExecutor(max_workers=min(max_workers, len(jobs)),
+                                       mp_context=multiprocessing.get_context('spawn'))
+        results = executor.map(_calculate_lst_for_date, *zip(*jobs))
+    else:
+        results = (_calculate_lst_for_date(*job) for job in jobs)
 
-        calculate_lst_multiband_rasters(sentinel2_path, sentinel3_path, output_path)
-        lst_files.append(output_path)
+    lst_files = []
+    try:
+        for date, output_path, seconds in results:
+            timings[date] = seconds
+            lst_files.append(output_path)
+            if progress is not None:
+                progress(len(lst_files), len(jobs), os.path.basename(output_path))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
 
     # Calculate the mean LST across all days
     if lst_files:
         lst_mean_path = os.path.join(working_dir, "LST_mean.tiff")
-        calculate_mean_lst(lst_files, lst_mean_path)
+        start = time.perf_counter()
+        calculate_mean_lst(lst_files, lst_mean_path, output_profile)
+        timings['mean'] = time.perf_counter() - start
         print(f"LST mean raster saved to {lst_mean_path}")
+        print("LST timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
         return lst_mean_path
     else:
         print("No LST files created.")
 
 
-def calculate_mean_lst(lst_files, output_path):
+def calculate_mean_lst(lst_files, output_path, output_profile=None):
     """
     Calculate the mean LST from a list of LST TIFF files.
 
     :param lst_files: List of paths to LST TIFF files.
     :param output_path: Path to save the mean LST TIFF file.
+    :param output_profile: Output profile name, see `gis_helpers.OUTPUT_PROFILES`.
     """
     # Open the first LST file to get metadata and shape
     with rasterio.open(lst_files[0]) as src:
         lst_meta = src.meta
-        lst_meta.update(count=1)  # Update metadata to have only 1 band (for mean)
+        lst_meta.update(count=1, dtype='float32', nodata=None)  # Update metadata to have only 1 band (for mean)
         lst_sum = np.zeros(src.shape, dtype=np.float32)
         lst_count = np.zeros(src.shape, dtype=np.int32)
 
     # Sum all LST rasters and count valid pixels
     for lst_file in lst_files:
         with rasterio.open(lst_file) as src:
-            lst_data = src.read(1)  # Read the first band
+            lst_data = read_unscaled(src, 1)  # Read the first band, unscaled if stored as UINT16
             valid_mask = np.isfinite(lst_data)  # Check for valid (non-NaN) pixels
             lst_sum[valid_mask] += lst_data[valid_mask]
             lst_count[valid_mask] += 1
@@ -157,7 +223,7 @@ def calculate_mean_lst(lst_files, output_path):
     lst_mean = np.divide(lst_sum, lst_count, where=lst_count != 0)
 
     # Save the mean LST raster
-    with rasterio.open(output_path, 'w', **lst_meta) as dst:
+    with open_raster_for_write(output_path, output_profile, **lst_meta) as dst:
         dst.write(lst_mean.astype(np.float32), 1)
 
     print(f"Mean LST raster saved to {output_path}")
@@ -0,0 +1,342 @@
+import argparse
+import base64
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import numpy as np
+
+from src.utils.http_client import PROCESSING_UNITS_HEADER, estimate_processing_units
+from src.utils.raster_storage import SCALED_ENCODINGS, encode
+
+PROCESS_PATH = '/api/v1/process'
+CATALOG_PATH = '/api/v1/catalog/1.0.0/search'
+TOKEN_PATH = '/oauth/token'
+# Days between two acquisitions of a collection; every collection not listed is acquired daily
+REVISIT_DAYS = {'sentinel-2-l1c': 2, 'sentinel-2-l2a': 2}
+COLLECTION_BANDS = {'sentinel-2-l1c': 4, 'sentinel-2-l2a': 4, 'sentinel-3-slstr': 2}
+# Encoding the evalscripts of `SentinelData` apply to each collection for UINT16 output
+UINT16_ENCODINGS = {'sentinel-2-l1c': SCALED_ENCODINGS['reflectance'],
+                    'sentinel-2-l2a': SCALED_ENCODINGS['reflectance'],
+                    'sentinel-3-slstr': SCALED_ENCODINGS['temperature']}
+
+
+class MockSentinelHub:
+    """
+    Local stand-in for the CDSE token, catalog search and Process API endpoints, e.g. for benchmarks and offline tests
+    of the download path.
+
+    Catalog searches find every `REVISIT_DAYS`-th day of a collection. Process API requests return float32 GeoTIFFs
+    (UINT16 in the encodings of `UINT16_ENCODINGS` if the evalscript asks for it) with a smooth synthetic pattern of
+    the requested collection (reflectances for Sentinel-2, brightness temperatures in Kelvin for Sentinel-3; the bands
+    of every collection for data fusion requests) computed from the world coordinates of each pixel and the date, so
+    identical requests return identical rasters and adjacent tiles mosaic seamlessly and report the processing units
+    they would cost.
+    Latency, throughput and a seeded error rate simulate the real service; `stats` counts requests, failures, bytes
+    and the peak of concurrent requests.
+
+    Point `load_config` (or `SentinelData`) at it with `base_url=mock.url` and `token_url=mock.token_url`, or through
+    the environment returned by `environ()`.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, throughput=None, error_rate=0.0, seed=0,
+                 client_id=None, client_secret=None, token_lifetime=3600):
+        """
+        :param host: Interface to listen on.
+        :param port: Port to listen on, 0 picks a free port.
+        :param latency: Seconds every catalog and process request waits before it is answered.
+        :param throughput: Bytes per second at which process responses are sent, unlimited if `None`.
+        :param error_rate: Fraction of catalog and process requests answered with a 429 or 503 error.
+        :param seed: Seed of the error sequence.
+        :param client_id: Client id the token endpoint accepts. `None` accepts any credentials.
+        :param client_secret: Client secret the token endpoint accepts.
+        :param token_lifetime: Seconds until an issued token expires.
+        """
+        self.latency = latency
+        self.throughput = throughput
+        self.error_rate = error_rate
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_lifetime = token_lifetime
+        self.stats = {'token': 0, 'catalog': 0, 'process': 0, 'errors': 0, 'bytes': 0, 'in_flight': 0,
+                      'peak_in_flight': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _MockRequestHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def token_url(self):
+        return f"{self.url}{TOKEN_PATH}"
+
+    def environ(self):
+        """Environment variables that make `load_config` use this server."""
+        # oauthlib refuses plain http token endpoints unless told otherwise
+        return {'HOTSPOT_SH_BASE_URL': self.url, 'HOTSPOT_SH_TOKEN_URL': self.token_url,
+                'OAUTHLIB_INSECURE_TRANSPORT': '1'}
+
+    def start(self):
+        """Serves on a background thread and returns immediately."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def issue_token(self, form):
+        """Returns a token response for the posted client credentials form, `None` if they are rejected."""
+        client_id = form.get('client_id', [''])[0]
+        if self.client_id is not None and (client_id != self.client_id
+                                           or form.get('client_secret', [''])[0] != self.client_secret):
+            return None
+        now = int(time.time())
+        # Unsigned JWT layout, sentinelhub reads the client id from the "azp" claim of the payload
+        claims = {'azp': client_id, 'iat': now, 'exp': now + self.token_lifetime}
+        access_token = '.'.join(base64.b64encode(json.dumps(part).encode()).decode().rstrip('=')
+                                for part in ({'alg': 'none', 'typ': 'JWT'}, claims)) + '.mock'
+        return {'access_token': access_token, 'token_type': 'Bearer', 'expires_in': self.token_lifetime,
+                'expires_at': now + self.token_lifetime}
+
+    def search(self, payload):
+        """Returns a catalog search response with the acquisition dates of the requested collection."""
+        start, end = (_parse_datetime(value).date() for value in payload['datetime'].split('/'))
+        collection = payload['collections'][0]
+        revisit = REVISIT_DAYS.get(collection, 1)
+        dates = [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+        dates = [date.isoformat() for date in dates if date.toordinal() % revisit == 0]
+
+        offset, limit = int(payload.get('next') or 0), int(payload.get('limit', 100))
+        page = dates[offset:offset + limit]
+        if payload.get('distinct') != 'date':
+            page = [{'id': f"{collection}_{date}", 'properties': {'datetime': f"{date}T10:00:00Z"},
+                     'bbox': payload.get('bbox')} for date in page]
+        context = {'limit': limit, 'returned': len(page)}
+        if offset + limit < len(dates):
+            context['next'] = offset + limit
+        return {'type': 'FeatureCollection', 'features': page, 'links': [], 'context': context}
+
+    def process(self, payload):
+        """Returns the GeoTIFF bytes answering a Process API request."""
+        import rasterio
+        from rasterio.io import MemoryFile
+        from rasterio.transform import from_bounds
+
+        bounds = payload['input']['bounds']
+        min_x, min_y, max_x, max_y = bounds['bbox']
+        crs = _epsg_from_url(bounds.get('properties', {}).get('crs', ''))
+        width, height, bands = _output_shape(payload)
+        sample_type = _sample_type(payload)
+        inputs = payload['input']['data']
+        if len(inputs) == 1:
+            input_bands = [(inputs[0], bands)]
+        else:
+            # Data fusion: the bands of every input collection, in the order of the inputs
+            input_bands = [(data, COLLECTION_BANDS.get(data['type'], 1)) for data in inputs]
+        layers = [synthetic_bands(data['type'], _request_date(data), (min_x, min_y, max_x, max_y), width, height, count)
+                  for data, count in input_bands]
+        if sample_type == 'UINT16':
+            layers = [encode(layer, UINT16_ENCODINGS[data['type']]) for layer, (data, _) in zip(layers, input_bands)]
+        array = np.concatenate(layers)
+        with MemoryFile() as memory_file:
+            with memory_file.open(driver='GTiff', width=width, height=height, count=bands, dtype=array.dtype,
+                                  crs=rasterio.crs.CRS.from_epsg(crs),
+                                  transform=from_bounds(min_x, min_y, max_x, max_y, width, height)) as dst:
+                dst.write(array[:bands])
+            return memory_file.read()
+
+    def processing_units(self, payload):
+        """Processing units the real service would charge for a Process API request."""
+        width, height, bands = _output_shape(payload)
+        return estimate_processing_units(width, height, bands, _sample_type(payload))
+
+    def _should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+            if key == 'in_flight':
+                self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+
+
+def synthetic_bands(collection, date, bbox, width, height, bands):
+    """
+    Returns a deterministic `(bands, height, width)` float32 array for a collection, date and area. Values depend only
+    on the world coordinates of the pixel centres, so overlapping requests agree on shared pixels.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    xs = min_x + (np.arange(width) + 0.5) * (max_x - min_x) / width
+    ys = max_y - (np.arange(height) + 0.5) * (max_y - min_y) / height
+    x, y = np.meshgrid(xs, ys)
+    phase = zlib.crc32(f"{collection}{date}".encode()) % 1000 / 1000 * 2 * np.pi
+
+    def pattern(shift=0.0):
+        return (np.sin((x - shift) / 700 + phase) * np.cos(y / 900 - phase) + 1) / 2
+
+    if collection.startswith('sentinel-3'):
+        # Brightness temperatures in Kelvin
+        layers = [280 + 30 * pattern() + 2 * band for band in range(bands)]
+    else:
+        # Reflectances, shifted by 30 m per band so the spectral indices are not constant
+        layers = [0.02 + 0.4 * pattern(band * 30) * (1 + band) / (1 + bands) for band in range(bands)]
+    return np.stack(layers).astype(np.float32)
+
+
+def _output_shape(payload):
+    """Returns the `(width, height, bands)` of the raster a Process API request asks for."""
+    min_x, min_y, max_x, max_y = payload['input']['bounds']['bbox']
+    output = payload.get('output', {})
+    if 'width' in output:
+        width, height = int(output['width']), int(output['height'])
+    else:
+        width = max(1, round((max_x - min_x) / output['resx']))
+        height = max(1, round((max_y - min_y) / output['resy']))
+    bands_match = re.search(r'bands:\s*(\d+)', payload.get('evalscript', ''))
+    collection = payload['input']['data'][0]['type']
+    bands = int(bands_match.group(1)) if bands_match else COLLECTION_BANDS.get(collection, 1)
+    return width, height, bands
+
+
+def _sample_type(payload):
+    sample_type_match = re.search(r'sampleType:\s*"(\w+)"', payload.get('evalscript', ''))
+    return sample_type_match.group(1).upper() if sample_type_match else 'FLOAT32'
+
+
+def _request_date(data):
+    return _parse_datetime(data.get('dataFilter', {}).get('timeRange', {}).get('from', '2024-01-01')).date()
+
+
+def _parse_datetime(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _epsg_from_url(crs_url):
+    code = crs_url.rstrip('/').rsplit('/', 1)[-1]
+    return int(code) if code.isdigit() else 4326
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path.split('?', 1)[0]
+
+        if path == TOKEN_PATH:
+            mock._count('token')
+            token = mock.issue_token(parse_qs(body.decode()))
+            if token is None:
+                self._send(HTTPStatus.UNAUTHORIZED, {'error': 'invalid_client'})
+            else:
+                self._send(HTTPStatus.OK, token)
+            return
+
+        if path not in (CATALOG_PATH, PROCESS_PATH):
+            self._send(HTTPStatus.NOT_FOUND, {'error': f"Unknown endpoint {path}"})
+            return
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self._send(HTTPStatus.UNAUTHORIZED, {'error': 'Missing bearer token'})
+            return
+
+        mock._count('catalog' if path == CATALOG_PATH else 'process')
+        mock._count('in_flight')
+        try:
+            time.sleep(mock.latency)
+            if mock._should_fail():
+                mock._count('errors')
+                status = mock._random.choice([HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE])
+                self._send(status, {'error': {'status': status.value, 'reason': 'Simulated failure'}},
+                           headers={'Retry-After': '1'})
+                return
+            payload = json.loads(body)
+            if path == CATALOG_PATH:
+                self._send(HTTPStatus.OK, mock.search(payload))
+            else:
+                self._send_throttled(mock.process(payload), 'image/tiff', mock,
+                                     headers={PROCESSING_UNITS_HEADER: f"{mock.processing_units(payload):.4f}"})
+        except (KeyError, ValueError) as e:
+            self._send(HTTPStatus.BAD_REQUEST, {'error': f"Malformed request: {e}"})
+        finally:
+            mock._count('in_flight', -1)
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_throttled(self, body, content_type, mock, headers=None):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        chunk_size = 64 * 1024
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(chunk)
+            if mock.throughput:
+                time.sleep(len(chunk) / mock.throughput)
+        mock._count('bytes', len(body))
+
+    def log_message(self, format, *args):
+        # One line per request would drown the benchmark output
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local stand-in of the Sentinel Hub token, catalog and "
+                                                 "Process API endpoints.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds every request waits")
+    parser.add_argument('--throughput', type=float, default=None, help="Bytes per second of process responses")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    mock = MockSentinelHub(host=args.host, port=args.port, latency=args.latency, throughput=args.throughput,
+                           error_rate=args.error_rate, seed=args.seed)
+    for name, value in mock.environ().items():
+        print(f"export {name}={value}")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.utils.helper_functions import canonical_hash, file_sha256, product_date
+
+MANIFEST_NAME = 'pipeline_manifest.json'
+
+
+class Task:
+    """One product of a stage: the file it writes, the files it reads, its parameters and the call producing it."""
+
+    def __init__(self, output, inputs, params, function, *args, **kwargs):
+        """
+        :param output: Path of the produced raster.
+        :param inputs: Paths of the files the product is computed from.
+        :param params: JSON-serialisable parameters that change the product, e.g. `{'sigma': 2}`.
+        :param function: Called as `function(*args, **kwargs)` to (re)compute the product.
+        """
+        self.output = output
+        self.inputs = list(inputs)
+        self.params = params
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Stage:
+    """
+    A named step of a `Pipeline`. `plan()` returns its tasks and is called only once all stages it depends on have
+    run, so it can list the files they produced.
+    """
+
+    def __init__(self, name, plan, depends_on=()):
+        self.name = name
+        self.plan = plan
+        self.depends_on = tuple(depends_on)
+
+
+class Pipeline:
+    """
+    Runs a graph of stages and recomputes only the products whose inputs or parameters changed.
+
+    Every product gets a fingerprint: a hash of its stage, parameters and the fingerprints of its inputs. Inputs that
+    are products of an earlier stage contribute their recorded fingerprint, other inputs (e.g. downloaded rasters)
+    contribute a hash of their content. The fingerprints are stored in a manifest in the working directory, together
+    with the size and modification time of every product, and a product is skipped if both still match. Changing e.g.
+    the UI thresholds therefore recomputes the weekly UI rasters and their aggregate, but not the LST stages, and
+    changing only the aggregation method recomputes only the aggregate.
+    """
+
+    def __init__(self, working_dir, stages=()):
+        self.working_dir = working_dir
+        self.stages = {}
+        self.manifest_path = os.path.join(working_dir, MANIFEST_NAME)
+        self._manifest = self._load_manifest()
+        self._lock = threading.Lock()
+        for stage in stages:
+            self.add_stage(stage)
+
+    def add_stage(self, stage):
+        unknown = [name for name in stage.depends_on if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages {unknown}")
+        self.stages[stage.name] = stage
+
+    def run(self, targets=None, max_workers=1, progress=None):
+        """
+        Runs the `targets` stages and all stages they depend on, in dependency order.
+
+        :param targets: Names of the stages to bring up to date, all stages by default.
+        :param max_workers: Number of threads computing the outdated products of a stage in parallel.
+        :param progress: Optional `progress(done, total, item)` callback, called after every product of a stage.
+        :return: Dictionary of stage name to `{'computed': {output: seconds}, 'skipped': [outputs]}`.
+        """
+        report = {}
+        for name in self._ordered(targets or list(self.stages)):
+            report[name] = self._run_stage(self.stages[name], max_workers, progress)
+            print(f"Stage {name}: {len(report[name]['computed'])} computed, {len(report[name]['skipped'])} "
+                  f"up to date")
+        return report
+
+    def is_up_to_date(self, task, stage_name):
+        record = self._manifest['products'].get(self._key(task.output))
+        return (record is not None and record['fingerprint'] == self._fingerprint(task, stage_name)
+                and record['stat'] == _stat(task.output))
+
+    def _ordered(self, targets):
+        ordered = []
+
+        def visit(name):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}', expected one of {list(self.stages)}")
+            if name in ordered:
+                return
+            for dependency in self.stages[name].depends_on:
+                visit(dependency)
+            ordered.append(name)
+
+        for target in targets:
+            visit(target)
+        return ordered
+
+    def _run_stage(self, stage, max_workers, progress):
+        tasks = stage.plan()
+        result = {'computed': {}, 'skipped': []}
+        outdated = []
+        for task in tasks:
+            if self.is_up_to_date(task, stage.name):
+                result['skipped'].append(task.output)
+            else:
+                outdated.append(task)
+
+        def compute(task):
+            start = time.perf_counter()
+            task.function(*task.args, **task.kwargs)
+            return time.perf_counter() - start
+
+        def finish(task, seconds):
+            result['computed'][task.output] = round(seconds, 3)
+            self._record(task, stage.name)
+            if progress is not None:
+                progress(len(result['skipped']) + len(result['computed']), len(tasks),
+                         f"{stage.name}: {os.path.basename(task.output)}")
+
+        if max_workers <= 1:
+            for task in outdated:
+                finish(task, compute(task))
+            return result
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {executor.submit(compute, task): task for task in outdated}
+            for future in as_completed(futures):
+                finish(futures[future], future.result())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return result
+
+    def _fingerprint(self, task, stage_name):
+        inputs = [(self._key(path), self._input_fingerprint(path)) for path in task.inputs]
+        return canonical_hash(stage=stage_name, params=task.params, inputs=inputs)
+
+    def _input_fingerprint(self, path):
+        key, stat = self._key(path), _stat(path)
+        if stat is None:
+            raise FileNotFoundError(f"Pipeline input {path} does not exist")
+        with self._lock:
+            product = self._manifest['products'].get(key)
+            if product is not None and product['stat'] == stat:
+                return product['fingerprint']
+            source = self._manifest['sources'].get(key)
+            if source is not None and source['stat'] == stat:
+                return source['sha256']
+        sha256 = file_sha256(path)
+        with self._lock:
+            self._manifest['sources'][key] = {'stat': stat, 'sha256': sha256}
+        return sha256
+
+    def _record(self, task, stage_name):
+        fingerprint = self._fingerprint(task, stage_name)
+        with self._lock:
+            self._manifest['products'][self._key(task.output)] = {
+                'stage': stage_name, 'fingerprint': fingerprint, 'stat': _stat(task.output), 'params': task.params,
+                'inputs': [self._key(path) for path in task.inputs],
+            }
+            self._manifest['sources'].pop(self._key(task.output), None)
+            self._save_manifest()
+
+    def _key(self, path):
+        # Relative to the working directory, so moving the directory keeps the manifest valid
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.working_dir)).replace(os.sep, '/')
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path) as manifest_file:
+                    return json.load(manifest_file)
+            except ValueError:
+                print(f"Ignoring unreadable pipeline manifest {self.manifest_path}")
+        return {'products': {}, 'sources': {}}
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.part"
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(self._manifest, manifest_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def _stat(path):
+    """Size and modification time of a file, `None` if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_hotspot_pipeline(working_dir, sigma=2, smooth=True, ndwi_threshold=0.3, mndwi_threshold=0.3,
+                           method='average', output_profile=None, precision='float32', memory_budget_mb=None,
+                           storage='float32'):
+    """
+    Returns the processing pipeline of a working directory laid out by `SentinelData`:
+
+    - `smooth`: Sentinel-3/s3_<date>.tiff -> Sentinel-3-smooth/s3_<date>.tiff
+    - `lst_days`: Sentinel-2/s2_<date>.tiff and the (smoothed) Sentinel-3 raster -> LST_days/LST_<date>.tiff
+    - `lst_mean`: the LST_days rasters planned by `lst_days` -> LST_mean.tiff
+    - `ui_weeks`: Sentinel-2-weeks/s2_<week>.tiff -> Sentinel-2-weeks/s2_<week>_ui.tiff
+    - `ui_aggregate`: the UI rasters planned by `ui_weeks` -> aggregated_ui.tiff
+
+    :param smooth: Compute LST from the smoothed Sentinel-3 rasters. Without smoothing the `smooth` stage plans no
+        tasks.
+    :param storage: Storage of the daily LST rasters, 'float32' or 'scaled' (UINT16 at 0.01 K). Smoothed rasters are
+        stored like the downloads they are computed from.
+    """
+    from src.utils.gis_helpers import aggregate_rasters, get_default_output_profile, smooth_raster
+    from src.utils.lst_calculator import calculate_lst_multiband_rasters, calculate_mean_lst
+    from src.utils.ui_calculator import calculate_ui_raster
+
+    # The profile changes the written files, so it is part of the parameters
+    output_profile = output_profile or get_default_output_profile()
+    sentinel2_dir = os.path.join(working_dir, 'Sentinel-2')
+    sentinel3_dir = os.path.join(working_dir, 'Sentinel-3')
+    sentinel3_smooth_dir = os.path.join(working_dir, 'Sentinel-3-smooth')
+    weeks_dir = os.path.join(working_dir, 'Sentinel-2-weeks')
+    lst_dir = os.path.join(working_dir, 'LST_days')
+
+    def tiffs(directory, suffix='.tiff'):
+        return sorted(glob.glob(os.path.join(directory, f"*{suffix}")))
+
+    def plan_smooth():
+        if not smooth:
+            return []
+        return [Task(os.path.join(sentinel3_smooth_dir, os.path.basename(path)), [path],
+                     {'sigma': sigma, 'output_profile': output_profile},
+                     smooth_raster, path, os.path.join(sentinel3_smooth_dir, os.path.basename(path)), sigma=sigma,
+                     output_profile=output_profile)
+                for path in tiffs(sentinel3_dir)]
+
+    # Outputs of the last `lst_days` and `ui_weeks` plans, so stale rasters of dates or weeks no longer downloaded
+    # stay out of the mean and the aggregate
+    planned_lst_files = []
+    planned_ui_files = []
+
+    def plan_lst_days():
+        sentinel3_files = {product_date(path): path
+                           for path in tiffs(sentinel3_smooth_dir if smooth else sentinel3_dir)}
+        tasks = []
+        for sentinel2_path in tiffs(sentinel2_dir):
+            date = product_date(sentinel2_path)
+            if date not in sentinel3_files:
+                continue
+            output_path = os.path.join(lst_dir, f"LST_{date}.tiff")
+            tasks.append(Task(output_path, [sentinel2_path, sentinel3_files[date]],
+                              {'output_profile': output_profile, 'storage': storage},
+                              calculate_lst_multiband_rasters, sentinel2_path, sentinel3_files[date], output_path,
+                              output_profile=output_profile, memory_budget_mb=memory_budget_mb, storage=storage))
+        os.makedirs(lst_dir, exist_ok=True)
+        planned_lst_files[:] = [task.output for task in tasks]
+        return tasks
+
+    def plan_lst_mean():
+        lst_files = list(planned_lst_files)
+        if not lst_files:
+            return []
+        output_path = os.path.join(working_dir, 'LST_mean.tiff')
+        return [Task(output_path, lst_files, {'output_profile': output_profile},
+                     calculate_mean_lst, lst_files, output_path, output_profile)]
+
+    def plan_ui_weeks():
+        params = {'ndwi_threshold': ndwi_threshold, 'mndwi_threshold': mndwi_threshold, 'precision': precision,
+                  'output_profile': output_profile}
+        tasks = [Task(path.replace('.tiff', '_ui.tiff'), [path], params,
+                      calculate_ui_raster, path, path.replace('.tiff', '_ui.tiff'), ndwi_threshold, mndwi_threshold,
+                      output_profile, precision)
+                 for path in tiffs(weeks_dir) if not path.endswith('_ui.tiff')]
+        planned_ui_files[:] = [task.output for task in tasks]
+        return tasks
+
+    def plan_ui_aggregate():
+        ui_files = list(planned_ui_files)
+        if not ui_files:
+            return []
+        return [Task(os.path.join(working_dir, 'aggregated_ui.tiff'), ui_files,
+                     {'method': method, 'output_profile': output_profile},
+                     aggregate_rasters, weeks_dir, working_dir, method, output_profile,
+                     memory_budget_mb if memory_budget_mb is not None else 512, ui_files)]
+
+    return Pipeline(working_dir, [
+        Stage('smooth', plan_smooth),
+        Stage('lst_days', plan_lst_days, depends_on=['smooth']),
+        Stage('lst_mean', plan_lst_mean, depends_on=['lst_days']),
+        Stage('ui_weeks', plan_ui_weeks),
+        Stage('ui_aggregate', plan_ui_aggregate, depends_on=['ui_weeks']),
+    ])
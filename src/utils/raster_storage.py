@@ -0,0 +1,100 @@
+import numpy as np
+
+STORAGE_TYPES = ('float32', 'scaled')
+# UINT16 encodings of the scaled storage: value = stored * scale + offset, `nodata` marks missing (NaN) pixels.
+# Reflectance keeps 4 decimals up to 6.5534, brightness and land surface temperatures 0.01 K up to 655.34 K.
+SCALED_ENCODINGS = {
+    'reflectance': {'dtype': 'uint16', 'scale': 0.0001, 'offset': 0.0, 'nodata': 65535},
+    'temperature': {'dtype': 'uint16', 'scale': 0.01, 'offset': 0.0, 'nodata': 65535},
+}
+
+
+def check_storage(storage):
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown storage '{storage}', expected one of {STORAGE_TYPES}")
+
+
+def scaled_metadata(bands_metadata, quantity, storage='scaled'):
+    """
+    Returns the band metadata of a raster of `quantity` (a key of `SCALED_ENCODINGS`) stored as `storage`: with the
+    `scale`, `offset`, `nodata` and `dtype` of the encoding added for scaled storage, unchanged for float32.
+    """
+    check_storage(storage)
+    if storage == 'float32':
+        return bands_metadata
+    return dict(bands_metadata, **SCALED_ENCODINGS[quantity])
+
+
+def encoding_of(bands_metadata):
+    """Returns the encoding recorded in band metadata or a `_metadata.json` sidecar, `None` for float rasters."""
+    if bands_metadata is None or 'scale' not in bands_metadata:
+        return None
+    return {key: bands_metadata[key] for key in ('dtype', 'scale', 'offset', 'nodata')}
+
+
+def dataset_encoding(dataset):
+    """Returns the encoding of an open scaled-integer raster, `None` if it stores its values as they are."""
+    if not np.issubdtype(np.dtype(dataset.dtypes[0]), np.integer):
+        return None
+    scale, offset = dataset.scales[0], dataset.offsets[0]
+    if scale == 1 and offset == 0:
+        return None
+    return {'dtype': dataset.dtypes[0], 'scale': scale, 'offset': offset, 'nodata': dataset.nodata}
+
+
+def encode(array, encoding):
+    """
+    Returns `array` stored as `encoding`: scaled, rounded and clipped to the integer range, NaN as nodata. Arrays that
+    already have the integer type of the encoding, e.g. scaled downloads, are returned unchanged.
+    """
+    if encoding is None or np.asarray(array).dtype == np.dtype(encoding['dtype']):
+        return array
+    info = np.iinfo(encoding['dtype'])
+    with np.errstate(invalid='ignore'):
+        stored = np.round((np.asarray(array, dtype=np.float64) - encoding['offset']) / encoding['scale'])
+    nodata = encoding['nodata']
+    # Valid values never collide with nodata
+    upper = info.max - 1 if nodata == info.max else info.max
+    lower = info.min + 1 if nodata == info.min else info.min
+    stored = np.clip(stored, lower, upper)
+    stored[np.isnan(stored)] = nodata
+    return stored.astype(encoding['dtype'])
+
+
+def decode(array, encoding, dtype='float32'):
+    """Returns the values of an `array` stored as `encoding`, NaN where it holds nodata."""
+    if encoding is None:
+        return np.asarray(array).astype(dtype, copy=False)
+    dtype = np.dtype(dtype)
+    values = np.asarray(array).astype(dtype) * dtype.type(encoding['scale']) + dtype.type(encoding['offset'])
+    if encoding['nodata'] is not None:
+        values[np.asarray(array) == encoding['nodata']] = np.nan
+    return values
+
+
+def set_encoding(dataset, encoding):
+    """Records the scale, offset and nodata of `encoding` in the GeoTIFF metadata of a dataset open for writing."""
+    if encoding is None:
+        return
+    dataset.nodata = encoding['nodata']
+    dataset.scales = (encoding['scale'],) * dataset.count
+    dataset.offsets = (encoding['offset'],) * dataset.count
+
+
+def write_meta(encoding, **meta):
+    """Returns rasterio dataset metadata for float32 values written as `encoding`."""
+    if encoding is None:
+        return dict(meta, dtype='float32', nodata=None)
+    return dict(meta, dtype=encoding['dtype'], nodata=encoding['nodata'])
+
+
+def read_unscaled(dataset, indexes=None, out_dtype='float32', **kwargs):
+    """
+    Reads like `dataset.read` and returns the values: scaled-integer rasters are unscaled with the scale and offset
+    in their GeoTIFF metadata and their nodata pixels returned as NaN, other rasters are returned as read.
+    """
+    encoding = dataset_encoding(dataset)
+    data = dataset.read(indexes, **kwargs)
+    if encoding is None:
+        return data.astype(out_dtype, copy=False)
+    return decode(data, encoding, out_dtype)
@@ -0,0 +1,131 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+from rasterio.crs import CRS as rasterio_CRS
+from rasterio.transform import from_bounds
+from rasterio.windows import Window
+
+from src.utils.gis_helpers import open_raster_for_write, save_metadata
+from src.utils.raster_storage import decode, encode, encoding_of, set_encoding
+
+# Resolution of the SLSTR thermal bands (S7-S9, F1-F2)
+SENTINEL3_NATIVE_RESOLUTION = 1000
+KERNELS = ('nearest', 'bilinear', 'cubic')
+# Pixels added around coarse downloads, the support of the widest kernel (cubic) on each side of a sample point.
+# The margin does not depend on the kernel, so one download serves all of them.
+COARSE_MARGIN_PIXELS = 2
+# Share of its kernel weight an output pixel needs on valid source pixels, otherwise it is NaN
+MIN_VALID_WEIGHT = 0.5
+
+
+def coarse_grid(bbox_coordinates, resolution):
+    """
+    Returns the `(bbox, (width, height))` of a coarse download covering `bbox_coordinates`: snapped outwards to whole
+    pixels of `resolution` anchored at the CRS origin, plus the margin the kernels need to interpolate the edge
+    pixels. Anchoring at the origin makes every AOI and tile of one resolution share a single grid.
+    """
+    margin = COARSE_MARGIN_PIXELS * resolution
+    min_x, min_y, max_x, max_y = (float(c) for c in bbox_coordinates)
+    bbox = (math.floor(min_x / resolution) * resolution - margin, math.floor(min_y / resolution) * resolution - margin,
+            math.ceil(max_x / resolution) * resolution + margin, math.ceil(max_y / resolution) * resolution + margin)
+    return bbox, (round((bbox[2] - bbox[0]) / resolution), round((bbox[3] - bbox[1]) / resolution))
+
+
+def upsample(array, source_bbox, target_bbox, target_size, kernel='bilinear', rows=None):
+    """
+    Resamples a `(height, width, bands)` array covering `source_bbox` onto the pixel grid of `target_size` pixels
+    covering `target_bbox` (same CRS, north up).
+
+    The kernel is applied separably, as one interpolation matrix per axis. The matrices depend only on the two grids
+    and the kernel and are cached, so resampling every date of a stack onto the same grid computes them once.
+
+    Missing (NaN) source pixels are left out of the weighted sum of the pixels around them, and the weights of the
+    valid taps are renormalised. An output pixel is NaN only where less than half of its kernel weight falls on valid
+    pixels, i.e. close to the missing ones.
+
+    :param kernel: One of `KERNELS`.
+    :param rows: Optional `(start, stop)` of the target rows to compute, for writing large targets in strips.
+    :return: `(rows, width, bands)` float32 array.
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown resampling kernel '{kernel}', expected one of {KERNELS}")
+    source_height, source_width = array.shape[:2]
+    target_width, target_height = target_size
+    columns = _interpolation_matrix(float(source_bbox[0]), (source_bbox[2] - source_bbox[0]) / source_width,
+                                    source_width, float(target_bbox[0]),
+                                    (target_bbox[2] - target_bbox[0]) / target_width, target_width, kernel)
+    # Rows run from north to south
+    row_matrix = _interpolation_matrix(-float(source_bbox[3]), (source_bbox[3] - source_bbox[1]) / source_height,
+                                       source_height, -float(target_bbox[3]),
+                                       (target_bbox[3] - target_bbox[1]) / target_height, target_height, kernel)
+    if rows is not None:
+        row_matrix = row_matrix[rows[0]:rows[1]]
+    source = np.asarray(array, dtype=np.float64)
+    valid = np.isfinite(source)
+    # (rows x source rows) . (source rows x source cols x bands) . (source cols x cols). Zero weights would still
+    # multiply NaNs into every output pixel, so missing pixels enter the sum as zeros.
+    result = np.einsum('rs,scb,tc->rtb', row_matrix, np.where(valid, source, 0.0), columns, optimize=True)
+    if not valid.all():
+        # Kernel weight of the valid taps of every output pixel; the weights of all taps sum to 1
+        weights = np.einsum('rs,scb,tc->rtb', row_matrix, valid.astype(np.float64), columns, optimize=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.where(weights >= MIN_VALID_WEIGHT, result / weights, np.nan)
+    return result.astype(np.float32)
+
+
+@lru_cache(maxsize=64)
+def _interpolation_matrix(source_origin, source_step, source_size, target_origin, target_step, target_size, kernel):
+    """
+    Returns the `(target_size, source_size)` matrix interpolating samples along one axis. Sample points beyond the
+    source are clamped to its edge pixels.
+    """
+    # Target pixel centres in source pixel coordinates, 0 being the centre of the first source pixel
+    positions = (target_origin + (np.arange(target_size) + 0.5) * target_step - source_origin) / source_step - 0.5
+    matrix = np.zeros((target_size, source_size))
+    rows = np.arange(target_size)
+
+    if kernel == 'nearest':
+        matrix[rows, np.clip(np.floor(positions + 0.5).astype(int), 0, source_size - 1)] = 1
+        return matrix
+
+    base = np.floor(positions).astype(int)
+    fraction = positions - base
+    if kernel == 'bilinear':
+        taps = {0: 1 - fraction, 1: fraction}
+    else:
+        taps = {offset: _cubic_weight(fraction - offset) for offset in (-1, 0, 1, 2)}
+    for offset, weights in taps.items():
+        # Clamped taps of the edge pixels accumulate on the edge
+        np.add.at(matrix, (rows, np.clip(base + offset, 0, source_size - 1)), weights)
+    return matrix
+
+
+def _cubic_weight(distance, a=-0.5):
+    """Keys cubic convolution kernel, the "cubic" resampling of GDAL."""
+    distance = np.abs(distance)
+    return np.where(distance <= 1, (a + 2) * distance ** 3 - (a + 3) * distance ** 2 + 1,
+                    np.where(distance < 2, a * distance ** 3 - 5 * a * distance ** 2 + 8 * a * distance - 4 * a, 0))
+
+
+def write_upsampled(array, source_bbox, target_bbox, target_size, crs, output_path, bands_metadata,
+                    kernel='bilinear', output_profile=None, strip_rows=512):
+    """
+    Upsamples a coarse `(height, width, bands)` array onto the grid of `target_size` pixels covering `target_bbox`
+    and writes it as a GeoTIFF with its metadata sidecar, a strip of rows at a time so the full-resolution raster is
+    never in memory. With a scaled-integer encoding in `bands_metadata`, `array` holds the stored integers and the
+    output is stored in the same encoding.
+    """
+    width, height = target_size
+    encoding = encoding_of(bands_metadata)
+    array = decode(array, encoding)
+    with open_raster_for_write(output_path, output_profile, width=width, height=height, count=array.shape[2],
+                               dtype=encoding['dtype'] if encoding else 'float32', crs=rasterio_CRS.from_epsg(crs),
+                               transform=from_bounds(*target_bbox, width, height)) as dst:
+        set_encoding(dst, encoding)
+        for row_start in range(0, height, strip_rows):
+            row_stop = min(height, row_start + strip_rows)
+            strip = upsample(array, source_bbox, target_bbox, (width, height), kernel, rows=(row_start, row_stop))
+            dst.write(np.moveaxis(encode(strip, encoding), -1, 0),
+                      window=Window(0, row_start, width, row_stop - row_start))
+    save_metadata(output_path, bands_metadata)
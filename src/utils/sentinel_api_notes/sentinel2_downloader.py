@@ -2,6 +2,7 @@ from sentinel_authenticator import authenticate_session
 from sentinel_search import search_satellite_imagery
 import secrets
 from gis_helpers import save_as_geotiff
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry
 
 class Sentinel2Downloader:
     def __init__(self, client_id, client_secret, bbox, time_range, bands, satellite_type="sentinel-2-l1c"):
@@ -84,12 +85,11 @@ class Sentinel2Downloader:
     def download_data(self, time_range):
         """Download data using the Process API."""
         self.update_payload_time(time_range)
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/process',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/process', SENTINEL_HUB_RETRY_POLICY,
             headers={"Authorization": f"Bearer {self.token}", "Accept": "image/tiff"},
             json=self.payload_template
         )
-        response.raise_for_status()
         return response.content
 
 
@@ -131,6 +131,4 @@ if __name__ == "__main__":
         #data.save_data(f"../data/Sentinel-2/{date}_{downloader.satellite_type}.tiff")
         with open(f"../data/Sentinel-2/{date}_{downloader.satellite_type}.tiff", 'wb') as f:
             f.write(data)
-        import pdb
-        pdb.set_trace()
         #save_as_geotiff(data, f"../data/Sentinel-2/{date}_{downloader.satellite_type}.tiff", bbox=bbox, bands=bands)
@@ -2,6 +2,7 @@ from sentinel_authenticator import authenticate_session
 from sentinel_search import search_satellite_imagery
 import secrets
 from gis_helpers import save_as_geotiff
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry
 
 class Sentinel3Downloader:
     def __init__(self, client_id, client_secret, bbox, time_range, band, satellite_type="sentinel-3-slstr"):
@@ -75,12 +76,11 @@ class Sentinel3Downloader:
     def download_data(self, time_range):
         """Download data using the Process API."""
         self.update_payload_time(time_range)
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/process',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/process', SENTINEL_HUB_RETRY_POLICY,
             headers={"Authorization": f"Bearer {self.token}"},
             json=self.payload_template
         )
-        response.raise_for_status()
         return response.content
 
 
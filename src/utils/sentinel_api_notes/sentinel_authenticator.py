@@ -1,5 +1,4 @@
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
+from src.utils.token_manager import get_token_manager
 import secrets
 
 def authenticate_session():
@@ -7,15 +6,9 @@ def authenticate_session():
     client_id = secrets.client_name  # e.g., 'your_client_id'
     client_secret = secrets.client_secret  # e.g., 'your_client_secret'
 
-    # OAuth session setup
-    client = BackendApplicationClient(client_id=client_id)
-    oauth = OAuth2Session(client=client)
-
-    # Obtain the access token
-    token = oauth.fetch_token(
-        token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-        client_secret=client_secret,
-        include_client_id=True
-    )
+    # OAuth session backed by the process-wide token cache
+    token_manager = get_token_manager(client_id, client_secret)
+    token = token_manager.get_token()
+    oauth = token_manager.oauth_session()
 
     return oauth, token
@@ -1,5 +1,6 @@
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
+from src.utils.config import CDSE_BASE_URL
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry, shared_rate_limiter
+from src.utils.token_manager import get_token_manager
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -21,6 +22,7 @@ class SentinelDownloader:
         self.satellite_type = satellite_type
         self.token = None
         self.oauth = None
+        self.rate_limiter = None
         self.evalscript = None
         self.payload = None
 
@@ -39,14 +41,12 @@ class SentinelDownloader:
         """Set up the OAuth session and fetch the access token."""
         # Token
         # https://shapps.dataspace.copernicus.eu/dashboard/#/account/settings
-        client = BackendApplicationClient(client_id=self.client_id)
-        self.oauth = OAuth2Session(client=client)
-        # Get token for the session
-        self.token = self.oauth.fetch_token(
-            token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-            client_secret=self.client_secret,
-            include_client_id=True
-        )
+        # Reuse the process-wide cached token instead of authenticating for every downloader
+        token_manager = get_token_manager(self.client_id, self.client_secret)
+        self.token = token_manager.get_token()
+        self.oauth = token_manager.oauth_session()
+        # Retried requests share the account's rate limit with all other downloads of the process
+        self.rate_limiter = shared_rate_limiter(CDSE_BASE_URL, self.client_id)
 
         # Register compliance hook
         def sentinelhub_compliance_hook(response):
@@ -108,8 +108,9 @@ class SentinelDownloader:
             "filter": "eo:cloud_cover < 30",
             "distinct": "date",
         }
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+            SENTINEL_HUB_RETRY_POLICY, self.rate_limiter,
             headers={"Authorization": f"Bearer {self.token}"},
             json=data,
 
@@ -120,12 +121,12 @@ class SentinelDownloader:
 
     def download_data(self):
         """Download data using the Process API."""
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/process',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/process', SENTINEL_HUB_RETRY_POLICY,
+            self.rate_limiter,
             headers={"Authorization": f"Bearer {self.token}"},
             json=self.payload
         )
-        response.raise_for_status()
         return response.content
 
     def save_data(self, data, filename):
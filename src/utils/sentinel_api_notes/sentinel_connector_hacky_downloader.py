@@ -1,5 +1,5 @@
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry
+from src.utils.token_manager import get_token_manager
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -34,14 +34,10 @@ class SentinelDownloader:
         """Set up the OAuth session and fetch the access token."""
         # Token
         # https://shapps.dataspace.copernicus.eu/dashboard/#/account/settings
-        client = BackendApplicationClient(client_id=self.client_id)
-        self.oauth = OAuth2Session(client=client)
-        # Get token for the session
-        self.token = self.oauth.fetch_token(
-            token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-            client_secret=self.client_secret,
-            include_client_id=True
-        )
+        # Reuse the process-wide cached token instead of authenticating for every downloader
+        token_manager = get_token_manager(self.client_id, self.client_secret)
+        self.token = token_manager.get_token()
+        self.oauth = token_manager.oauth_session()
 
         # Register compliance hook
         def sentinelhub_compliance_hook(response):
@@ -85,8 +81,9 @@ class SentinelDownloader:
             "distinct": "date",
         }
         print(data)
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+            SENTINEL_HUB_RETRY_POLICY,
             headers={"Authorization": f"Bearer {self.token}"},
             json=data,
 
@@ -99,16 +96,12 @@ class SentinelDownloader:
         """Download data using the Process API."""
         self.create_payload(evalscript)
         print(self.payload)
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/process',
+        # 429 and 5xx answers are retried with backoff, other errors are raised
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/process', SENTINEL_HUB_RETRY_POLICY,
             headers={"Authorization": f"Bearer {self.token}", "Accept": "image/tiff"},
             json=self.payload
         )
-        try:
-            response.raise_for_status()
-        except:
-            import pdb
-            pdb.set_trace()
         return response.content
 
     def save_data(self, data, filename):
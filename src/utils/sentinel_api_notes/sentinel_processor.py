@@ -6,6 +6,7 @@ import rasterio
 from rasterio.transform import from_bounds
 from rasterio.crs import CRS
 from gis_helpers import transform_bbox
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry
 
 class SentinelDownloader:
     def __init__(self, authenticator, bbox, time_range, bands, satellite_type):
@@ -86,13 +87,12 @@ class SentinelDownloader:
             # "distinct": "date",  # Remove the 'distinct' parameter
         }
 
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+            SENTINEL_HUB_RETRY_POLICY,
             json=search_payload,
         )
 
-        response.raise_for_status()  # Ensure the response was successful
-
         response_json = response.json()
         features = response_json.get("features", [])
         return features
@@ -100,15 +100,12 @@ class SentinelDownloader:
     def download_data(self):
         """Download data using the Process API."""
         try:
-            response = self.oauth.post(
-                'https://sh.dataspace.copernicus.eu/api/v1/process',
+            response = request_with_retry(
+                self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/process', SENTINEL_HUB_RETRY_POLICY,
                 headers={"Authorization": f"Bearer {self.token}"},
                 json=self.payload
             )
-            response.raise_for_status()
         except Exception as e:
-            import pdb
-            pdb.set_trace()
             print(f"Error during data download: {e}")
             return None
         return response.content
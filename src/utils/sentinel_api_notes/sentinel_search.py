@@ -1,6 +1,7 @@
 # satellite_search.py
 
 from sentinel_authenticator import authenticate_session
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry
 
 class SatelliteSearchEngine:
     """A generic class to handle the search functionality for multiple satellites."""
@@ -37,16 +38,12 @@ class SatelliteSearchEngine:
             "distinct": "date",
         }
 
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+            SENTINEL_HUB_RETRY_POLICY,
             headers={"Authorization": f"Bearer {self.token}"},
             json=search_payload,
         )
-        try:
-            response.raise_for_status()  # Ensure the response was successful
-        except:
-            import pdb
-            pdb.set_trace()
         response_json = response.json()
         features = response_json.get("features", [])
         return features
@@ -1,131 +1,609 @@
+import functools
+import hashlib
 import os
+import threading
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from urllib.parse import urlparse
 
+import requests
 from sentinelhub import BBox, CRS, MimeType, SentinelHubRequest, DataCollection, SentinelHubCatalog, bbox_to_dimensions, \
-    MosaickingOrder
-from src.utils.config import load_config
-from src.utils.gis_helpers import save_tiff_and_metadata
+    MosaickingOrder, SentinelHubDownloadClient
+from sentinelhub.download.handlers import fail_user_errors
+from sentinelhub.download.models import DownloadResponse
+from sentinelhub.exceptions import DownloadFailedException
+from src.utils.config import CDSE_BASE_URL, load_config
+from src.utils.download_manifest import DownloadManifest, remove_partial_files
+from src.utils.gis_helpers import save_tiff_and_metadata, save_metadata, open_raster_for_write, \
+    get_default_output_profile
+import rasterio
+from rasterio.crs import CRS as rasterio_CRS
 from rasterio.transform import from_bounds
+import numpy as np
 
-from src.utils.helper_functions import normalize_to_weeks
+from src.utils.helper_functions import file_sha256, normalize_to_weeks
+from src.utils.http_client import RetryPolicy, SENTINEL_HUB_RETRY_AFTER_UNIT, estimate_processing_units, \
+    pooled_session, request_with_retry, shared_rate_limiter
+from src.utils.raster_storage import SCALED_ENCODINGS, check_storage, encoding_of, scaled_metadata, set_encoding
+from src.utils.resampling import KERNELS, SENTINEL3_NATIVE_RESOLUTION, coarse_grid, write_upsampled
+from src.utils.tiling import MAX_TILE_PIXELS, tile_grid
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+class _HostRequests:
+    """Number of requests in flight against one host, shared by every caller sending requests to it."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+
+class _HostSemaphore:
+    """Context manager admitting a request to a host while fewer than `limit` of its requests are in flight."""
+
+    def __init__(self, host, limit):
+        self._host = host
+        self._limit = limit
+
+    def __enter__(self):
+        with self._host.condition:
+            self._host.condition.wait_for(lambda: self._host.in_flight < self._limit)
+            self._host.in_flight += 1
+
+    def __exit__(self, *exc_info):
+        with self._host.condition:
+            self._host.in_flight -= 1
+            self._host.condition.notify_all()
+
+
+def host_semaphore(url, limit):
+    """
+    Returns a semaphore capping the number of concurrent requests sent to the host of `url`. The count of requests in
+    flight is process-wide per host, so callers with different limits share it: each of them only sends a request
+    while fewer than its own `limit` requests are in flight against the host in total.
+
+    :param url: Service URL the requests are sent to.
+    :param limit: Maximum number of requests allowed in flight against that host at the same time.
+    """
+    netloc = urlparse(url).netloc
+    with _hosts_lock:
+        if netloc not in _hosts:
+            _hosts[netloc] = _HostRequests()
+        return _HostSemaphore(_hosts[netloc], limit)
+
+
+def _data_collection(collection, name, service_url):
+    """
+    Returns `collection` defined for `service_url`. sentinelhub rejects redefining a collection name with another
+    service URL, so collections for other services than CDSE (e.g. `MockSentinelHub`) get a name per URL.
+    """
+    if service_url != CDSE_BASE_URL:
+        name = f"{name}_{hashlib.sha1(service_url.encode()).hexdigest()[:8]}"
+    return collection.define_from(name, service_url=service_url)
+
+
+SENTINEL2_BANDS_METADATA = {"bands": ["B03", "B04", "B08", "B11"]}
+SENTINEL3_BANDS_METADATA = {"bands": ["S8", "S9"]}
+# Bands of the Sentinel-2 and Sentinel-3 products in the 6-band raster of `download_s2_s3_fused_data`
+FUSED_BAND_SLICES = {'sentinel-2': slice(0, 4), 'sentinel-3': slice(4, 6)}
+# Quantity of the bands of each product, which selects its encoding in scaled storage
+STORED_QUANTITIES = {'sentinel-2': 'reflectance', 'sentinel-3': 'temperature'}
+
+
+def _evalscript(template, storage):
+    """
+    Fills the output sample type and the factors scaling each quantity into an evalscript template. Scaled storage
+    lets Sentinel Hub return UINT16 in the encodings of `raster_storage.SCALED_ENCODINGS` (all with offset 0), float32
+    storage returns the values as they are.
+    """
+    if storage == 'float32':
+        return template % {'sample_type': 'FLOAT32', 'reflectance': '', 'temperature': ''}
+    return template % {'sample_type': 'UINT16',
+                       'reflectance': f" * {1 / SCALED_ENCODINGS['reflectance']['scale']:g}",
+                       'temperature': f" * {1 / SCALED_ENCODINGS['temperature']['scale']:g}"}
+
+
+def select_bands(array, bands):
+    """Returns the `bands` (a slice of the last axis) of a `(height, width, bands)` array, all of them if `None`."""
+    return array if bands is None else array[:, :, bands]
+
+
+def _output_grid(resolution, size):
+    """Returns the SentinelHubRequest grid arguments: an exact pixel `size` if given, otherwise the `resolution`."""
+    if size is not None:
+        return {'size': size}
+    return {'resolution': (resolution, resolution)}
+
+
+def _processing_units(bbox_coordinates, crs, resolution, size, input_bands, storage='float32'):
+    """Estimated processing units of a Process API request, see `http_client.estimate_processing_units`."""
+    width, height = size if size is not None else bbox_to_dimensions(BBox(bbox_coordinates, crs=CRS(crs)),
+                                                                      resolution=resolution)
+    return estimate_processing_units(width, height, input_bands, 'FLOAT32' if storage == 'float32' else 'UINT16')
+
+
+class _RetryingDownloadClient(SentinelHubDownloadClient):
+    """
+    sentinelhub download client that sends its requests through the pooled session, `RetryPolicy` and `RateLimiter`
+    of `http_client`, instead of opening a connection per request and retrying at sentinelhub's fixed intervals.
+    """
+
+    def __init__(self, *, retry_policy, rate_limiter, processing_units=0, **kwargs):
+        super().__init__(**kwargs)
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.processing_units = processing_units
+
+    @fail_user_errors
+    def _execute_download(self, request):
+        try:
+            response = request_with_retry(pooled_session(), request.request_type.value, request.url,
+                                          self.retry_policy, self.rate_limiter, self.processing_units,
+                                          json=request.post_values, headers=self._prepare_headers(request),
+                                          timeout=self.config.download_timeout_seconds)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise DownloadFailedException(f"Download from {request.url} failed: {e}", request_exception=e) from e
+        except requests.HTTPError as e:
+            if e.response.status_code not in self.retry_policy.retry_statuses:
+                raise
+            raise DownloadFailedException(f"Download from {request.url} failed after "
+                                          f"{self.retry_policy.max_attempts} attempts: {e}",
+                                          request_exception=e) from e
+        return DownloadResponse.from_response(response, request)
 
 
 class SentinelData:
-    def __init__(self, api_keys=False):
-        if api_keys:
-            self.config = load_config(api_keys)
-        else:
-            self.config = load_config()
-
-    def download_sentinel2_data(self, bbox_coordinates, crs, date_range, resolution):
-        evalscript = """
+    def __init__(self, api_keys=False, cache=None, catalog_index=None, output_profile=None, base_url=None,
+                 token_url=None, rate_limiter=None, retry_policy=None, storage='float32', token_cache_dir=None):
+        """
+        :param api_keys: Optional dictionary with `client_name` and `client_secret`, otherwise the secrets module is used.
+        :param cache: Optional `DownloadCache`. Identical Process API requests are then served from local disk.
+        :param catalog_index: Optional `CatalogIndex`. Catalog searches then only query days not searched before.
+        :param output_profile: Output profile of the downloaded rasters, see `gis_helpers.OUTPUT_PROFILES`.
+        :param base_url: Sentinel Hub service URL, see `config.service_urls`.
+        :param token_url: Token endpoint URL, see `config.service_urls`.
+        :param rate_limiter: `http_client.RateLimiter` every catalog and Process API request waits for. Defaults to
+            the one shared by all downloads of the account in this process, set to the CDSE quota.
+        :param retry_policy: `http_client.RetryPolicy` of failed requests. Rate limit and server errors are retried
+            with jittered exponential backoff, honouring `Retry-After`.
+        :param storage: 'float32', or 'scaled' to download and store reflectances and brightness temperatures as
+            UINT16 with the scale factors of `raster_storage.SCALED_ENCODINGS`, half the bytes of float32. The
+            download functions then return the UINT16 arrays.
+        :param token_cache_dir: Directory of the on-disk token cache shared with other processes, e.g.
+            `token_manager.DEFAULT_TOKEN_CACHE_DIR`. `None` keeps the token in memory only.
+        """
+        check_storage(storage)
+        self.config = load_config(api_keys, token_cache_dir=token_cache_dir, base_url=base_url, token_url=token_url)
+        self.cache = cache
+        self.catalog_index = catalog_index
+        self.output_profile = output_profile
+        self.rate_limiter = rate_limiter or shared_rate_limiter(self.config.sh_base_url, self.config.sh_client_id)
+        self.retry_policy = retry_policy or RetryPolicy(retry_after_unit=SENTINEL_HUB_RETRY_AFTER_UNIT)
+        self.storage = storage
+
+    def bands_metadata(self, product):
+        """Band metadata of the 'sentinel-2' or 'sentinel-3' rasters, with their encoding in scaled storage."""
+        bands_metadata = SENTINEL2_BANDS_METADATA if product == 'sentinel-2' else SENTINEL3_BANDS_METADATA
+        return scaled_metadata(bands_metadata, STORED_QUANTITIES[product], self.storage)
+
+    def download_sentinel2_data(self, bbox_coordinates, crs, date_range, resolution, size=None):
+        evalscript = _evalscript("""
         //VERSION=3
         function setup() {
             return {
                 input: [{ bands: ["B03", "B04", "B08", "B11"], units: ["REFLECTANCE", "REFLECTANCE", "REFLECTANCE", "REFLECTANCE"]}],
-                output: { bands: 4, sampleType: "FLOAT32" }
+                output: { bands: 4, sampleType: "%(sample_type)s" }
             };
         }
     
         function evaluatePixel(sample) {
-            return [sample.B03, sample.B04, sample.B08, sample.B11];
+            return [sample.B03%(reflectance)s, sample.B04%(reflectance)s, sample.B08%(reflectance)s, sample.B11%(reflectance)s];
         }
-        """
+        """, self.storage)
 
-        request = SentinelHubRequest(
-            evalscript=evalscript,
-            input_data=[
-                SentinelHubRequest.input_data(
-                    data_collection=DataCollection.SENTINEL2_L1C.define_from("s2l1c", service_url=self.config.sh_base_url),
-                    time_interval=date_range,
-                    mosaicking_order=MosaickingOrder.LEAST_CC,
-                )
-            ],
-            responses=[
-                SentinelHubRequest.output_response('default', MimeType.TIFF)
-            ],
-            bbox=BBox(bbox_coordinates, crs=CRS(crs)),
-            resolution=(resolution, resolution),
-            config=self.config
-        )
-
-        return request.get_data()[0]
-
-    def download_sentinel3_data(self, bbox_coordinates, crs, date_range, resolution):
-        evalscript = """
+        def create_request():
+            return SentinelHubRequest(
+                evalscript=evalscript,
+                input_data=[
+                    SentinelHubRequest.input_data(
+                        data_collection=_data_collection(DataCollection.SENTINEL2_L1C, "s2l1c", self.config.sh_base_url),
+                        time_interval=date_range,
+                        mosaicking_order=MosaickingOrder.LEAST_CC,
+                    )
+                ],
+                responses=[
+                    SentinelHubRequest.output_response('default', MimeType.TIFF)
+                ],
+                bbox=BBox(bbox_coordinates, crs=CRS(crs)),
+                config=self.config,
+                **_output_grid(resolution, size)
+            )
+
+        return self._get_data(create_request, _processing_units(bbox_coordinates, crs, resolution, size, 4, self.storage),
+                              collection="sentinel-2-l1c", evalscript=evalscript,
+                              bbox=[float(c) for c in bbox_coordinates], crs=str(crs), time_interval=date_range,
+                              resolution=resolution, size=size, mosaicking_order=MosaickingOrder.LEAST_CC.value)
+
+    def download_sentinel3_data(self, bbox_coordinates, crs, date_range, resolution, size=None):
+        evalscript = _evalscript("""
         //VERSION=3
         function setup() {
             return {
                 input: [{ bands: ["S8", "S9"], units: ["BRIGHTNESS_TEMPERATURE", "BRIGHTNESS_TEMPERATURE"] }],
-                output: { bands: 2, sampleType: "FLOAT32" }
+                output: { bands: 2, sampleType: "%(sample_type)s" }
             };
         }
     
         function evaluatePixel(sample) {
-            return [sample.S8, sample.S9];
+            return [sample.S8%(temperature)s, sample.S9%(temperature)s];
+        }
+        """, self.storage)
+
+        def create_request():
+            return SentinelHubRequest(
+                evalscript=evalscript,
+                input_data=[
+                    SentinelHubRequest.input_data(
+                        data_collection=_data_collection(DataCollection.SENTINEL3_SLSTR, "s3slstr", self.config.sh_base_url),
+                        time_interval=date_range
+                    )
+                ],
+                responses=[
+                    SentinelHubRequest.output_response('default', MimeType.TIFF)
+                ],
+                bbox=BBox(bbox_coordinates, crs=CRS(crs)),
+                config=self.config,
+                **_output_grid(resolution, size)
+            )
+
+        return self._get_data(create_request, _processing_units(bbox_coordinates, crs, resolution, size, 2, self.storage),
+                              collection="sentinel-3-slstr", evalscript=evalscript,
+                              bbox=[float(c) for c in bbox_coordinates], crs=str(crs), time_interval=date_range,
+                              resolution=resolution, size=size, mosaicking_order=None)
+
+    def download_s2_s3_fused_data(self, bbox_coordinates, crs, date_range, resolution, size=None):
+        """
+        Downloads Sentinel-2 and Sentinel-3 in one data fusion request and returns a 6-band array: B03, B04, B08 and
+        B11 as `download_sentinel2_data` returns them, followed by S8 and S9 as `download_sentinel3_data` returns
+        them. See `FUSED_BAND_SLICES` to split it into the two products.
+        """
+        evalscript = _evalscript("""
+        //VERSION=3
+        function setup() {
+            return {
+                input: [
+                    { datasource: "s2", bands: ["B03", "B04", "B08", "B11"], units: ["REFLECTANCE", "REFLECTANCE", "REFLECTANCE", "REFLECTANCE"] },
+                    { datasource: "s3", bands: ["S8", "S9"], units: ["BRIGHTNESS_TEMPERATURE", "BRIGHTNESS_TEMPERATURE"] }
+                ],
+                output: { bands: 6, sampleType: "%(sample_type)s" }
+            };
+        }
+
+        function evaluatePixel(samples) {
+            // A collection without data is returned as zeros, like in a request of its own
+            var s2 = samples.s2.length ? samples.s2[0] : { B03: 0, B04: 0, B08: 0, B11: 0 };
+            var s3 = samples.s3.length ? samples.s3[0] : { S8: 0, S9: 0 };
+            return [s2.B03%(reflectance)s, s2.B04%(reflectance)s, s2.B08%(reflectance)s, s2.B11%(reflectance)s,
+                    s3.S8%(temperature)s, s3.S9%(temperature)s];
         }
+        """, self.storage)
+
+        def create_request():
+            return SentinelHubRequest(
+                evalscript=evalscript,
+                input_data=[
+                    SentinelHubRequest.input_data(
+                        data_collection=_data_collection(DataCollection.SENTINEL2_L1C, "s2l1c", self.config.sh_base_url),
+                        identifier="s2",
+                        time_interval=date_range,
+                        mosaicking_order=MosaickingOrder.LEAST_CC,
+                    ),
+                    SentinelHubRequest.input_data(
+                        data_collection=_data_collection(DataCollection.SENTINEL3_SLSTR, "s3slstr", self.config.sh_base_url),
+                        identifier="s3",
+                        time_interval=date_range
+                    )
+                ],
+                responses=[
+                    SentinelHubRequest.output_response('default', MimeType.TIFF)
+                ],
+                bbox=BBox(bbox_coordinates, crs=CRS(crs)),
+                config=self.config,
+                **_output_grid(resolution, size)
+            )
+
+        return self._get_data(create_request, _processing_units(bbox_coordinates, crs, resolution, size, 6, self.storage),
+                              collection="sentinel-2-l1c+sentinel-3-slstr", evalscript=evalscript,
+                              bbox=[float(c) for c in bbox_coordinates], crs=str(crs), time_interval=date_range,
+                              resolution=resolution, size=size, mosaicking_order=MosaickingOrder.LEAST_CC.value)
+
+    def _get_data(self, create_request, processing_units, **request_params):
         """
+        Returns the first response of the request built by `create_request`, using the download cache if configured.
+
+        :param processing_units: Estimated processing units of the request, taken from the rate limiter.
+        :param request_params: Everything that determines the response; hashed into the cache key.
+        """
+        def fetch():
+            request = create_request()
+            request.download_client_class = self._download_client_class(processing_units)
+            return request.get_data()[0]
+
+        if self.cache is None:
+            return fetch()
 
-        request = SentinelHubRequest(
-            evalscript=evalscript,
-            input_data=[
-                SentinelHubRequest.input_data(
-                    data_collection=DataCollection.SENTINEL3_SLSTR.define_from("s3slstr", service_url=self.config.sh_base_url),
-                    time_interval=date_range
-                )
-            ],
-            responses=[
-                SentinelHubRequest.output_response('default', MimeType.TIFF)
-            ],
-            bbox=BBox(bbox_coordinates, crs=CRS(crs)),
-            resolution=(resolution, resolution),
-            config=self.config
-        )
-
-        return request.get_data()[0]
+        cache_key = self.cache.make_key(service_url=self.config.sh_base_url, **request_params)
+        data = self.cache.get(cache_key)
+        if data is None:
+            data = fetch()
+            self.cache.put(cache_key, data)
+        return data
+
+    def _download_client_class(self, processing_units=0):
+        return functools.partial(_RetryingDownloadClient, retry_policy=self.retry_policy,
+                                 rate_limiter=self.rate_limiter, processing_units=processing_units)
 
     def search_data(self, bbox_coordinates, crs, date_range, filter='eo:cloud_cover < 50'):
         aoi_bbox = BBox(bbox_coordinates, crs=CRS(crs))
         catalog = SentinelHubCatalog(config=self.config)
+        catalog.client = self._download_client_class()(config=self.config)
 
-        sentinel2_search = catalog.search(DataCollection.SENTINEL2_L2A, bbox=aoi_bbox, time=date_range,
-                                          filter=filter, )
-        sentinel3_search = catalog.search(DataCollection.SENTINEL3_SLSTR, bbox=aoi_bbox, time=date_range,
-                                          filter=filter, )
-
-        dates_sentinel2 = set([item['properties']['datetime'][:10] for item in sentinel2_search])
-        dates_sentinel3 = set([item['properties']['datetime'][:10] for item in sentinel3_search])
+        dates_sentinel2 = self._search_dates(catalog, DataCollection.SENTINEL2_L2A, aoi_bbox, date_range, filter)
+        dates_sentinel3 = self._search_dates(catalog, DataCollection.SENTINEL3_SLSTR, aoi_bbox, date_range, filter)
         common_dates = list(sorted(dates_sentinel2.intersection(dates_sentinel3)))
 
         return {"sentinel_2": dates_sentinel2, "sentinel_3": dates_sentinel3, "common_dates": common_dates}
 
-    def download_s2_s3_data_pack(self, bbox_coordinates, crs, date_range, resolution, out_dir, filter='eo:cloud_cover < 50'):
+    def _search_dates(self, catalog, collection, aoi_bbox, date_range, filter):
+        """
+        Returns the set of ISO dates on which the catalog has items of `collection` for the AOI.
+
+        The catalog is asked for distinct dates only, instead of full STAC items. With a catalog index, only the day
+        spans that were never searched for this collection, AOI and filter are sent to the catalog.
+        """
+        def query(time_interval):
+            return {str(date)[:10] for date in catalog.search(collection, bbox=aoi_bbox, time=time_interval,
+                                                              filter=filter, distinct='date')}
+
+        if self.catalog_index is None:
+            return query(date_range)
+
+        aoi = self.catalog_index.aoi_key(list(aoi_bbox), aoi_bbox.crs.epsg)
+        start_date, end_date = str(date_range[0])[:10], str(date_range[1])[:10]
+        for span_start, span_end in self.catalog_index.missing_spans(collection.api_id, aoi, filter, start_date, end_date):
+            found = query((span_start, span_end))
+            self.catalog_index.record(collection.api_id, aoi, filter, span_start, span_end, found)
+        return self.catalog_index.dates(collection.api_id, aoi, filter, start_date, end_date)
+
+    def download_s2_s3_data_pack(self, bbox_coordinates, crs, date_range, resolution, out_dir, filter='eo:cloud_cover < 50',
+                                 max_workers=1, max_requests_per_host=4, max_tile_pixels=MAX_TILE_PIXELS, progress=None,
+                                 resume=True, fused=False, sentinel3_resolution=None, sentinel3_kernel='bilinear'):
+        """
+        Downloads a Sentinel-2 and a Sentinel-3 raster for every day on which both collections have data.
+
+        Completed rasters are recorded in the `DownloadManifest` of `out_dir`. With `resume`, a rerun skips every
+        raster that was completely downloaded with the same parameters and downloads only missing or corrupt ones.
+
+        :param max_workers: Number of day requests run in parallel. The default of 1 downloads serially.
+        :param max_requests_per_host: Upper bound of requests in flight against the Sentinel Hub host, shared by all
+            downloads of this process.
+        :param max_tile_pixels: AOIs wider or higher than this many pixels are downloaded as a grid of tiles.
+        :param progress: Optional `progress(done, total, item)` callback, called after every downloaded raster.
+        :param resume: Skip the rasters the download manifest records as complete.
+        :param fused: Download both rasters of a day in one data fusion request (see `download_s2_s3_fused_data`)
+            and split it locally, halving the number of requests.
+        :param sentinel3_resolution: Download Sentinel-3 at this coarser resolution in CRS units, or `'native'` for
+            the 1 km of the SLSTR thermal bands, and upsample it locally onto the Sentinel-2 grid. The coarse rasters
+            are kept in `Sentinel-3-<resolution>m`. `None` downloads Sentinel-3 at `resolution`.
+        :param sentinel3_kernel: Kernel upsampling the coarse Sentinel-3 rasters, one of `resampling.KERNELS`.
+        """
+        if sentinel3_resolution is not None and fused:
+            raise ValueError("Fused downloads return Sentinel-3 on the Sentinel-2 grid, they cannot be combined with "
+                             "a coarse sentinel3_resolution")
+        if sentinel3_kernel not in KERNELS:
+            raise ValueError(f"Unknown resampling kernel '{sentinel3_kernel}', expected one of {KERNELS}")
 
         available_data = self.search_data(bbox_coordinates, crs, date_range, filter=filter)
-        aoi_bbox = BBox(bbox=bbox_coordinates, crs=CRS(crs))
-        aoi_size = bbox_to_dimensions(aoi_bbox, resolution=resolution)
-        transform = from_bounds(*aoi_bbox, aoi_size[0], aoi_size[1])
-        bands_metadata_sentinel2 = {"bands": ["B03", "B04", "B08", "B11"]}
         Path(os.path.join(out_dir,"Sentinel-2")).mkdir(parents=True, exist_ok=True)
         Path(os.path.join(out_dir, "Sentinel-3")).mkdir(parents=True, exist_ok=True)
 
+        jobs = []
         for day in available_data['common_dates']:
             current_day_range = (day+'T00:00:00Z', day+'T23:59:59.9Z')
-            sentinel_2_data_array = self.download_sentinel2_data(bbox_coordinates, crs, current_day_range, resolution)
-            save_tiff_and_metadata(sentinel_2_data_array, transform, crs, f"{out_dir}/Sentinel-2/s2_{day}.tiff", bands_metadata_sentinel2)
+            sentinel2_output = (f"{out_dir}/Sentinel-2/s2_{day}.tiff", None, self.bands_metadata('sentinel-2'))
+            sentinel3_output = (f"{out_dir}/Sentinel-3/s3_{day}.tiff", None, self.bands_metadata('sentinel-3'))
+            if fused:
+                jobs.append((self.download_s2_s3_fused_data, current_day_range, [
+                    (sentinel2_output[0], FUSED_BAND_SLICES['sentinel-2'], self.bands_metadata('sentinel-2')),
+                    (sentinel3_output[0], FUSED_BAND_SLICES['sentinel-3'], self.bands_metadata('sentinel-3'))]))
+            else:
+                jobs.append((self.download_sentinel2_data, current_day_range, [sentinel2_output]))
+                if sentinel3_resolution is None:
+                    jobs.append((self.download_sentinel3_data, current_day_range, [sentinel3_output]))
 
-            sentinel_3_data_array = self.download_sentinel3_data(bbox_coordinates, crs, current_day_range, resolution)
-            save_tiff_and_metadata(sentinel_3_data_array, transform, crs, f"{out_dir}/Sentinel-3/s3_{day}.tiff",
-                                   bands_metadata_sentinel2)
+        manifest = DownloadManifest(out_dir)
+        self._run_downloads(jobs, bbox_coordinates, crs, resolution, self.bands_metadata('sentinel-2'), max_workers,
+                            max_requests_per_host, max_tile_pixels, progress, manifest, resume)
+        if sentinel3_resolution is not None:
+            self._download_sentinel3_upsampled(available_data['common_dates'], bbox_coordinates, crs, resolution,
+                                               out_dir, sentinel3_resolution, sentinel3_kernel, max_workers,
+                                               max_requests_per_host, progress, manifest, resume)
+
+    def _download_sentinel3_upsampled(self, days, bbox_coordinates, crs, resolution, out_dir, sentinel3_resolution,
+                                      kernel, max_workers, max_requests_per_host, progress, manifest, resume):
+        """
+        Downloads the Sentinel-3 rasters of `days` on a coarse grid and upsamples them onto the Sentinel-2 grid of the
+        AOI as `Sentinel-3/s3_<day>.tiff`. A coarse raster is only downloaded again if it is missing, so changing the
+        kernel or the Sentinel-2 resolution only repeats the local upsampling.
+        """
+        if sentinel3_resolution == 'native':
+            sentinel3_resolution = SENTINEL3_NATIVE_RESOLUTION
+        coarse_bbox, _ = coarse_grid(bbox_coordinates, sentinel3_resolution)
+        coarse_dir = os.path.join(out_dir, f"Sentinel-3-{sentinel3_resolution:g}m")
+        Path(coarse_dir).mkdir(parents=True, exist_ok=True)
+        coarse_jobs = [(self.download_sentinel3_data, (day + 'T00:00:00Z', day + 'T23:59:59.9Z'),
+                        [(os.path.join(coarse_dir, f"s3_{day}.tiff"), None, self.bands_metadata('sentinel-3'))])
+                       for day in days]
+        self._run_downloads(coarse_jobs, list(coarse_bbox), crs, sentinel3_resolution,
+                            self.bands_metadata('sentinel-3'), max_workers, max_requests_per_host, progress=progress,
+                            manifest=manifest, resume=resume)
 
-    def download_s2_data_weekly(self, bbox_coordinates, crs, date_range, resolution, out_dir):
+        target_size = bbox_to_dimensions(BBox(bbox_coordinates, crs=CRS(crs)), resolution=resolution)
+        output_profile = self.output_profile or get_default_output_profile()
+
+        def upsample_day(day):
+            coarse_path = os.path.join(coarse_dir, f"s3_{day}.tiff")
+            output_path = os.path.join(out_dir, "Sentinel-3", f"s3_{day}.tiff")
+            request_hash = manifest.request_hash(
+                product='sentinel3_upsampled', source=file_sha256(coarse_path), kernel=kernel,
+                bbox=[float(c) for c in bbox_coordinates], crs=str(crs), resolution=resolution,
+                output_profile=output_profile)
+            if resume and manifest.is_complete(output_path, request_hash):
+                return
+            with rasterio.open(coarse_path) as src:
+                coarse_array = np.moveaxis(src.read(), 0, -1)
+                source_bbox = tuple(src.bounds)
+            remove_partial_files(output_path)
+            write_upsampled(coarse_array, source_bbox, bbox_coordinates, target_size, crs, output_path,
+                            self.bands_metadata('sentinel-3'), kernel, self.output_profile)
+            manifest.record(output_path, request_hash)
+
+        _run_in_pool(upsample_day, [(day,) for day in days], max_workers)
+
+    def download_s2_data_weekly(self, bbox_coordinates, crs, date_range, resolution, out_dir, max_workers=1,
+                                max_requests_per_host=4, max_tile_pixels=MAX_TILE_PIXELS, progress=None, resume=True):
+        Path(os.path.join(out_dir, "Sentinel-2-weeks")).mkdir(parents=True, exist_ok=True)
+        weeks = normalize_to_weeks(date_range)
+        jobs = [(self.download_sentinel2_data, week, f"{out_dir}/Sentinel-2-weeks/s2_{week[0]}-{week[1]}.tiff")
+                for week in weeks]
+        self._run_downloads(jobs, bbox_coordinates, crs, resolution, self.bands_metadata('sentinel-2'), max_workers,
+                            max_requests_per_host, max_tile_pixels, progress, DownloadManifest(out_dir), resume)
+
+    def _run_downloads(self, jobs, bbox_coordinates, crs, resolution, bands_metadata, max_workers,
+                       max_requests_per_host, max_tile_pixels=MAX_TILE_PIXELS, progress=None, manifest=None,
+                       resume=True):
+        """
+        Executes `(download_function, date_range, output_path)` jobs, serially or on a bounded thread pool.
+
+        Instead of a single path, a job can write several rasters from one response, given as a list of
+        `(output_path, bands, bands_metadata)` with `bands` a slice of the response bands (`None` for all of them).
+        AOIs exceeding `max_tile_pixels` are split into a tile grid and each job downloads its tiles in parallel.
+        The first failing job is re-raised after the jobs that have not started yet are cancelled. Finished jobs are
+        recorded in `manifest`, and with `resume` the jobs it records as complete are skipped.
+        """
+        jobs = [(download_function, job_date_range,
+                 [(outputs, None, bands_metadata)] if isinstance(outputs, str) else list(outputs))
+                for download_function, job_date_range, outputs in jobs]
+        semaphore = host_semaphore(self.config.sh_base_url, max_requests_per_host)
         aoi_bbox = BBox(bbox=bbox_coordinates, crs=CRS(crs))
         aoi_size = bbox_to_dimensions(aoi_bbox, resolution=resolution)
         transform = from_bounds(*aoi_bbox, aoi_size[0], aoi_size[1])
-        bands_metadata_sentinel2 = {"bands": ["B03", "B04", "B08", "B11"]}
-        Path(os.path.join(out_dir, "Sentinel-2-weeks")).mkdir(parents=True, exist_ok=True)
-        weeks = normalize_to_weeks(date_range)
-        for week in weeks:
-            sentinel_2_mosaic_data_array = self.download_sentinel2_data(bbox_coordinates, crs, week, resolution)
-            save_tiff_and_metadata(sentinel_2_mosaic_data_array, transform, crs, f"{out_dir}/Sentinel-2-weeks/s2_{week[0]}-{week[1]}.tiff",
-                                   bands_metadata_sentinel2)
+        tiles = tile_grid(aoi_size[0], aoi_size[1], transform, max_tile_pixels)
+
+        request_hashes = {}
+        if manifest is not None:
+            output_profile = self.output_profile or get_default_output_profile()
+            # Only scaled storage is hashed, so the manifests of float32 downloads stay valid
+            storage = {'storage': self.storage} if self.storage != 'float32' else {}
+            for download_function, job_date_range, outputs in jobs:
+                request_hash = manifest.request_hash(
+                    product=download_function.__name__, bbox=[float(c) for c in bbox_coordinates], crs=str(crs),
+                    time_interval=job_date_range, resolution=resolution, max_tile_pixels=max_tile_pixels,
+                    output_profile=output_profile, service_url=self.config.sh_base_url, **storage)
+                for output_path, _, _ in outputs:
+                    request_hashes[output_path] = request_hash
+            if resume:
+                remaining = [job for job in jobs
+                             if not all(manifest.is_complete(path, request_hashes[path]) for path, _, _ in job[2])]
+                if len(remaining) < len(jobs):
+                    print(f"Skipping {len(jobs) - len(remaining)} of {len(jobs)} rasters completed by an earlier run")
+                jobs = remaining
+
+        def run_job(download_function, job_date_range, outputs):
+            for output_path, _, _ in outputs:
+                remove_partial_files(output_path)
+            if len(tiles) > 1:
+                self._download_tiles(download_function, tiles, crs, job_date_range, transform, aoi_size, outputs,
+                                     semaphore, max(max_workers, max_requests_per_host))
+            else:
+                with semaphore:
+                    data_array = download_function(bbox_coordinates, crs, job_date_range, resolution)
+                for output_path, bands, output_metadata in outputs:
+                    save_tiff_and_metadata(select_bands(data_array, bands), transform, crs, output_path,
+                                           output_metadata, self.output_profile)
+            if manifest is not None:
+                for output_path, _, _ in outputs:
+                    manifest.record(output_path, request_hashes[output_path])
+
+        def report(done, total, job):
+            if progress is not None:
+                progress(done, total, ', '.join(os.path.basename(output_path) for output_path, _, _ in job[2]))
+
+        _run_in_pool(run_job, jobs, max_workers, report)
+
+    def _download_tiles(self, download_function, tiles, crs, date_range, transform, aoi_size, outputs,
+                        semaphore, max_workers):
+        """
+        Downloads the tiles of one product in parallel and writes each tile into its window of the output rasters
+        (see `_run_downloads` for `outputs`) as soon as it arrives, so neither the full mosaic nor all tiles are held
+        in memory.
+        """
+        def download_tile(window, tile_bbox):
+            with semaphore:
+                return download_function(list(tile_bbox), crs, date_range, None,
+                                         size=(int(window.width), int(window.height)))
+
+        # Tiles are downloaded on the pool but written from this thread, which owns the output dataset. Each finished
+        # tile is dropped right after it is written.
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            pending = {executor.submit(download_tile, window, tile_bbox): window for window, tile_bbox in tiles}
+            with ExitStack() as stack:
+                datasets = None
+                for future in as_completed(list(pending)):
+                    window = pending.pop(future)
+                    tile_array = future.result()
+                    if datasets is None:
+                        datasets = [stack.enter_context(open_raster_for_write(
+                            output_path, self.output_profile, width=aoi_size[0], height=aoi_size[1],
+                            count=select_bands(tile_array, bands).shape[2], dtype=tile_array.dtype,
+                            crs=rasterio_CRS.from_epsg(crs), transform=transform, tiled=True, blockxsize=256,
+                            blockysize=256)) for output_path, bands, _ in outputs]
+                        for dst, (_, _, output_metadata) in zip(datasets, outputs):
+                            set_encoding(dst, encoding_of(output_metadata))
+                    for dst, (_, bands, _) in zip(datasets, outputs):
+                        dst.write(np.moveaxis(select_bands(tile_array, bands), -1, 0), window=window)
+                    del tile_array
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        for output_path, _, output_metadata in outputs:
+            save_metadata(output_path, output_metadata)
+            print(f"Mosaic of {len(tiles)} tiles saved to {output_path}")
+
+
+def _run_in_pool(function, jobs, max_workers, progress=None):
+    """
+    Calls `function(*job)` for each job, serially if `max_workers` is 1 or less and on a thread pool otherwise.
+
+    `progress(done, total, job)` is called from the calling thread after each finished job. The first exception,
+    raised by a job or by `progress`, is re-raised after the jobs that have not started yet are cancelled.
+    """
+    if max_workers <= 1:
+        for done, job in enumerate(jobs, start=1):
+            function(*job)
+            if progress is not None:
+                progress(done, len(jobs), job)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(function, *job): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            if progress is not None:
+                progress(done, len(jobs), futures[future])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,7 +1,7 @@
 import requests
-from oauthlib.oauth2 import BackendApplicationClient
 from rasterio import MemoryFile
-from requests_oauthlib import OAuth2Session
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry
+from src.utils.token_manager import get_token_manager
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -12,7 +12,6 @@ from rasterio.crs import CRS
 from pyproj import Transformer  # For coordinate transformation
 import secrets
 
-
 from pyproj import Transformer
 
 def convert_bbox_epsg25833_to_crs84(bbox):
@@ -67,14 +66,10 @@ class SentinelDownloader:
         """Set up the OAuth session and fetch the access token."""
         # Token
         # https://shapps.dataspace.copernicus.eu/dashboard/#/account/settings
-        client = BackendApplicationClient(client_id=self.client_id)
-        self.oauth = OAuth2Session(client=client)
-        # Get token for the session
-        self.token = self.oauth.fetch_token(
-            token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-            client_secret=self.client_secret,
-            include_client_id=True
-        )
+        # Reuse the process-wide cached token instead of authenticating for every downloader
+        token_manager = get_token_manager(self.client_id, self.client_secret)
+        self.token = token_manager.get_token()
+        self.oauth = token_manager.oauth_session()
 
         # Register compliance hook
         def sentinelhub_compliance_hook(response):
@@ -155,8 +150,9 @@ class SentinelDownloader:
             "distinct": "date",
         }
 
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+            SENTINEL_HUB_RETRY_POLICY,
             headers={"Authorization": f"Bearer {self.token}"},
             json=data,
 
@@ -166,31 +162,17 @@ class SentinelDownloader:
 
     def download_data(self):
         """Download data using the Process API."""
+        # 429 and 5xx answers are retried with backoff, other errors are raised to the caller
         try:
-            response = self.oauth.post(
-                'https://sh.dataspace.copernicus.eu/api/v1/process',
+            response = request_with_retry(
+                self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/process', SENTINEL_HUB_RETRY_POLICY,
                 headers={"Authorization": f"Bearer {self.token}"},
                 json=self.payload
             )
-            response.raise_for_status()
         except requests.exceptions.HTTPError as http_err:
             print(f"HTTP error occurred: {http_err}")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response Content: {response.text}")
-            import pdb
-            pdb.set_trace()
-        except requests.exceptions.ConnectionError as conn_err:
-            print(f"Connection error occurred: {conn_err}")
-            import pdb
-            pdb.set_trace()
-        except requests.exceptions.Timeout as timeout_err:
-            print(f"Timeout error occurred: {timeout_err}")
-            import pdb
-            pdb.set_trace()
-        except requests.exceptions.RequestException as req_err:
-            print(f"An error occurred: {req_err}")
-            import pdb
-            pdb.set_trace()
+            print(f"Response Content: {http_err.response.text}")
+            raise
         return response.content
 
     def save_data(self, data, filename):
@@ -1,6 +1,7 @@
 import requests
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
+from src.utils.config import CDSE_BASE_URL
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry, shared_rate_limiter
+from src.utils.token_manager import get_token_manager
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -22,6 +23,7 @@ class SentinelDownloader:
         self.satellite_type = satellite_type
         self.token = None
         self.oauth = None
+        self.rate_limiter = None
         self.evalscript = None
         self.payload = None
 
@@ -38,14 +40,12 @@ class SentinelDownloader:
 
     def setup_session(self):
         """Set up the OAuth session and fetch the access token."""
-        client = BackendApplicationClient(client_id=self.client_id)
-        self.oauth = OAuth2Session(client=client)
-        # Get token for the session
-        self.token = self.oauth.fetch_token(
-            token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-            client_secret=self.client_secret,
-            include_client_id=True
-        )
+        # Reuse the process-wide cached token instead of authenticating for every downloader
+        token_manager = get_token_manager(self.client_id, self.client_secret)
+        self.token = token_manager.get_token()
+        self.oauth = token_manager.oauth_session()
+        # Retried requests share the account's rate limit with all other downloads of the process
+        self.rate_limiter = shared_rate_limiter(CDSE_BASE_URL, self.client_id)
 
         # Register compliance hook
         def sentinelhub_compliance_hook(response):
@@ -114,29 +114,32 @@ class SentinelDownloader:
             "collections": [self.satellite_type],
             "distinct": "date",
         }
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
-            headers={"Authorization": f"Bearer {self.token}"},
-            json=data,
-        )
-        if response.status_code != 200:
-            print(f"Error in search_data: {response.status_code} - {response.text}")
+        try:
+            response = request_with_retry(
+                self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+                SENTINEL_HUB_RETRY_POLICY, self.rate_limiter,
+                headers={"Authorization": f"Bearer {self.token}"},
+                json=data,
+            )
+        except requests.exceptions.HTTPError as http_err:
+            print(f"Error in search_data: {http_err.response.status_code} - {http_err.response.text}")
             return []
         return json.loads(response.content)["features"]
 
     def download_data(self):
         """Download data using the Process API."""
         try:
-            response = self.oauth.post(
-                'https://sh.dataspace.copernicus.eu/api/v1/process',
+            # 429 and 5xx answers, connection errors and timeouts are retried with backoff first
+            response = request_with_retry(
+                self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/process', SENTINEL_HUB_RETRY_POLICY,
+                self.rate_limiter,
                 headers={"Authorization": f"Bearer {self.token}"},
                 json=self.payload
             )
-            response.raise_for_status()
         except requests.exceptions.HTTPError as http_err:
             print(f"HTTP error occurred: {http_err}")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response Content: {response.text}")
+            print(f"Status Code: {http_err.response.status_code}")
+            print(f"Response Content: {http_err.response.text}")
             return None
         except requests.exceptions.ConnectionError as conn_err:
             print(f"Connection error occurred: {conn_err}")
@@ -1,6 +1,7 @@
 import requests
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
+from src.utils.config import CDSE_BASE_URL
+from src.utils.http_client import SENTINEL_HUB_RETRY_POLICY, request_with_retry, shared_rate_limiter
+from src.utils.token_manager import get_token_manager
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -24,6 +25,7 @@ class SentinelDownloader:
         self.satellite_type = satellite_type
         self.token = None
         self.oauth = None
+        self.rate_limiter = None
         self.evalscript = None
         self.payload = None
 
@@ -47,13 +49,12 @@ class SentinelDownloader:
         self.create_payload()
 
     def setup_session(self):
-        client = BackendApplicationClient(client_id=self.client_id)
-        self.oauth = OAuth2Session(client=client)
-        self.token = self.oauth.fetch_token(
-            token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-            client_secret=self.client_secret,
-            include_client_id=True
-        )
+        # Reuse the process-wide cached token instead of authenticating for every downloader
+        token_manager = get_token_manager(self.client_id, self.client_secret)
+        self.token = token_manager.get_token()
+        self.oauth = token_manager.oauth_session()
+        # Retried requests share the account's rate limit with all other downloads of the process
+        self.rate_limiter = shared_rate_limiter(CDSE_BASE_URL, self.client_id)
 
         def sentinelhub_compliance_hook(response):
             response.raise_for_status()
@@ -111,21 +112,19 @@ class SentinelDownloader:
             "collections": [self.satellite_type],
             "filter": "eo:cloud_cover < 30"
         }
-        response = self.oauth.post(
-            'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+        response = request_with_retry(
+            self.oauth, 'POST', 'https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/search',
+            SENTINEL_HUB_RETRY_POLICY, self.rate_limiter,
             headers={"Authorization": f"Bearer {self.token}"},
             json=data,
         )
 
-        if response.status_code == 200:
-            content = json.loads(response.content)
-            features = content.get("features", [])
-            if features:
-                return features
-            else:
-                raise ValueError("No available data found for the given search criteria.")
+        content = json.loads(response.content)
+        features = content.get("features", [])
+        if features:
+            return features
         else:
-            raise Exception(f"Error occurred: {response.status_code}, {response.content}")
+            raise ValueError("No available data found for the given search criteria.")
 
     def download_from_s3(self, bucket_name, s3_path, target_dir=""):
         """Download files from an S3 bucket using the provided S3 path."""
@@ -0,0 +1,177 @@
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.transform import Affine, from_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds as window_from_bounds
+
+TILE_SIZE = 256
+# Half the width of the Web Mercator (EPSG:3857) world in metres
+WEB_MERCATOR_HALF_WIDTH = 20037508.342789244
+
+
+def tile_bounds(zoom, x, y):
+    """Returns the EPSG:3857 bounds `(min_x, min_y, max_x, max_y)` of an XYZ tile."""
+    span = 2 * WEB_MERCATOR_HALF_WIDTH / 2 ** zoom
+    min_x = -WEB_MERCATOR_HALF_WIDTH + x * span
+    max_y = WEB_MERCATOR_HALF_WIDTH - y * span
+    return min_x, max_y - span, min_x + span, max_y
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Returns the `(x, y)` index of the XYZ tile containing a WGS84 position."""
+    n = 2 ** zoom
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def colormap_lut(name='viridis'):
+    """Returns a 256x4 uint8 RGBA lookup table for a matplotlib colormap."""
+    from matplotlib import colormaps
+    return (colormaps[name](np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+
+class TileRenderer:
+    """
+    Renders colourised XYZ (Web Mercator) tiles of a single-band raster on demand.
+
+    Each tile reads only the raster window below it, decimated to roughly the tile resolution, so GDAL serves low
+    zoom levels from the overviews instead of full resolution pixels. Rendered tiles are kept in an LRU cache.
+    """
+
+    def __init__(self, raster_path, colormap='viridis', vmin=None, vmax=None, opacity=0.7, band=1, max_tiles=512,
+                 build_overviews=True):
+        """
+        :param raster_path: Path of the GeoTIFF to render, e.g. the aggregated UI or the mean LST.
+        :param colormap: Name of a matplotlib colormap.
+        :param vmin: Value mapped to the lowest colour, defaults to the 2nd percentile of the raster.
+        :param vmax: Value mapped to the highest colour, defaults to the 98th percentile of the raster.
+        :param opacity: Opacity of valid pixels between 0 and 1, nodata pixels are transparent.
+        :param band: Band to render.
+        :param max_tiles: Number of rendered tiles kept in memory.
+        :param build_overviews: Add external overviews (`<raster>.ovr`) to rasters larger than a tile that have none
+            yet.
+        """
+        self.raster_path = raster_path
+        self.band = band
+        self.opacity = opacity
+        self.max_tiles = max_tiles
+        self._lut = colormap_lut(colormap)
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+        if build_overviews:
+            _ensure_overviews(raster_path)
+        with rasterio.open(raster_path) as src:
+            self.crs = src.crs
+            self.bounds = src.bounds
+            self.resolution = src.res
+            if vmin is None or vmax is None:
+                low, high = _value_range(src, band)
+                vmin = low if vmin is None else vmin
+                vmax = high if vmax is None else vmax
+        self.vmin, self.vmax = vmin, vmax
+
+    def bounds_wgs84(self):
+        """Returns the raster bounds as `(west, south, east, north)` in degrees."""
+        return transform_bounds(self.crs, 'EPSG:4326', *self.bounds)
+
+    def render_tile(self, zoom, x, y):
+        """Returns the tile as an RGBA `PIL.Image`, or `None` if the raster does not cover it."""
+        key = (zoom, x, y)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+
+        tile = self._render(zoom, x, y)
+
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def render_tile_bytes(self, zoom, x, y, image_format='PNG'):
+        """Returns the encoded tile (PNG or WEBP), or `None` if the raster does not cover it."""
+        tile = self.render_tile(zoom, x, y)
+        if tile is None:
+            return None
+        buffer = io.BytesIO()
+        tile.save(buffer, format=image_format)
+        return buffer.getvalue()
+
+    def _render(self, zoom, x, y):
+        bounds_3857 = tile_bounds(zoom, x, y)
+        min_x, min_y, max_x, max_y = transform_bounds('EPSG:3857', self.crs, *bounds_3857)
+        # Source pixels per tile pixel, at least two source pixels are read per tile pixel for a sharp result
+        scale = max(1.0, (max_x - min_x) / TILE_SIZE / self.resolution[0] / 2)
+        min_x, min_y = max(min_x, self.bounds.left), max(min_y, self.bounds.bottom)
+        max_x, max_y = min(max_x, self.bounds.right), min(max_y, self.bounds.top)
+        if min_x >= max_x or min_y >= max_y:
+            return None
+
+        with rasterio.open(self.raster_path) as src:
+            window = window_from_bounds(min_x, min_y, max_x, max_y, src.transform)
+            window = window.round_offsets().round_lengths().intersection(Window(0, 0, src.width, src.height))
+            # Read no more pixels than the tile can show, GDAL picks the matching overview
+            out_shape = (max(1, math.ceil(window.height / scale)), max(1, math.ceil(window.width / scale)))
+            data = _unscale(src, self.band, src.read(self.band, window=window, out_shape=out_shape,
+                                                     resampling=Resampling.nearest, masked=True))
+            window_transform = src.window_transform(window) * Affine.scale(window.width / out_shape[1],
+                                                                           window.height / out_shape[0])
+
+        tile_data = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+        reproject(data, tile_data, src_transform=window_transform, src_crs=self.crs, src_nodata=np.nan,
+                  dst_transform=from_bounds(*bounds_3857, TILE_SIZE, TILE_SIZE), dst_crs='EPSG:3857',
+                  dst_nodata=np.nan, resampling=Resampling.nearest)
+        return Image.fromarray(self._colourise(tile_data), mode='RGBA')
+
+    def _colourise(self, data):
+        valid = np.isfinite(data)
+        scaled = (np.nan_to_num(data, nan=self.vmin) - self.vmin) / ((self.vmax - self.vmin) or 1)
+        rgba = self._lut[np.clip(scaled * 255, 0, 255).astype(np.uint8)]
+        rgba[..., 3] = np.where(valid, int(self.opacity * 255), 0)
+        return rgba
+
+
+def _value_range(src, band):
+    """2nd and 98th percentile of the valid pixels, read from a decimated copy of the band."""
+    scale = max(1, max(src.width, src.height) // 1024)
+    data = _unscale(src, band, src.read(band, out_shape=(max(1, src.height // scale), max(1, src.width // scale)),
+                                        masked=True))
+    valid = data[np.isfinite(data)]
+    if valid.size == 0:
+        return 0.0, 1.0
+    return float(np.percentile(valid, 2)), float(np.percentile(valid, 98))
+
+
+def _unscale(src, band, data):
+    """Values of a masked read with masked pixels as NaN, unscaled with the scale and offset of the band."""
+    return data.astype(np.float32).filled(np.nan) * src.scales[band - 1] + src.offsets[band - 1]
+
+
+def _ensure_overviews(raster_path):
+    """
+    Builds overviews of a raster without any into an external `<raster>.ovr` file. The raster itself is never
+    modified, so viewing a product keeps it valid in the pipeline and download manifests.
+    """
+    overview_path = f"{raster_path}.ovr"
+    # Overviews of a raster that was rewritten since are stale
+    if os.path.exists(overview_path) and os.path.getmtime(overview_path) < os.path.getmtime(raster_path):
+        os.remove(overview_path)
+    with rasterio.open(raster_path) as src:
+        if src.overviews(1) or max(src.width, src.height) <= TILE_SIZE:
+            return
+        factors = [2 ** level for level in range(1, math.ceil(math.log2(max(src.width, src.height) / TILE_SIZE)) + 1)]
+    # With TIFF_USE_OVR, GDAL writes the overviews to the .ovr file and leaves the GeoTIFF untouched
+    with rasterio.Env(TIFF_USE_OVR=True), rasterio.open(raster_path, 'r+') as dst:
+        dst.build_overviews(factors, Resampling.average)
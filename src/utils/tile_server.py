@@ -0,0 +1,292 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from PIL import Image
+
+from src.utils.tile_renderer import TILE_SIZE, TileRenderer
+
+IMAGE_FORMATS = {'png': ('PNG', 'image/png'), 'webp': ('WEBP', 'image/webp')}
+TILE_PATH = re.compile(r'^/(?P<layer>[\w.-]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(?P<format>png|webp)$')
+
+
+class TileCache:
+    """Encoded tiles in an in-memory LRU cache, backed by an optional on-disk cache that survives restarts."""
+
+    def __init__(self, cache_dir=None, max_memory_bytes=64 * 1024 ** 2):
+        """
+        :param cache_dir: Directory for the on-disk cache. `None` keeps tiles in memory only.
+        :param max_memory_bytes: Upper bound for the summed size of the tiles kept in memory.
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self._tiles = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, 'rb') as tile_file:
+            data = tile_file.read()
+        self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        self._remember(key, data)
+        path = self._path(key)
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.part"
+            with open(tmp_path, 'wb') as tile_file:
+                tile_file.write(data)
+            os.replace(tmp_path, path)
+
+    def drop_other_versions(self, layer, version):
+        """
+        Removes the tiles of `layer` rendered from other raster versions than `version` from memory and disk. Keys
+        are laid out as "<layer>/<version>/...", so each version of a layer has its own directory.
+        """
+        current = f"{layer}/{version}/"
+        with self._lock:
+            for key in [key for key in self._tiles if key.startswith(f"{layer}/") and not key.startswith(current)]:
+                self._size -= len(self._tiles.pop(key))
+        layer_dir = self._path(layer)
+        if layer_dir is None or not os.path.isdir(layer_dir):
+            return
+        for name in os.listdir(layer_dir):
+            if name != version:
+                shutil.rmtree(os.path.join(layer_dir, name), ignore_errors=True)
+
+    def _remember(self, key, data):
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = data
+            self._size += len(data)
+            while self._size > self.max_memory_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _path(self, key):
+        return None if self.cache_dir is None else os.path.join(self.cache_dir, *key.split('/'))
+
+
+class TileServer:
+    """
+    Local HTTP endpoint serving colourised XYZ tiles of result rasters, e.g. for web maps of city heat.
+
+    Tiles are served at `/<layer>/<z>/<x>/<y>.png` (or `.webp`) and `/layers` lists the layers with their bounds.
+    Tiles are rendered by a `TileRenderer` per layer, cached by `TileCache` and carry an ETag derived from the
+    raster file version, so browsers revalidate cheaply and a rewritten raster invalidates all its tiles. The
+    cache only keeps the tiles of the current version of each raster.
+    Requests are handled on a thread pool.
+    """
+
+    def __init__(self, layers, host='127.0.0.1', port=8080, cache_dir=None, max_workers=8,
+                 memory_cache_mb=64, colormaps=None):
+        """
+        :param layers: Dictionary of layer name to GeoTIFF path.
+        :param host: Interface to listen on. The default only accepts local connections.
+        :param port: Port to listen on, 0 picks a free port.
+        :param cache_dir: Directory for the on-disk tile cache.
+        :param max_workers: Number of threads handling requests.
+        :param memory_cache_mb: Size of the in-memory tile cache in MB.
+        :param colormaps: Optional dictionary of layer name to matplotlib colormap name.
+        """
+        self.layers = dict(layers)
+        self.colormaps = colormaps or {}
+        self.cache = TileCache(cache_dir, memory_cache_mb * 1024 ** 2)
+        self._renderers = {}
+        self._renderers_lock = threading.Lock()
+        self._empty_tiles = {}
+        self._server = _PooledHTTPServer((host, port), _TileRequestHandler, self, max_workers)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_template(self, layer, image_format='png'):
+        return f"{self.url}/{layer}/{{z}}/{{x}}/{{y}}.{image_format}"
+
+    def start(self):
+        """Serves on a background thread and returns immediately."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def tile(self, layer, zoom, x, y, image_format):
+        """Returns the encoded tile, rendering it only if no cache holds it."""
+        return self.tile_and_etag(layer, zoom, x, y, image_format)[0]
+
+    def tile_and_etag(self, layer, zoom, x, y, image_format):
+        """Returns the encoded tile and its ETag, both for the same version of the raster file."""
+        renderer, version = self._renderer(layer)
+        key = self._tile_key(layer, version, zoom, x, y, image_format)
+        data = self.cache.get(key)
+        if data is None:
+            data = renderer.render_tile_bytes(zoom, x, y, IMAGE_FORMATS[image_format][0])
+            if data is None:
+                data = self._empty_tile(image_format)
+            self.cache.put(key, data)
+        return data, self._etag(key)
+
+    def etag(self, layer, zoom, x, y, image_format):
+        """Returns the ETag of a tile, which changes whenever the raster file is rewritten."""
+        _, version = self._renderer(layer)
+        return self._etag(self._tile_key(layer, version, zoom, x, y, image_format))
+
+    @staticmethod
+    def _tile_key(layer, version, zoom, x, y, image_format):
+        return f"{layer}/{version}/{zoom}/{x}/{y}.{image_format}"
+
+    @staticmethod
+    def _etag(key):
+        return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+    def layer_info(self):
+        return {layer: {'bounds': self._renderer(layer)[0].bounds_wgs84(), 'tiles': self.url_template(layer)}
+                for layer in self.layers}
+
+    def _raster_version(self, layer):
+        stat = os.stat(self.layers[layer])
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def _renderer(self, layer):
+        """Returns the renderer of a layer and the raster version it renders, recreating it once the raster changed."""
+        version = self._raster_version(layer)
+        with self._renderers_lock:
+            renderer, renderer_version = self._renderers.get(layer, (None, None))
+            if renderer is None or renderer_version != version:
+                renderer = TileRenderer(self.layers[layer], colormap=self.colormaps.get(layer, 'viridis'), max_tiles=64)
+                self._renderers[layer] = (renderer, version)
+                # Tiles of earlier versions are never served again, without this every rewrite adds a tile pyramid
+                self.cache.drop_other_versions(layer, version)
+            return renderer, version
+
+    def _empty_tile(self, image_format):
+        if image_format not in self._empty_tiles:
+            buffer = io.BytesIO()
+            Image.new('RGBA', (TILE_SIZE, TILE_SIZE)).save(buffer, format=IMAGE_FORMATS[image_format][0])
+            self._empty_tiles[image_format] = buffer.getvalue()
+        return self._empty_tiles[image_format]
+
+
+class _PooledHTTPServer(HTTPServer):
+    """`HTTPServer` that handles each request on a bounded thread pool."""
+
+    def __init__(self, server_address, handler_class, tile_server, max_workers):
+        self.tile_server = tile_server
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class _TileRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        tile_server = self.server.tile_server
+        if self.path == '/layers':
+            self._send(HTTPStatus.OK, json.dumps(tile_server.layer_info()).encode(), 'application/json')
+            return
+
+        match = TILE_PATH.match(self.path)
+        if match is None or match['layer'] not in tile_server.layers:
+            self._send(HTTPStatus.NOT_FOUND, b'Unknown layer or tile path', 'text/plain')
+            return
+        zoom, x, y = int(match['z']), int(match['x']), int(match['y'])
+        if zoom > 24 or x >= 2 ** zoom or y >= 2 ** zoom:
+            self._send(HTTPStatus.NOT_FOUND, b'Tile out of range', 'text/plain')
+            return
+
+        try:
+            etag = tile_server.etag(match['layer'], zoom, x, y, match['format'])
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            data, etag = tile_server.tile_and_etag(match['layer'], zoom, x, y, match['format'])
+        except Exception as e:
+            print(f"Rendering tile {self.path} failed: {e}")
+            self._send(HTTPStatus.INTERNAL_SERVER_ERROR, b'Rendering failed', 'text/plain')
+            return
+        self._send(HTTPStatus.OK, data, IMAGE_FORMATS[match['format']][1], etag)
+
+    def _send(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'public, max-age=3600')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One line per tile would drown the console
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve UI/LST result rasters as XYZ map tiles.")
+    parser.add_argument('layers', nargs='+', metavar='NAME=PATH',
+                        help="Layer name and GeoTIFF path, e.g. lst=LST_mean.tiff")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-dir', default=None, help="Directory for the on-disk tile cache")
+    parser.add_argument('--workers', type=int, default=8, help="Number of request handling threads")
+    args = parser.parse_args(argv)
+
+    layers = dict(layer.split('=', 1) for layer in args.layers)
+    server = TileServer(layers, host=args.host, port=args.port, cache_dir=args.cache_dir, max_workers=args.workers)
+    for layer in layers:
+        print(f"{layer}: {server.url_template(layer)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
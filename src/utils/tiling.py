@@ -0,0 +1,33 @@
+import math
+
+from rasterio.windows import Window, bounds
+
+# Maximum width and height in pixels of a single Process API response
+MAX_TILE_PIXELS = 2500
+
+
+def tile_grid(width, height, transform, max_tile_pixels=MAX_TILE_PIXELS):
+    """
+    Splits an output raster grid into tiles no larger than `max_tile_pixels` in either direction.
+
+    Tiles are aligned to the output pixel grid, so a tile's bounding box covers exactly the pixels of its window and
+    the tiles mosaic back into the full raster without resampling or seams. The grid is split into equally sized
+    tiles instead of full tiles plus a thin remainder.
+
+    :param width: Width of the full raster in pixels.
+    :param height: Height of the full raster in pixels.
+    :param transform: Affine transform of the full raster.
+    :param max_tile_pixels: Maximum tile width and height in pixels.
+    :return: List of `(window, bbox)` tuples, where `bbox` is `(min_x, min_y, max_x, max_y)` of the window.
+    """
+    n_cols = math.ceil(width / max_tile_pixels)
+    n_rows = math.ceil(height / max_tile_pixels)
+    tile_width = math.ceil(width / n_cols)
+    tile_height = math.ceil(height / n_rows)
+
+    tiles = []
+    for row_off in range(0, height, tile_height):
+        for col_off in range(0, width, tile_width):
+            window = Window(col_off, row_off, min(tile_width, width - col_off), min(tile_height, height - row_off))
+            tiles.append((window, bounds(window, transform)))
+    return tiles
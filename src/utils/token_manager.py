@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from oauthlib.oauth2 import BackendApplicationClient
+from requests_oauthlib import OAuth2Session
+from sentinelhub import SentinelHubSession
+
+CDSE_TOKEN_URL = 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token'
+DEFAULT_TOKEN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'hotspot', 'tokens')
+# Shortest wait before a background refresh, so tokens with a very short lifetime cannot make it loop
+MIN_REFRESH_DELAY = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """
+    Caches a CDSE OAuth access token until shortly before it expires and refreshes it ahead of time.
+
+    The token is kept in memory and, if `cache_dir` is given, in a JSON file keyed by client id so that separate
+    processes (GUI, notebooks, batch runs) reuse a still valid token instead of authenticating again.
+    """
+
+    def __init__(self, client_id, client_secret, token_url=CDSE_TOKEN_URL, cache_dir=None, refresh_margin=60,
+                 background_refresh=True):
+        """
+        :param client_id: OAuth client id.
+        :param client_secret: OAuth client secret.
+        :param token_url: Identity service token endpoint.
+        :param cache_dir: Directory for the on-disk token cache. `None` keeps the token in memory only.
+        :param refresh_margin: Seconds before expiry at which a token is no longer handed out and gets refreshed.
+        :param background_refresh: Refresh the token on a timer thread before it expires, so callers never wait. The
+            timer only refreshes tokens that were used since the last refresh, so idle processes stop contacting the
+            identity service until the token is requested again.
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.cache_dir = cache_dir
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+        self.fetch_count = 0
+        self._token = None
+        self._lock = threading.RLock()
+        self._refresh_timer = None
+        self._used = False
+
+    @property
+    def cache_path(self):
+        if self.cache_dir is None:
+            return None
+        key = hashlib.sha256(f"{self.token_url}|{self.client_id}".encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get_token(self):
+        """
+        Returns a token dictionary (`access_token`, `expires_at`, ...) that is valid for at least `refresh_margin`
+        seconds, fetching a new one only if neither the memory nor the disk cache holds one.
+        """
+        with self._lock:
+            if not self._is_valid(self._token):
+                cached_token = self._read_cache()
+                if self._is_valid(cached_token):
+                    self._token = cached_token
+                else:
+                    self._token = self._fetch_token()
+                    self._write_cache(self._token)
+                self._schedule_refresh()
+            elif self._refresh_timer is None:
+                # The timer stopped while the token was not used
+                self._schedule_refresh()
+            self._used = True
+            return self._token
+
+    def oauth_session(self):
+        """Returns a `requests_oauthlib.OAuth2Session` authorised with the cached token."""
+        return OAuth2Session(client=BackendApplicationClient(client_id=self.client_id), token=self.get_token())
+
+    def sentinelhub_session(self, config):
+        """Returns a `SentinelHubSession` that always reads its token from this manager."""
+        return ManagedSentinelHubSession(self, config)
+
+    def invalidate(self):
+        """Drops the cached token, e.g. after the service rejected it."""
+        with self._lock:
+            self._token = None
+            if self.cache_path and os.path.exists(self.cache_path):
+                os.remove(self.cache_path)
+
+    def close(self):
+        """Stops the background refresh timer."""
+        with self._lock:
+            if self._refresh_timer is not None:
+                self._refresh_timer.cancel()
+                self._refresh_timer = None
+
+    def _is_valid(self, token):
+        return bool(token) and token.get('expires_at', 0) - self.refresh_margin > time.time()
+
+    def _fetch_token(self):
+        oauth = OAuth2Session(client=BackendApplicationClient(client_id=self.client_id))
+        token = oauth.fetch_token(
+            token_url=self.token_url,
+            client_secret=self.client_secret,
+            include_client_id=True
+        )
+        self.fetch_count += 1
+        return dict(token)
+
+    def _read_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, token):
+        if self.cache_path is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.cache_path}.part"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as cache_file:
+            json.dump(token, cache_file)
+        os.replace(tmp_path, self.cache_path)
+
+    def _schedule_refresh(self):
+        if not self.background_refresh:
+            return
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+        remaining = self._token['expires_at'] - time.time()
+        if remaining <= self.refresh_margin:
+            # A token that does not outlive the margin is never handed out, refreshing it ahead of time is pointless
+            return
+        # Wake up a little before the token stops being handed out so that callers never block on a refresh. Tokens
+        # living less than twice the margin are refreshed after half their remaining lifetime instead of at once.
+        delay = max(remaining - self.refresh_margin * 2, remaining / 2, MIN_REFRESH_DELAY)
+        self._refresh_timer = threading.Timer(delay, self._refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh(self):
+        with self._lock:
+            self._refresh_timer = None
+            if not self._used:
+                # Nobody asked for the token since the last refresh, the next get_token() restarts the timer
+                return
+        try:
+            token = self._fetch_token()
+        except Exception as e:
+            # The next get_token() call fetches synchronously instead.
+            logger.warning("Background token refresh failed: %s", e)
+            return
+        with self._lock:
+            self._token = token
+            self._used = False
+            self._write_cache(token)
+            self._schedule_refresh()
+
+
+class ManagedSentinelHubSession(SentinelHubSession):
+    """A `SentinelHubSession` that delegates token handling to a `TokenManager`."""
+
+    def __init__(self, token_manager, config):
+        self.token_manager = token_manager
+        super().__init__(config=config, refresh_before_expiry=None, _token=token_manager.get_token())
+
+    @property
+    def token(self):
+        return self.token_manager.get_token()
+
+
+_token_managers = {}
+_token_managers_lock = threading.Lock()
+
+
+def get_token_manager(client_id, client_secret, token_url=CDSE_TOKEN_URL, cache_dir=None):
+    """
+    Returns the process-wide `TokenManager` for the given credentials, creating it on first use.
+
+    :param cache_dir: Directory for the on-disk token cache, only used when the manager is created.
+    """
+    key = (client_id, hashlib.sha256(client_secret.encode()).hexdigest(), token_url)
+    with _token_managers_lock:
+        if key not in _token_managers:
+            _token_managers[key] = TokenManager(client_id, client_secret, token_url=token_url, cache_dir=cache_dir)
+        return _token_managers[key]
@@ -1,52 +1,123 @@
 import os
 
+import numpy as np
 import rasterio
 
-from src.utils.gis_helpers import aggregate_rasters
+from src.utils.gis_helpers import aggregate_rasters, open_raster_for_write
+from src.utils.raster_storage import read_unscaled
 
+try:
+    import numexpr
+except ImportError:  # optional, the numpy kernel below is used instead
+    numexpr = None
 
-def calculate_ui(working_dir, ndwi_threshold=0.3, mndwi_threshold=0.3, method='average'):
+# Pixels per chunk of the numpy kernel, small enough for the temporaries to stay in the CPU cache
+UI_KERNEL_CHUNK_PIXELS = 64 * 1024
+
+# `water_value` is passed as a typed local: a -0.5 literal is a double and would make numexpr return float64
+UI_EXPRESSION = ("where(((b03 - b08) / (b03 + b08) > ndwi_threshold) | ((b03 - b11) / (b03 + b11) > mndwi_threshold), "
+                 "water_value, (b04 - b08) / (b04 + b08))")
+UI_WATER_VALUE = -0.5
+
+
+def calculate_ui_array(b03, b04, b08, b11, ndwi_threshold=0.3, mndwi_threshold=0.3, precision='float32'):
+    """
+    Computes the water-masked UI of four band arrays in a single pass.
+
+    NDWI, MNDWI, the water mask and UI are fused into one kernel: numexpr evaluates the whole expression per pixel if
+    it is installed, otherwise numpy evaluates it chunk by chunk into the output array. Neither creates full-size
+    intermediate arrays.
+
+    :param b03: Green band.
+    :param b04: Red band.
+    :param b08: NIR band.
+    :param b11: SWIR band.
+    :param ndwi_threshold: Pixels with a higher NDWI are water.
+    :param mndwi_threshold: Pixels with a higher MNDWI are water.
+    :param precision: 'float32' or 'float64', the dtype the bands are computed in.
+    :return: UI array of dtype `precision`, -0.5 where water is detected.
+    """
+    dtype = np.dtype(precision)
+    b03, b04, b08, b11 = (np.ascontiguousarray(band, dtype=dtype) for band in (b03, b04, b08, b11))
+    ndwi_threshold, mndwi_threshold = dtype.type(ndwi_threshold), dtype.type(mndwi_threshold)
+
+    if numexpr is not None:
+        return numexpr.evaluate(UI_EXPRESSION, local_dict={
+            'b03': b03, 'b04': b04, 'b08': b08, 'b11': b11, 'water_value': dtype.type(UI_WATER_VALUE),
+            'ndwi_threshold': ndwi_threshold, 'mndwi_threshold': mndwi_threshold}).astype(dtype, copy=False)
+
+    ui = np.empty(b03.shape, dtype=dtype)
+    green, red, nir, swir, out = (array.reshape(-1) for array in (b03, b04, b08, b11, ui))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, out.size, UI_KERNEL_CHUNK_PIXELS):
+            chunk = slice(start, start + UI_KERNEL_CHUNK_PIXELS)
+            g, r, n, s, o = green[chunk], red[chunk], nir[chunk], swir[chunk], out[chunk]
+
+            # NDWI: (B03 - B08) / (B03 + B08)
+            index = g - n
+            index /= g + n
+            water_mask = index > ndwi_threshold
+
+            # MNDWI: (B03 - B11) / (B03 + B11)
+            np.subtract(g, s, out=index)
+            index /= g + s
+            water_mask |= index > mndwi_threshold
+
+            # UI: (B04 - B08) / (B04 + B08), -0.5 where water is detected
+            np.subtract(r, n, out=o)
+            o /= r + n
+            o[water_mask] = UI_WATER_VALUE
+    return ui
+
+
+def calculate_ui(working_dir, ndwi_threshold=0.3, mndwi_threshold=0.3, method='average', output_profile=None,
+                 precision='float32', progress=None, memory_budget_mb=512):
     sentinel2_dir = os.path.join(working_dir, 'Sentinel-2-weeks')
 
-    for tiff_file in os.listdir(sentinel2_dir):
-        # Skip files that are already processed (end with "_ui.tiff")
-        if tiff_file.endswith("_ui.tiff"):
-            print(f"Skipping {tiff_file}: already processed.")
-            continue
-        if tiff_file.endswith(".tiff"):
-            file_path = os.path.join(sentinel2_dir, tiff_file)
-
-            # Open the TIFF file
-            with rasterio.open(file_path) as src:
-                if src.count < 4:
-                    print(f"Skipping {tiff_file}: not enough bands (requires 4 bands).")
-                    continue
-                # Read the bands needed for calculations
-                b03 = src.read(1).astype(float)  # Green
-                b04 = src.read(2).astype(float)  # Red
-                b08 = src.read(3).astype(float)  # NIR
-                b11 = src.read(4).astype(float)  # SWIR
-
-                # Calculate NDWI: (B03 - B08) / (B03 + B08)
-                ndwi = (b03 - b08) / (b03 + b08)
-
-                # Calculate MNDWI: (B03 - B11) / (B03 + B11)
-                mndwi = (b03 - b11) / (b03 + b11)
-
-                # Water mask: both NDWI > ndwi_threshold and MNDWI > mndwi_threshold
-                water_mask = (ndwi > ndwi_threshold) | (mndwi > mndwi_threshold)
-
-                # Calculate UI: (B04 - B08) / (B04 + B08)
-                ui = (b04 - b08) / (b04 + b08)
-
-                # Apply water mask: set UI to -0.5 where water is detected
-                ui[water_mask] = -0.5
-
-                # Save the result as a new TIFF
-                output_file = os.path.join(sentinel2_dir, tiff_file.replace(".tiff", "_ui.tiff"))
-                out_meta = src.meta.copy()
-                out_meta.update(count=1, dtype='float32')
-
-                with rasterio.open(output_file, 'w', **out_meta) as dest:
-                    dest.write(ui.astype('float32'), 1)
-    return aggregate_rasters(sentinel2_dir, working_dir, method)
+    tiff_files = os.listdir(sentinel2_dir)
+    for done, tiff_file in enumerate(tiff_files, start=1):
+        _calculate_ui_file(sentinel2_dir, tiff_file, ndwi_threshold, mndwi_threshold, output_profile, precision)
+        if progress is not None:
+            progress(done, len(tiff_files), tiff_file)
+    return aggregate_rasters(sentinel2_dir, working_dir, method, output_profile, memory_budget_mb)
+
+
+def _calculate_ui_file(sentinel2_dir, tiff_file, ndwi_threshold, mndwi_threshold, output_profile, precision):
+    # Skip files that are already processed (end with "_ui.tiff")
+    if tiff_file.endswith("_ui.tiff"):
+        print(f"Skipping {tiff_file}: already processed.")
+        return
+    if tiff_file.endswith(".tiff"):
+        calculate_ui_raster(os.path.join(sentinel2_dir, tiff_file),
+                            os.path.join(sentinel2_dir, tiff_file.replace(".tiff", "_ui.tiff")),
+                            ndwi_threshold, mndwi_threshold, output_profile, precision)
+
+
+def calculate_ui_raster(input_path, output_path, ndwi_threshold=0.3, mndwi_threshold=0.3, output_profile=None,
+                        precision='float32'):
+    """
+    Calculates the water-masked UI of one Sentinel-2 raster (B03, B04, B08, B11) and saves it as a float32 raster.
+
+    :return: `output_path`, or `None` if the raster has fewer than 4 bands.
+    """
+    # Open the TIFF file
+    with rasterio.open(input_path) as src:
+        if src.count < 4:
+            print(f"Skipping {os.path.basename(input_path)}: not enough bands (requires 4 bands).")
+            return None
+        # Read the bands needed for calculations
+        b03 = read_unscaled(src, 1, out_dtype=precision)  # Green
+        b04 = read_unscaled(src, 2, out_dtype=precision)  # Red
+        b08 = read_unscaled(src, 3, out_dtype=precision)  # NIR
+        b11 = read_unscaled(src, 4, out_dtype=precision)  # SWIR
+
+        # Water-masked UI in a single pass over the bands
+        ui = calculate_ui_array(b03, b04, b08, b11, ndwi_threshold, mndwi_threshold, precision)
+
+        # Save the result as a new TIFF
+        out_meta = src.meta.copy()
+        out_meta.update(count=1, dtype='float32', nodata=None)
+
+        with open_raster_for_write(output_path, output_profile, **out_meta) as dest:
+            dest.write(ui.astype('float32'), 1)
+    return output_path
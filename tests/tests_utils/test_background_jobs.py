@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+from src.utils.background_jobs import BackgroundJobRunner
+
+
+def _wait_for(runner, events, kinds, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not any(kind in kinds for kind, _ in events) and time.monotonic() < deadline:
+        runner.poll()
+        time.sleep(0.01)
+
+
+def _recording_runner():
+    runner = BackgroundJobRunner()
+    events = []
+    callbacks = {f"on_{kind}": (lambda payload, kind=kind: events.append((kind, payload)))
+                 for kind in ("progress", "success", "error", "cancelled")}
+    return runner, events, callbacks
+
+
+def test_job_reports_progress_and_result_on_polling_thread():
+    runner, events, callbacks = _recording_runner()
+    threads = set()
+    for name in callbacks:
+        callback = callbacks[name]
+        callbacks[name] = lambda payload, callback=callback: (threads.add(threading.get_ident()), callback(payload))
+
+    def job(items, progress):
+        for done, item in enumerate(items, start=1):
+            progress(done, len(items), item)
+        return "finished"
+
+    runner.submit("Job", job, ["a", "b", "c"], **callbacks)
+    _wait_for(runner, events, {"success"})
+
+    assert [kind for kind, _ in events] == ["progress"] * 3 + ["success"]
+    assert events[-1][1] == "finished"
+    assert events[0][1].label == "Job" and events[0][1].total == 3
+    assert threads == {threading.get_ident()}
+
+
+def test_job_cancelled_at_next_progress_report():
+    runner, events, callbacks = _recording_runner()
+    started = threading.Event()
+    finished_items = []
+
+    def job(progress):
+        for done in range(1, 101):
+            started.set()
+            time.sleep(0.01)
+            finished_items.append(done)
+            progress(done, 100, str(done))
+
+    runner.submit("Job", job, **callbacks)
+    started.wait()
+    runner.cancel()
+    _wait_for(runner, events, {"cancelled"})
+
+    assert events[-1][0] == "cancelled"
+    assert len(finished_items) < 100
+    assert not runner.busy
+
+
+def test_job_error_is_reported_and_only_one_job_runs():
+    runner, events, callbacks = _recording_runner()
+    release = threading.Event()
+
+    def job(progress):
+        release.wait()
+        raise ValueError("broken")
+
+    runner.submit("Job", job, **callbacks)
+    with pytest.raises(RuntimeError):
+        runner.submit("Second job", job, **callbacks)
+    release.set()
+    _wait_for(runner, events, {"error"})
+
+    assert isinstance(events[-1][1], ValueError)
+
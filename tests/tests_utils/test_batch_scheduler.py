@@ -0,0 +1,150 @@
+import threading
+
+import numpy as np
+import rasterio
+from sentinelhub import SHConfig
+from src.utils.batch_scheduler import BatchScheduler
+from src.utils.sentinel_data import SentinelData
+
+
+def _offline_sentinel_data(monkeypatch, fail_below_x=None):
+    """SentinelData whose responses hold the pixel centre coordinates instead of calling Sentinel Hub."""
+    monkeypatch.setattr("src.utils.sentinel_data.load_config", lambda *args, **kwargs: SHConfig())
+    sentinel_data = SentinelData()
+    sentinel_data.requests = []
+    sentinel_data.searches = []
+    lock = threading.Lock()
+
+    def fake_download(bands):
+        def download(bbox_coordinates, crs, date_range, resolution, size=None):
+            with lock:
+                sentinel_data.requests.append((tuple(bbox_coordinates), str(date_range[0])))
+            if fail_below_x is not None and bbox_coordinates[0] < fail_below_x:
+                raise IOError("Process API failed")
+            min_x, min_y, max_x, max_y = bbox_coordinates
+            pixel_width, pixel_height = (max_x - min_x) / size[0], (max_y - min_y) / size[1]
+            xs = min_x + (np.arange(size[0]) + 0.5) * pixel_width
+            ys = max_y - (np.arange(size[1]) + 0.5) * pixel_height
+            grid = np.stack(np.meshgrid(xs, ys), axis=-1)
+            return np.concatenate([grid] * (bands // 2), axis=-1).astype(np.float32)
+        return download
+
+    def fake_search(bbox_coordinates, crs, date_range, filter=None):
+        sentinel_data.searches.append(date_range)
+        return {"common_dates": ['2024-06-01', '2024-06-03', '2024-06-05']}
+
+    sentinel_data.download_sentinel2_data = fake_download(4)
+    sentinel_data.download_sentinel3_data = fake_download(2)
+    sentinel_data.download_s2_s3_fused_data = fake_download(6)
+    sentinel_data.search_data = fake_search
+    return sentinel_data
+
+
+def _assert_pixel_centres(path):
+    with rasterio.open(path) as src:
+        xs, ys = rasterio.transform.xy(src.transform, *np.indices(src.shape))
+        np.testing.assert_allclose(src.read(1), np.reshape(xs, src.shape))
+        np.testing.assert_allclose(src.read(2), np.reshape(ys, src.shape))
+
+
+def test_overlapping_aois_share_tiles(tmp_path, monkeypatch):
+    sentinel_data = _offline_sentinel_data(monkeypatch)
+    scheduler = BatchScheduler(sentinel_data, max_workers=4, grid_tile_pixels=64)
+    scheduler.add_aoi('west', [500003, 5660000, 501200, 5661000], 32633, ('2024-06-01', '2024-06-05'), 10,
+                      str(tmp_path / "west"))
+    scheduler.add_aoi('east', [500600, 5660000, 501900, 5661000], 32633, ('2024-06-01', '2024-06-05'), 10,
+                      str(tmp_path / "east"))
+    scheduler.add_aoi('west_late', [500003, 5660000, 501200, 5661000], 32633, ('2024-06-02', '2024-06-30'), 10,
+                      str(tmp_path / "west_late"))
+    progress = []
+
+    results = scheduler.run(progress=lambda done, total, item: progress.append((done, total, item)))
+
+    assert all(result['status'] == 'ok' for result in results.values())
+    # The AOIs with the same bbox are searched once, over the union of their date ranges
+    assert sorted(sentinel_data.searches) == [('2024-06-01', '2024-06-05'), ('2024-06-01', '2024-06-30')]
+    assert scheduler.stats['unique_tile_requests'] < scheduler.stats['tile_requests']
+    assert len(sentinel_data.requests) == scheduler.stats['unique_tile_requests']
+    assert [done for done, _, _ in progress] == list(range(1, 17)) and progress[-1][1] == 16
+    # Every AOI gets results before any of them is complete
+    assert {item.split('/')[0] for _, _, item in progress[:8]} == {'west', 'east', 'west_late'}
+    for name, count in (('west', 6), ('east', 6), ('west_late', 4)):
+        assert len(results[name]['outputs']) == count
+        for output_path in results[name]['outputs']:
+            _assert_pixel_centres(output_path)
+    with rasterio.open(tmp_path / "west" / "Sentinel-2" / "s2_2024-06-01.tiff") as src:
+        assert src.bounds == (500000, 5660000, 501200, 5661000)
+
+
+def test_separate_aoi_is_downloaded_on_its_own_grid(tmp_path, monkeypatch):
+    sentinel_data = _offline_sentinel_data(monkeypatch)
+    scheduler = BatchScheduler(sentinel_data, grid_tile_pixels=64)
+    scheduler.add_aoi('weekly', [500000, 5660000, 500300, 5660200], 32633, ('2024-06-03', '2024-06-16'), 10,
+                      str(tmp_path / "weekly"), daily=False, weekly=True)
+
+    results = scheduler.run()
+
+    assert results['weekly']['status'] == 'ok' and not sentinel_data.searches
+    assert sorted(bbox for bbox, _ in sentinel_data.requests) == [(500000, 5660000, 500300, 5660200)] * 2
+    assert (tmp_path / "weekly" / "Sentinel-2-weeks" / "s2_2024-06-10-2024-06-16.tiff").exists()
+
+
+def test_failed_request_fails_only_affected_aoi(tmp_path, monkeypatch):
+    sentinel_data = _offline_sentinel_data(monkeypatch, fail_below_x=400000)
+    scheduler = BatchScheduler(sentinel_data, max_workers=2)
+    scheduler.add_aoi('broken', [300000, 5660000, 300200, 5660200], 32633, ('2024-06-01', '2024-06-05'), 10,
+                      str(tmp_path / "broken"))
+    scheduler.add_aoi('fine', [500000, 5660000, 500200, 5660200], 32633, ('2024-06-01', '2024-06-05'), 10,
+                      str(tmp_path / "fine"))
+
+    results = scheduler.run()
+
+    assert results['broken']['status'] == 'failed' and 'Process API failed' in results['broken']['error']
+    assert results['fine']['status'] == 'ok' and len(results['fine']['outputs']) == 6
+
+
+def test_rerun_skips_completed_rasters(tmp_path, monkeypatch):
+    sentinel_data = _offline_sentinel_data(monkeypatch)
+    for _ in range(2):
+        scheduler = BatchScheduler(sentinel_data)
+        scheduler.add_aoi('aoi', [500000, 5660000, 500300, 5660200], 32633, ('2024-06-01', '2024-06-05'), 10,
+                          str(tmp_path / "aoi"))
+        results = scheduler.run()
+
+    assert len(sentinel_data.requests) == 6
+    assert scheduler.stats['skipped_products'] == 6 and len(results['aoi']['outputs']) == 6
+
+
+def test_fused_download_requests_each_tile_once_per_day(tmp_path, monkeypatch):
+    sentinel_data = _offline_sentinel_data(monkeypatch)
+    scheduler = BatchScheduler(sentinel_data, max_workers=2, fused=True)
+    scheduler.add_aoi('aoi', [500000, 5660000, 500400, 5660300], 32633, ('2024-06-01', '2024-06-05'), 10,
+                      str(tmp_path))
+
+    results = scheduler.run()
+
+    assert results['aoi']['status'] == 'ok' and len(results['aoi']['outputs']) == 6
+    assert len(sentinel_data.requests) == scheduler.stats['unique_tile_requests'] == 3
+    for path in results['aoi']['outputs']:
+        with rasterio.open(path) as src:
+            assert src.count == (4 if '/Sentinel-2/' in path else 2)
+        _assert_pixel_centres(path)
+
+
+def test_coarse_sentinel3_is_requested_once_and_upsampled(tmp_path, monkeypatch):
+    sentinel_data = _offline_sentinel_data(monkeypatch)
+    scheduler = BatchScheduler(sentinel_data, max_workers=2, max_tile_pixels=16, sentinel3_resolution='native')
+    scheduler.add_aoi('aoi', [500000, 5660000, 500400, 5660300], 32633, ('2024-06-01', '2024-06-05'), 10,
+                      str(tmp_path))
+
+    results = scheduler.run()
+
+    assert results['aoi']['status'] == 'ok' and len(results['aoi']['outputs']) == 6
+    sentinel3_requests = [bbox for bbox, _ in sentinel_data.requests if bbox[2] - bbox[0] > 1000]
+    assert sentinel3_requests == [(498000.0, 5658000.0, 503000.0, 5663000.0)] * 3
+    with rasterio.open(tmp_path / "Sentinel-3" / "s3_2024-06-03.tiff") as src:
+        assert (src.width, src.height) == (40, 30)
+        # Bilinear upsampling reproduces the pixel centre coordinates of the coarse raster
+        xs, ys = rasterio.transform.xy(src.transform, *np.indices(src.shape))
+        np.testing.assert_allclose(src.read(1), np.reshape(xs, src.shape), rtol=1e-6)
+        np.testing.assert_allclose(src.read(2), np.reshape(ys, src.shape), rtol=1e-6)
@@ -0,0 +1,56 @@
+import datetime
+
+from src.utils.catalog_index import CatalogIndex
+
+
+def test_missing_spans_after_overlapping_searches(tmp_path):
+    index = CatalogIndex(str(tmp_path / "catalog.sqlite"))
+    aoi = CatalogIndex.aoi_key([498260, 5666530, 498290, 5666590], 32633)
+
+    assert index.missing_spans("sentinel-2-l2a", aoi, "", "2024-06-01", "2024-06-30") == [("2024-06-01", "2024-06-30")]
+    index.record("sentinel-2-l2a", aoi, "", "2024-06-01", "2024-06-10", ["2024-06-03", "2024-06-08"])
+    index.record("sentinel-2-l2a", aoi, "", "2024-06-20", "2024-06-30", ["2024-06-25"])
+
+    assert index.missing_spans("sentinel-2-l2a", aoi, "", "2024-06-01", "2024-07-02") == [
+        ("2024-06-11", "2024-06-19"), ("2024-07-01", "2024-07-02")]
+    assert index.dates("sentinel-2-l2a", aoi, "", "2024-06-05", "2024-06-30") == {"2024-06-08", "2024-06-25"}
+    # Other collections and filters are indexed separately
+    assert index.missing_spans("sentinel-3-slstr", aoi, "", "2024-06-01", "2024-06-02") == [("2024-06-01", "2024-06-02")]
+
+
+def test_recent_days_are_not_marked_searched(tmp_path):
+    index = CatalogIndex(str(tmp_path / "catalog.sqlite"), settle_days=2)
+    today = datetime.date.today()
+    start = (today - datetime.timedelta(days=10)).isoformat()
+    index.record("sentinel-2-l2a", "aoi", "", start, today.isoformat(), [])
+
+    unsettled = (today - datetime.timedelta(days=1)).isoformat()
+    assert index.missing_spans("sentinel-2-l2a", "aoi", "", start, today.isoformat()) == [(unsettled, today.isoformat())]
+
+
+def test_search_data_only_queries_new_days(tmp_path, monkeypatch):
+    from sentinelhub import SHConfig, SentinelHubCatalog
+    from src.utils.sentinel_data import SentinelData
+
+    monkeypatch.setattr("src.utils.sentinel_data.load_config", lambda *args, **kwargs: SHConfig())
+    queried = []
+
+    def fake_search(self, collection, bbox=None, time=None, filter=None, distinct=None, **kwargs):
+        queried.append((collection.api_id, time))
+        start, end = datetime.date.fromisoformat(time[0][:10]), datetime.date.fromisoformat(time[1][:10])
+        days = [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+        step = 2 if collection.api_id == "sentinel-2-l2a" else 3
+        return iter([day.isoformat() for day in days if day.toordinal() % step == 0])
+
+    monkeypatch.setattr(SentinelHubCatalog, "search", fake_search)
+    sentinel_data = SentinelData(catalog_index=CatalogIndex(str(tmp_path / "catalog.sqlite")))
+    bbox_coords = [498260, 5666530, 498290, 5666590]
+
+    first = sentinel_data.search_data(bbox_coords, 32633, ("2024-06-01", "2024-06-30"))
+    queried.clear()
+    second = sentinel_data.search_data(bbox_coords, 32633, ("2024-06-02", "2024-07-01"))
+
+    assert queried == [("sentinel-2-l2a", ("2024-07-01", "2024-07-01")),
+                       ("sentinel-3-slstr", ("2024-07-01", "2024-07-01"))]
+    assert set(first["common_dates"]) - {"2024-06-01"} <= set(second["common_dates"])
+    assert all(int(datetime.date.fromisoformat(day).toordinal()) % 6 == 0 for day in second["common_dates"])
@@ -0,0 +1,119 @@
+import json
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from src.cli import load_job_file, main
+
+
+def _write_raster(path, array):
+    with rasterio.open(path, 'w', driver='GTiff', width=array.shape[2], height=array.shape[1], count=array.shape[0],
+                       dtype=array.dtype, crs='EPSG:32633', transform=from_origin(498000, 5667000, 10, 10)) as dst:
+        dst.write(array)
+
+
+def _write_inputs(out_dir):
+    for directory in ('Sentinel-2', 'Sentinel-3', 'Sentinel-2-weeks'):
+        (out_dir / directory).mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for date in ('2024-06-01', '2024-06-02'):
+        _write_raster(str(out_dir / 'Sentinel-2' / f"s2_{date}.tiff"),
+                      rng.uniform(0.01, 0.5, size=(4, 40, 50)).astype(np.float32))
+        _write_raster(str(out_dir / 'Sentinel-3' / f"s3_{date}.tiff"),
+                      rng.uniform(270, 320, size=(2, 40, 50)).astype(np.float32))
+    _write_raster(str(out_dir / 'Sentinel-2-weeks' / "s2_2024-06-01-2024-06-07.tiff"),
+                  rng.uniform(0.01, 0.5, size=(4, 40, 50)).astype(np.float32))
+
+
+def _write_job(tmp_path, aois, defaults=None):
+    job_path = tmp_path / "job.json"
+    job_path.write_text(json.dumps({'defaults': defaults or {}, 'aois': aois}))
+    return str(job_path)
+
+
+def test_run_writes_outputs_and_report(tmp_path):
+    out_dir = tmp_path / "goerlitz"
+    _write_inputs(out_dir)
+    job_path = _write_job(tmp_path, [
+        {'name': 'goerlitz', 'bbox': [498000, 5666600, 498500, 5667000], 'crs': 32633,
+         'date_range': ['2024-06-01', '2024-06-03'], 'out_dir': str(out_dir)},
+        {'name': 'empty', 'bbox': [498000, 5666600, 498500, 5667000], 'crs': 32633,
+         'date_range': ['2024-06-01', '2024-06-03'], 'out_dir': str(tmp_path / "empty")},
+    ], defaults={'steps': ['lst', 'ui']})
+    report_path = tmp_path / "report.json"
+
+    exit_code = main(['run', job_path, '--memory-budget-mb', '1', '--report', str(report_path)])
+
+    report = json.loads(report_path.read_text())
+    assert exit_code == 1 and report['status'] == 'failed'
+    goerlitz, empty = report['aois']
+    assert goerlitz['status'] == 'ok' and set(goerlitz['steps']) == {'lst', 'ui'}
+    assert list(goerlitz['outputs']['lst_timings']) == ['LST_2024-06-01.tiff', 'LST_2024-06-02.tiff', 'LST_mean.tiff']
+    with rasterio.open(goerlitz['outputs']['lst_mean']) as src:
+        assert src.shape == (40, 50)
+    with rasterio.open(goerlitz['outputs']['aggregated_ui']) as src:
+        assert src.shape == (40, 50)
+    assert empty['status'] == 'failed' and 'error' in empty
+
+    # A rerun with unchanged inputs and parameters recomputes nothing
+    main(['run', job_path, '--report', str(report_path)])
+    rerun = json.loads(report_path.read_text())['aois'][0]
+    assert rerun['outputs']['lst_timings'] == {}
+    assert all(stage['computed'] == 0 for stage in rerun['outputs']['stages'].values())
+
+
+def test_invalid_job_file_exits_with_2(tmp_path, capsys):
+    job_path = _write_job(tmp_path, [{'name': 'no_bbox', 'crs': 32633, 'date_range': ['2024-06-01', '2024-06-03'],
+                                      'out_dir': str(tmp_path)}])
+
+    assert main(['run', job_path]) == 2
+    assert "no_bbox' misses bbox" in capsys.readouterr().err
+
+
+def test_unknown_output_profile_is_rejected(tmp_path, capsys):
+    job_path = _write_job(tmp_path, [])
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(['run', job_path, '--output-profile', 'png'])
+    assert exit_info.value.code == 2
+    assert "invalid choice: 'png'" in capsys.readouterr().err
+
+
+def test_job_defaults_apply_to_every_aoi(tmp_path):
+    job_path = _write_job(tmp_path, [
+        {'bbox': [0, 0, 1, 1], 'crs': 32633, 'date_range': ['2024-06-01', '2024-06-03'], 'out_dir': 'a'},
+        {'bbox': [0, 0, 1, 1], 'crs': 32633, 'date_range': ['2024-06-01', '2024-06-03'], 'out_dir': 'b',
+         'resolution': 20},
+    ], defaults={'resolution': 60, 'steps': ['ui']})
+
+    first, second = load_job_file(job_path)
+
+    assert (first['name'], first['resolution'], first['steps']) == ('aoi_0', 60, ['ui'])
+    assert (second['name'], second['resolution']) == ('aoi_1', 20)
+
+
+def test_download_step_runs_one_batch_for_all_aois(tmp_path, monkeypatch):
+    from sentinelhub import SHConfig
+    from src.utils.sentinel_data import SentinelData
+    monkeypatch.setattr("src.utils.sentinel_data.load_config", lambda *args, **kwargs: SHConfig())
+    sentinel_data = SentinelData()
+    requests = []
+    sentinel_data.search_data = lambda *args, **kwargs: {'common_dates': ['2024-06-01']}
+    sentinel_data.download_sentinel2_data = lambda bbox, crs, date_range, resolution, size=None: \
+        requests.append(bbox) or np.ones((size[1], size[0], 4), dtype=np.float32)
+    sentinel_data.download_sentinel3_data = lambda bbox, crs, date_range, resolution, size=None: \
+        requests.append(bbox) or np.ones((size[1], size[0], 2), dtype=np.float32)
+    monkeypatch.setattr("src.cli._create_sentinel_data", lambda options: sentinel_data)
+    aoi = {'bbox': [500000, 5660000, 500400, 5660400], 'crs': 32633, 'date_range': ['2024-06-01', '2024-06-01']}
+    job_path = _write_job(tmp_path, [dict(aoi, name='a', out_dir=str(tmp_path / "a")),
+                                     dict(aoi, name='b', out_dir=str(tmp_path / "b"))],
+                          defaults={'steps': ['download', 'lst']})
+    report_path = tmp_path / "report.json"
+
+    assert main(['run', job_path, '--report', str(report_path)]) == 0
+
+    report = json.loads(report_path.read_text())
+    assert report['download']['unique_tile_requests'] == len(requests) < report['download']['tile_requests']
+    assert [set(record['outputs']['lst_timings']) for record in report['aois']] == \
+        [{'LST_2024-06-01.tiff', 'LST_mean.tiff'}] * 2
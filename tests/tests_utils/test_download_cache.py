@@ -0,0 +1,68 @@
+import io
+
+import numpy as np
+import pytest
+from src.utils.download_cache import DownloadCache
+from src.utils.helper_functions import canonical_hash
+
+
+def test_cache_key_is_order_independent():
+    first = DownloadCache.make_key(bbox=[1.0, 2.0, 3.0, 4.0], crs="32633", resolution=10)
+    second = DownloadCache.make_key(resolution=10, crs="32633", bbox=[1.0, 2.0, 3.0, 4.0])
+    assert first == second
+    assert first != DownloadCache.make_key(bbox=[1.0, 2.0, 3.0, 4.0], crs="32633", resolution=20)
+    assert first == canonical_hash(crs="32633", bbox=[1.0, 2.0, 3.0, 4.0], resolution=10)
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = DownloadCache(tmp_path)
+    key = DownloadCache.make_key(collection="sentinel-2-l1c", time_interval=("2024-06-01", "2024-06-01"))
+    assert cache.get(key) is None
+
+    data = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    cache.put(key, data)
+    np.testing.assert_array_equal(cache.get(key), data)
+
+    # A new instance on the same directory sees the stored entry
+    reopened = DownloadCache(tmp_path)
+    np.testing.assert_array_equal(reopened.get(key), data)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_cache_evicts_least_recently_used_but_keeps_pinned(tmp_path):
+    data = np.zeros((32, 32), dtype=np.float32)
+    buffer = io.BytesIO()
+    np.save(buffer, data)
+    entry_size = len(buffer.getvalue())
+    cache = DownloadCache(tmp_path / "cache", max_bytes=2 * entry_size)
+
+    cache.put("pinned", data, pinned=True)
+    cache.put("old", data)
+    cache.put("recent", data)
+    cache.get("old")
+    cache.put("newest", data)
+
+    assert cache.get("pinned") is not None
+    assert cache.get("recent") is None
+    assert cache.get("old") is not None
+    assert cache.get("newest") is not None
+
+    with pytest.raises(KeyError):
+        cache.pin("recent")
+
+
+def test_entry_evicted_during_get_is_a_miss(tmp_path, monkeypatch):
+    cache = DownloadCache(tmp_path)
+    key = DownloadCache.make_key(collection="sentinel-3-slstr")
+    cache.put(key, np.ones((2, 2, 2), dtype=np.float32))
+    index_mtime = (tmp_path / "index.json").stat().st_mtime_ns
+    assert cache.get(key) is not None
+    # Hits do not rewrite the index
+    assert (tmp_path / "index.json").stat().st_mtime_ns == index_mtime
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr("src.utils.download_cache.np.load", evicted)
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses) == (1, 1)
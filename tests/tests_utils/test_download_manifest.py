@@ -0,0 +1,77 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+from sentinelhub import SHConfig
+from src.utils.download_manifest import DownloadManifest
+from src.utils.sentinel_data import SentinelData
+
+BBOX = [498260, 5666530, 498290, 5666590]
+DAYS = [f"2024-06-{day:02d}" for day in range(1, 7)]
+
+
+def _offline_sentinel_data(monkeypatch, fail_on_day=None):
+    """SentinelData that records its downloads and optionally fails on one day, instead of calling Sentinel Hub."""
+    monkeypatch.setattr("src.utils.sentinel_data.load_config", lambda *args, **kwargs: SHConfig())
+    sentinel_data = SentinelData()
+    sentinel_data.downloaded = []
+
+    def fake_download(bands):
+        def download(bbox_coordinates, crs, date_range, resolution):
+            if fail_on_day is not None and date_range[0].startswith(fail_on_day):
+                raise IOError("Connection reset")
+            sentinel_data.downloaded.append(date_range[0][:10])
+            return np.full((6, 3, bands), len(sentinel_data.downloaded), dtype=np.float32)
+        return download
+
+    sentinel_data.download_sentinel2_data = fake_download(4)
+    sentinel_data.download_sentinel3_data = fake_download(2)
+    sentinel_data.search_data = lambda *args, **kwargs: {"common_dates": DAYS}
+    return sentinel_data
+
+
+def test_rerun_resumes_after_crash(tmp_path, monkeypatch):
+    crashing = _offline_sentinel_data(monkeypatch, fail_on_day="2024-06-04")
+    with pytest.raises(IOError):
+        crashing.download_s2_s3_data_pack(BBOX, 32633, (DAYS[0], DAYS[-1]), 10, str(tmp_path))
+    assert sorted(set(crashing.downloaded)) == DAYS[:3]
+
+    rerun = _offline_sentinel_data(monkeypatch)
+    rerun.download_s2_s3_data_pack(BBOX, 32633, (DAYS[0], DAYS[-1]), 10, str(tmp_path))
+
+    assert sorted(set(rerun.downloaded)) == DAYS[3:]
+    assert len(glob.glob(str(tmp_path / "*" / "*.tiff"))) == 12
+    assert not glob.glob(str(tmp_path / "*" / "*.part*"))
+
+
+def test_corrupt_missing_and_changed_rasters_are_downloaded_again(tmp_path, monkeypatch):
+    _offline_sentinel_data(monkeypatch).download_s2_s3_data_pack(BBOX, 32633, (DAYS[0], DAYS[-1]), 10, str(tmp_path))
+    with open(tmp_path / "Sentinel-2" / "s2_2024-06-02.tiff", 'r+b') as raster:
+        raster.seek(-16, os.SEEK_END)
+        raster.write(b'\0' * 16)
+    os.remove(tmp_path / "Sentinel-3" / "s3_2024-06-05.tiff")
+
+    rerun = _offline_sentinel_data(monkeypatch)
+    rerun.download_s2_s3_data_pack(BBOX, 32633, (DAYS[0], DAYS[-1]), 10, str(tmp_path))
+    assert sorted(rerun.downloaded) == ["2024-06-02", "2024-06-05"]
+
+    other_resolution = _offline_sentinel_data(monkeypatch)
+    other_resolution.download_s2_s3_data_pack(BBOX, 32633, (DAYS[0], DAYS[-1]), 20, str(tmp_path))
+    assert len(other_resolution.downloaded) == 12
+
+
+def test_manifest_keys_are_relative_and_written_atomically(tmp_path):
+    raster_path = tmp_path / "Sentinel-2" / "s2_2024-06-01.tiff"
+    raster_path.parent.mkdir()
+    raster_path.write_bytes(b'raster')
+    manifest = DownloadManifest(str(tmp_path))
+    request_hash = DownloadManifest.request_hash(bbox=BBOX, crs='32633', time_interval=('2024-06-01', '2024-06-01'))
+
+    manifest.record(str(raster_path), request_hash)
+
+    assert not glob.glob(str(tmp_path / "*.part"))
+    reloaded = DownloadManifest(str(tmp_path))
+    assert reloaded.is_complete(str(raster_path), request_hash)
+    assert not reloaded.is_complete(str(raster_path), DownloadManifest.request_hash(bbox=BBOX))
+    assert list(reloaded._entries) == ["Sentinel-2/s2_2024-06-01.tiff"]
@@ -42,3 +42,148 @@ def test_download_sentinel2_data(tmp_path):
     assert tiff_filepath.stat().st_size > 0, "File is empty!"
     assert metadata_file.stat().st_size > 0, "Metadata file is empty!"
 
+
+def test_save_tiff_cloud_optimized_profile(tmp_path):
+    import numpy as np
+    import rasterio
+    from src.utils.gis_helpers import save_tiff_and_metadata
+
+    data = np.random.default_rng(0).random((1200, 1100, 2)).astype(np.float32)
+    transform = from_bounds(498000, 5664000, 509000, 5676000, 1100, 1200)
+    plain_path = str(tmp_path / "plain.tiff")
+    cog_path = str(tmp_path / "cog.tiff")
+
+    save_tiff_and_metadata(data, transform, 32633, plain_path, {"bands": ["a", "b"]})
+    save_tiff_and_metadata(data, transform, 32633, cog_path, {"bands": ["a", "b"]}, output_profile="cog")
+
+    with rasterio.open(cog_path) as src:
+        assert src.profile["tiled"]
+        assert src.compression.name.lower() == "deflate"
+        assert src.overviews(1)
+        np.testing.assert_array_equal(src.read(2), data[:, :, 1])
+    with rasterio.open(plain_path) as src:
+        assert src.compression is None
+    assert sorted(os.listdir(tmp_path)) == ["cog.tiff", "cog_metadata.json", "plain.tiff", "plain_metadata.json"]
+
+
+def test_open_raster_for_write_leaves_nothing_on_error(tmp_path):
+    import numpy as np
+    from src.utils.gis_helpers import open_raster_for_write
+
+    output_path = str(tmp_path / "failed.tiff")
+    with pytest.raises(RuntimeError):
+        with open_raster_for_write(output_path, "cog", width=4, height=4, count=1, dtype="float32") as dst:
+            dst.write(np.zeros((4, 4), dtype=np.float32), 1)
+            raise RuntimeError("interrupted")
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("method, reference", [
+    ("average", "nanmean"), ("median", "nanmedian"), ("max", "nanmax"), ("min", "nanmin"), ("p90", None)])
+def test_aggregate_rasters_streaming_matches_full_stack(tmp_path, method, reference):
+    import warnings
+    import numpy as np
+    import rasterio
+    from src.utils.gis_helpers import aggregate_rasters
+
+    rng = np.random.default_rng(1)
+    stack = rng.uniform(-1, 1, size=(5, 150, 140)).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.2] = -9999
+    stack[:, :3, :3] = -9999  # pixels without any valid value
+    for index, data in enumerate(stack):
+        with rasterio.open(tmp_path / f"s2_{index}_ui.tiff", "w", driver="GTiff", width=140, height=150, count=1,
+                           dtype="float32", nodata=-9999, tiled=True, blockxsize=64, blockysize=64) as dst:
+            dst.write(data, 1)
+
+    output_file = aggregate_rasters(str(tmp_path), str(tmp_path), method, memory_budget_mb=0.1)
+
+    full_stack = np.where(stack == -9999, np.nan, stack.astype(float))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if reference is None:
+            expected = np.nanpercentile(full_stack, 90, axis=0)
+        else:
+            expected = getattr(np, reference)(full_stack, axis=0)
+    with rasterio.open(output_file) as src:
+        np.testing.assert_allclose(src.read(1), expected.astype(np.float32), rtol=1e-6)
+
+
+@pytest.mark.parametrize("percentile", [0, 10, 50, 90, 100])
+def test_nanpercentile_sorted_matches_numpy_with_infinite_values(percentile):
+    import warnings
+    import numpy as np
+    from src.utils.gis_helpers import _nanpercentile_sorted
+
+    rng = np.random.default_rng(2)
+    stack = rng.uniform(-1, 1, size=(7, 30, 30))
+    stack[rng.random(stack.shape) < 0.2] = np.nan
+    stack[rng.random(stack.shape) < 0.1] = -np.inf
+    stack[rng.random(stack.shape) < 0.1] = np.inf
+    stack[:, 0, 0] = np.nan
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        expected = np.nanpercentile(stack, percentile, axis=0)
+    np.testing.assert_array_equal(_nanpercentile_sorted(stack, percentile), expected)
+
+
+def test_transformers_are_cached_and_shared_between_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from src.utils.gis_helpers import get_transformer, transform_bbox
+
+    assert get_transformer(25833, 4326) is get_transformer("epsg:25833", "EPSG:4326")
+    assert get_transformer(25833, 4326) is not get_transformer(25833, 4326, always_xy=False)
+    # PROJ strings are case-sensitive and must reach pyproj unchanged
+    proj_string = "+proj=utm +zone=33 +datum=WGS84 +units=m +no_defs"
+    np.testing.assert_allclose(get_transformer(proj_string, 4326).transform(500000, 5660000),
+                               get_transformer(32633, 4326).transform(500000, 5660000))
+
+    bbox = (497000, 5664900, 501700, 5668400)
+    expected = transform_bbox(bbox, 25833, 4326)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: transform_bbox(bbox, 25833, 4326), range(200)))
+    assert all(result == expected for result in results)
+
+
+def test_transform_bboxes_matches_single_bbox_transform():
+    import numpy as np
+    from src.utils.gis_helpers import transform_bbox, transform_bboxes
+
+    rng = np.random.default_rng(0)
+    origins = rng.uniform([400000, 5600000], [600000, 5800000], size=(1000, 2))
+    bboxes = np.hstack([origins, origins + rng.uniform(100, 5000, size=(1000, 2))])
+
+    transformed = transform_bboxes(bboxes, 32633, 4326)
+
+    assert transformed.shape == (1000, 4)
+    for bbox, result in zip(bboxes[:20], transformed[:20]):
+        np.testing.assert_allclose(result, transform_bbox(bbox, 32633, 4326))
+
+
+def test_transform_bbox_encloses_curved_edges_tightly():
+    import numpy as np
+    from pyproj import Transformer
+    from src.utils.gis_helpers import convert_bbox_to_utm, transform_bbox
+
+    # Parallels bend towards the pole on both sides of the central meridian of UTM zone 33 (15°E)
+    west, south, east, north = 14.0, 50.0, 16.0, 52.0
+    bounding_box_utm, crs_info = convert_bbox_to_utm(north, south, east, west)
+
+    transformer = Transformer.from_crs("EPSG:4326", f"EPSG:{crs_info['epsg_code']}", always_xy=True)
+    edge = np.linspace(0, 1, 2001)
+    lons = np.concatenate([west + (east - west) * edge, np.full(edge.size, east),
+                           west + (east - west) * edge, np.full(edge.size, west)])
+    lats = np.concatenate([np.full(edge.size, south), south + (north - south) * edge,
+                           np.full(edge.size, north), south + (north - south) * edge])
+    xs, ys = transformer.transform(lons, lats)
+
+    # Encloses the exact outline within a metre and is no larger than it
+    assert bounding_box_utm['west_x'] == pytest.approx(xs.min(), abs=1)
+    assert bounding_box_utm['east_x'] == pytest.approx(xs.max(), abs=1)
+    assert bounding_box_utm['south_y'] == pytest.approx(ys.min(), abs=1)
+    assert bounding_box_utm['north_y'] == pytest.approx(ys.max(), abs=1)
+
+    # Two corners miss part of the area
+    corners_only = transform_bbox((west, south, east, north), 4326, crs_info['epsg_code'], densify_points=0)
+    assert corners_only[1] > ys.min() + 100
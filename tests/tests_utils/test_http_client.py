@@ -0,0 +1,102 @@
+import email.utils
+import glob
+import logging
+import time
+
+import pytest
+import requests
+from src.utils.http_client import RateLimiter, RetryPolicy, TokenBucket, parse_retry_after, request_with_retry
+from src.utils.mock_sentinel_hub import MockSentinelHub
+from src.utils.sentinel_data import SentinelData
+
+
+class _ScriptedSession:
+    """Answers each request with the next `(status, headers)` of a script."""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        status, headers = self.script[self.calls]
+        self.calls += 1
+        response = requests.Response()
+        response.status_code, response.url, response._content = status, url, b'payload'
+        response._content_consumed = True
+        response.headers.update(headers)
+        return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+    monkeypatch.setattr("src.utils.http_client.time.sleep", recorded.append)
+    return recorded
+
+
+def test_retry_policy_delays():
+    policy = RetryPolicy(max_attempts=4, base_delay=1, max_delay=10, seed=0)
+
+    assert all(0 <= policy.delay(attempt) <= min(10, 2 ** (attempt - 1)) for attempt in range(1, 8)
+               for _ in range(20))
+    assert 3 <= policy.delay(1, retry_after='3') <= 3.3
+    assert policy.delay(1, retry_after='300') == 10
+    assert RetryPolicy(retry_after_unit=0.001).delay(1, retry_after='2000') <= 2.2
+    assert policy.should_retry(3, 503) and not policy.should_retry(3, 404) and not policy.should_retry(4, 503)
+
+    in_five_seconds = email.utils.formatdate(time.time() + 5, usegmt=True)
+    assert 3 < parse_retry_after(in_five_seconds) <= 5
+    assert parse_retry_after('soon') is None and parse_retry_after(None) is None
+
+
+def test_request_with_retry_backs_off_and_settles_processing_units(sleeps, caplog, capsys):
+    caplog.set_level(logging.DEBUG, logger='src.utils.http_client')
+    session = _ScriptedSession([(503, {}), (429, {'Retry-After': '2'}), (200, {'X-ProcessingUnits-Spent': '3'})])
+    limiter = RateLimiter(requests_per_minute=600, processing_units_per_minute=600)
+
+    response = request_with_retry(session, 'POST', 'http://hub/process', RetryPolicy(base_delay=1, seed=0), limiter,
+                                  processing_units=1)
+
+    assert response.status_code == 200 and session.calls == 3
+    assert sleeps[0] <= 1 and 2 <= sleeps[1] <= 2.2
+    # The failed attempts are refunded, the successful one is settled with the units the service reported
+    assert limiter.stats['requests'] == 3 and limiter.stats['processing_units'] == pytest.approx(3)
+    # Retries are logged instead of printed
+    assert [record.levelno for record in caplog.records] == [logging.DEBUG] * 2
+    assert 'answered 429, retry 2' in caplog.records[1].getMessage()
+    assert capsys.readouterr().out == ''
+
+    with pytest.raises(requests.HTTPError):
+        request_with_retry(_ScriptedSession([(400, {})]), 'POST', 'http://hub/process')
+    with pytest.raises(requests.HTTPError):
+        request_with_retry(_ScriptedSession([(503, {})] * 3), 'POST', 'http://hub/process', RetryPolicy(3))
+
+
+def test_token_bucket_limits_rate_after_burst():
+    bucket = TokenBucket(rate=50, capacity=5)
+
+    start = time.perf_counter()
+    waits = [bucket.acquire() for _ in range(10)]
+
+    assert waits[:5] == [0.0] * 5
+    # The five requests beyond the burst need 5 / 50 s of refill
+    assert time.perf_counter() - start >= 0.09
+    bucket.adjust(-5)
+    assert bucket.acquire() > 0
+
+
+def test_sentinel_data_retries_within_quota(monkeypatch, tmp_path):
+    with MockSentinelHub(error_rate=0.3, seed=1) as mock:
+        for name, value in mock.environ().items():
+            monkeypatch.setenv(name, value)
+        limiter = RateLimiter(requests_per_minute=6000, processing_units_per_minute=6000)
+        sentinel_data = SentinelData({'client_name': 'mock', 'client_secret': 'mock'}, rate_limiter=limiter)
+
+        sentinel_data.download_s2_s3_data_pack([500000, 5660000, 500300, 5660200], 32633, ('2024-06-01', '2024-06-06'),
+                                               10, str(tmp_path), max_workers=4)
+
+    assert len(glob.glob(str(tmp_path / "Sentinel-*" / "*.tiff"))) == 6
+    assert mock.stats['errors'] > 0
+    assert limiter.stats['requests'] == mock.stats['catalog'] + mock.stats['process']
+    # 30 x 20 pixels are charged the minimal area: 6 rasters of 4 or 2 FLOAT32 bands
+    assert limiter.stats['processing_units'] == pytest.approx(3 * 0.01 * (4 + 2) / 3 * 2, abs=1e-3)
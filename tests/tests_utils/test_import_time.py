@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Modules that must only be loaded once a download or calculation starts
+HEAVY_MODULES = ['matplotlib', 'scipy', 'sentinelhub', 'rasterio', 'pyproj', 'geopy', 'numpy']
+# Cumulative import time budget of the GUI module in seconds, generous for slow CI machines
+GUI_IMPORT_BUDGET = 1.5
+
+
+def _import_times(module):
+    """Imports `module` in a fresh interpreter with `-X importtime` and returns {module: cumulative seconds}."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=PROJECT_ROOT,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_gui_import_defers_heavy_modules():
+    pytest.importorskip('tkinter')
+    pytest.importorskip('tkintermapview')
+    times = _import_times('src.gui_python')
+
+    loaded_heavy = [module for module in HEAVY_MODULES if module in times]
+    assert loaded_heavy == [], f"Imported at GUI startup: {loaded_heavy}"
+    assert times['src.gui_python'] < GUI_IMPORT_BUDGET
+
+
+def test_config_import_does_not_load_secrets():
+    times = _import_times('src.utils.config')
+    assert 'src.utils.sentinel_secrets' not in times
+
+
+def test_gis_helpers_import_defers_plotting_and_filters():
+    times = _import_times('src.utils.gis_helpers')
+    assert 'matplotlib' not in times and 'scipy' not in times
@@ -0,0 +1,73 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from src.utils.gis_helpers import iter_block_windows
+from src.utils.lst_calculator import calculate_lst, calculate_lst_multiband_rasters
+
+
+def _write_raster(path, array, **options):
+    with rasterio.open(path, 'w', driver='GTiff', width=array.shape[2], height=array.shape[1], count=array.shape[0],
+                       dtype=array.dtype, crs='EPSG:32633', transform=from_origin(498000, 5667000, 10, 10),
+                       **options) as dst:
+        dst.write(array)
+
+
+def _write_scene(tmp_path, width=300, height=200, **options):
+    rng = np.random.default_rng(0)
+    sentinel2 = rng.uniform(0.01, 0.5, size=(4, height, width)).astype(np.float32)
+    sentinel3 = rng.uniform(270, 320, size=(2, height, width)).astype(np.float32)
+    sentinel2_path, sentinel3_path = str(tmp_path / "s2.tiff"), str(tmp_path / "s3.tiff")
+    _write_raster(sentinel2_path, sentinel2, **options)
+    _write_raster(sentinel3_path, sentinel3, **options)
+    return sentinel2_path, sentinel3_path
+
+
+def test_iter_block_windows_covers_raster_within_budget(tmp_path):
+    sentinel2_path, _ = _write_scene(tmp_path, tiled=True, blockxsize=64, blockysize=64)
+
+    with rasterio.open(sentinel2_path) as src:
+        windows = list(iter_block_windows(src, memory_budget_mb=0.5, bytes_per_pixel=64))
+
+    assert len(windows) > 1
+    assert sum(window.width * window.height for window in windows) == 300 * 200
+    assert all(window.width * window.height * 64 <= 0.5 * 1024 ** 2 for window in windows)
+    assert all(window.row_off % 64 == 0 and window.col_off % 64 == 0 for window in windows)
+
+
+def test_block_lst_matches_full_scene(tmp_path):
+    sentinel2_path, sentinel3_path = _write_scene(tmp_path, tiled=True, blockxsize=64, blockysize=64)
+    full_path, block_path = str(tmp_path / "full.tiff"), str(tmp_path / "block.tiff")
+
+    calculate_lst_multiband_rasters(sentinel2_path, sentinel3_path, full_path)
+    calculate_lst_multiband_rasters(sentinel2_path, sentinel3_path, block_path, memory_budget_mb=0.5)
+
+    with rasterio.open(full_path) as full, rasterio.open(block_path) as block:
+        np.testing.assert_array_equal(full.read(1), block.read(1))
+        assert block.profile['transform'] == full.profile['transform']
+
+
+def _write_working_dir(working_dir, dates):
+    for index, date in enumerate(dates):
+        (working_dir / 'Sentinel-2').mkdir(parents=True, exist_ok=True)
+        (working_dir / 'Sentinel-3').mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(index)
+        _write_raster(str(working_dir / 'Sentinel-2' / f"s2_{date}.tiff"),
+                      rng.uniform(0.01, 0.5, size=(4, 40, 50)).astype(np.float32))
+        _write_raster(str(working_dir / 'Sentinel-3' / f"s3_{date}.tiff"),
+                      rng.uniform(270, 320, size=(2, 40, 50)).astype(np.float32))
+
+
+def test_parallel_lst_matches_serial(tmp_path):
+    dates = ['2024-06-01', '2024-06-02', '2024-06-03']
+    serial_dir, parallel_dir = tmp_path / "serial", tmp_path / "parallel"
+    _write_working_dir(serial_dir, dates)
+    _write_working_dir(parallel_dir, dates)
+
+    timings = {}
+    serial_mean = calculate_lst(str(serial_dir))
+    parallel_mean = calculate_lst(str(parallel_dir), max_workers=3, timings=timings)
+
+    assert list(timings) == dates + ['mean']
+    assert sorted(path.name for path in (parallel_dir / 'LST_days').iterdir()) == [f"LST_{date}.tiff" for date in dates]
+    with rasterio.open(serial_mean) as serial, rasterio.open(parallel_mean) as parallel:
+        np.testing.assert_array_equal(serial.read(1), parallel.read(1))
@@ -0,0 +1,173 @@
+import glob
+import json
+import time
+
+import numpy as np
+import pytest
+import rasterio
+import requests
+from src.utils.config import load_config
+from src.utils.mock_sentinel_hub import MockSentinelHub
+from src.utils.sentinel_data import SentinelData
+
+API_KEYS = {'client_name': 'mock-client', 'client_secret': 'mock-secret'}
+BBOX = [500000, 5660000, 500300, 5660200]
+
+
+@pytest.fixture
+def mock_hub(monkeypatch):
+    with MockSentinelHub(client_id=API_KEYS['client_name'], client_secret=API_KEYS['client_secret']) as mock:
+        for name, value in mock.environ().items():
+            monkeypatch.setenv(name, value)
+        yield mock
+
+
+def _sentinel_data():
+    sentinel_data = SentinelData(API_KEYS)
+    sentinel_data.config.download_sleep_time = 0.01
+    return sentinel_data
+
+
+def test_load_config_targets_mock_from_environment(mock_hub):
+    config = load_config(API_KEYS)
+
+    assert (config.sh_base_url, config.sh_token_url) == (mock_hub.url, mock_hub.token_url)
+    assert mock_hub.stats['token'] == 1
+    rejected = requests.post(mock_hub.token_url, data={'grant_type': 'client_credentials', 'client_id': 'other',
+                                                       'client_secret': 'wrong'})
+    assert rejected.status_code == 401
+
+
+def test_data_pack_download_is_deterministic(mock_hub, tmp_path):
+    sentinel_data = _sentinel_data()
+
+    for out_dir in ("first", "second"):
+        sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-06'), 10, str(tmp_path / out_dir))
+
+    first_files = sorted(glob.glob(str(tmp_path / "first" / "*" / "*.tiff")))
+    assert [path.rsplit('/', 2)[1:] for path in first_files] == [
+        ['Sentinel-2', f"s2_{day}.tiff"] for day in ('2024-06-01', '2024-06-03', '2024-06-05')] + [
+        ['Sentinel-3', f"s3_{day}.tiff"] for day in ('2024-06-01', '2024-06-03', '2024-06-05')]
+    for path in first_files:
+        with rasterio.open(path) as first, rasterio.open(path.replace("first", "second")) as second:
+            assert first.shape == (20, 30)
+            np.testing.assert_array_equal(first.read(), second.read())
+    with rasterio.open(tmp_path / "first" / "Sentinel-3" / "s3_2024-06-01.tiff") as src:
+        assert 270 < src.read().min() and src.read().max() < 320
+    assert mock_hub.stats['process'] == 12 and mock_hub.stats['catalog'] == 4
+
+
+def test_errors_are_retried_and_concurrency_is_measured(mock_hub, tmp_path):
+    mock_hub.error_rate, mock_hub.latency = 0.3, 0.05
+    sentinel_data = _sentinel_data()
+
+    sentinel_data.download_s2_data_weekly(BBOX, 32633, ('2024-06-03', '2024-07-28'), 10, str(tmp_path),
+                                          max_workers=8, max_requests_per_host=3)
+
+    assert len(glob.glob(str(tmp_path / "Sentinel-2-weeks" / "*.tiff"))) == 8
+    assert mock_hub.stats['errors'] > 0
+    assert mock_hub.stats['process'] == 8 + mock_hub.stats['errors']
+    assert 1 < mock_hub.stats['peak_in_flight'] <= 3
+
+
+def test_parallel_data_pack_speedup(mock_hub, tmp_path, capsys):
+    """Downloads a data pack serially and in parallel and reports the speedup, which varies too much to assert."""
+    mock_hub.latency = 0.1
+    sentinel_data = _sentinel_data()
+
+    seconds = {}
+    for run, workers in (("serial", 1), ("parallel", 8)):
+        process_requests = mock_hub.stats['process']
+        mock_hub.stats['peak_in_flight'] = 0
+        start = time.perf_counter()
+        sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-16'), 10, str(tmp_path / run),
+                                               max_workers=workers, max_requests_per_host=workers)
+        seconds[run] = time.perf_counter() - start
+        assert mock_hub.stats['process'] - process_requests == 16
+        if workers == 1:
+            assert mock_hub.stats['peak_in_flight'] == 1
+        else:
+            assert 1 < mock_hub.stats['peak_in_flight'] <= workers
+
+    for path in glob.glob(str(tmp_path / "serial" / "*" / "*.tiff")):
+        with rasterio.open(path) as serial, rasterio.open(path.replace("serial", "parallel")) as parallel:
+            np.testing.assert_array_equal(serial.read(), parallel.read())
+    with capsys.disabled():
+        print(f"\nData pack of 16 requests: serial {seconds['serial']:.2f}s, parallel {seconds['parallel']:.2f}s, "
+              f"speedup {seconds['serial'] / seconds['parallel']:.1f}x")
+
+
+def test_fused_download_matches_separate_requests(mock_hub, tmp_path):
+    sentinel_data = _sentinel_data()
+
+    sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-04'), 10, str(tmp_path / "separate"))
+    separate_requests = mock_hub.stats['process']
+    sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-04'), 10, str(tmp_path / "fused"),
+                                           fused=True)
+    fused_requests = mock_hub.stats['process'] - separate_requests
+    sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-04'), 10, str(tmp_path / "tiled"),
+                                           fused=True, max_tile_pixels=16)
+
+    assert (separate_requests, fused_requests) == (4, 2)
+    products = [f"Sentinel-{sentinel}/s{sentinel}_{day}" for sentinel in (2, 3) for day in ('2024-06-01', '2024-06-03')]
+    assert len(glob.glob(str(tmp_path / "fused" / "*" / "*.tiff"))) == len(products)
+    for product in products:
+        with rasterio.open(tmp_path / "separate" / f"{product}.tiff") as separate:
+            expected = separate.read()
+        for run in ("fused", "tiled"):
+            with rasterio.open(tmp_path / run / f"{product}.tiff") as fused:
+                assert fused.count == (4 if product.startswith('Sentinel-2') else 2)
+                np.testing.assert_allclose(fused.read(), expected, rtol=1e-6)
+        metadata = [json.loads((tmp_path / run / f"{product}_metadata.json").read_text())
+                    for run in ("separate", "fused", "tiled")]
+        assert metadata[0] == metadata[1] == metadata[2]
+
+
+def test_coarse_sentinel3_download_is_upsampled(mock_hub, tmp_path):
+    sentinel_data = _sentinel_data()
+    sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-02'), 10, str(tmp_path / "direct"))
+    direct_bytes = mock_hub.stats['bytes']
+
+    sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-02'), 10, str(tmp_path / "coarse"),
+                                           sentinel3_resolution=100, sentinel3_kernel='cubic')
+    assert mock_hub.stats['bytes'] - direct_bytes < direct_bytes
+
+    coarse_path = tmp_path / "coarse" / "Sentinel-3-100m" / "s3_2024-06-01.tiff"
+    with rasterio.open(coarse_path) as coarse:
+        assert (coarse.width, coarse.height) == (7, 6)
+    with rasterio.open(tmp_path / "direct" / "Sentinel-3" / "s3_2024-06-01.tiff") as direct, \
+            rasterio.open(tmp_path / "coarse" / "Sentinel-3" / "s3_2024-06-01.tiff") as upsampled:
+        assert (upsampled.bounds, upsampled.shape) == (direct.bounds, direct.shape)
+        np.testing.assert_allclose(upsampled.read(), direct.read(), atol=0.5)
+
+    # A second kernel only repeats the local upsampling
+    process_requests = mock_hub.stats['process']
+    sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-02'), 10, str(tmp_path / "coarse"),
+                                           sentinel3_resolution=100, sentinel3_kernel='nearest')
+    assert mock_hub.stats['process'] == process_requests
+    with pytest.raises(ValueError):
+        sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-02'), 10, str(tmp_path),
+                                               fused=True, sentinel3_resolution='native')
+
+
+def test_scaled_storage_matches_float_products(mock_hub, tmp_path):
+    from src.utils.pipeline import build_hotspot_pipeline
+    from src.utils.raster_storage import read_unscaled
+
+    for storage in ("float32", "scaled"):
+        sentinel_data = SentinelData(API_KEYS, storage=storage)
+        bytes_before = mock_hub.stats['bytes']
+        sentinel_data.download_s2_s3_data_pack(BBOX, 32633, ('2024-06-01', '2024-06-02'), 10, str(tmp_path / storage),
+                                               fused=storage == "scaled")
+        build_hotspot_pipeline(str(tmp_path / storage), storage=storage).run(['lst_mean'])
+        if storage == "float32":
+            float_bytes = mock_hub.stats['bytes'] - bytes_before
+    assert mock_hub.stats['bytes'] - bytes_before < 0.75 * float_bytes
+
+    for product, atol in (("Sentinel-2/s2_2024-06-01", 0.00005), ("Sentinel-3/s3_2024-06-01", 0.005),
+                          ("Sentinel-3-smooth/s3_2024-06-01", 0.01), ("LST_days/LST_2024-06-01", 0.05),
+                          ("LST_mean", 0.05)):
+        with rasterio.open(tmp_path / "float32" / f"{product}.tiff") as expected, \
+                rasterio.open(tmp_path / "scaled" / f"{product}.tiff") as scaled:
+            assert scaled.dtypes[0] == ('float32' if product == "LST_mean" else 'uint16')
+            np.testing.assert_allclose(read_unscaled(scaled), expected.read(), atol=atol)
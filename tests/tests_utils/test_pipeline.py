@@ -0,0 +1,101 @@
+import json
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from src.utils.pipeline import build_hotspot_pipeline
+
+
+def _write_raster(path, array):
+    with rasterio.open(path, 'w', driver='GTiff', width=array.shape[2], height=array.shape[1], count=array.shape[0],
+                       dtype=array.dtype, crs='EPSG:32633', transform=from_origin(498000, 5667000, 10, 10)) as dst:
+        dst.write(array)
+
+
+def _write_working_dir(working_dir):
+    for directory in ('Sentinel-2', 'Sentinel-3', 'Sentinel-2-weeks'):
+        (working_dir / directory).mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for date in ('2024-06-01', '2024-06-02'):
+        _write_raster(str(working_dir / 'Sentinel-2' / f"s2_{date}.tiff"),
+                      rng.uniform(0.01, 0.5, size=(4, 40, 50)).astype(np.float32))
+        _write_raster(str(working_dir / 'Sentinel-3' / f"s3_{date}.tiff"),
+                      rng.uniform(270, 320, size=(2, 40, 50)).astype(np.float32))
+    for week in ('2024-06-03-2024-06-09', '2024-06-10-2024-06-16'):
+        _write_raster(str(working_dir / 'Sentinel-2-weeks' / f"s2_{week}.tiff"),
+                      rng.uniform(0.01, 0.5, size=(4, 40, 50)).astype(np.float32))
+
+
+def _computed(report):
+    return {stage: len(result['computed']) for stage, result in report.items()}
+
+
+def test_rerun_skips_unchanged_products(tmp_path):
+    _write_working_dir(tmp_path)
+
+    first = build_hotspot_pipeline(str(tmp_path)).run()
+    second = build_hotspot_pipeline(str(tmp_path)).run()
+
+    assert _computed(first) == {'smooth': 2, 'lst_days': 2, 'lst_mean': 1, 'ui_weeks': 2, 'ui_aggregate': 1}
+    assert _computed(second) == {'smooth': 0, 'lst_days': 0, 'lst_mean': 0, 'ui_weeks': 0, 'ui_aggregate': 0}
+    assert (tmp_path / 'LST_mean.tiff').exists() and (tmp_path / 'aggregated_ui.tiff').exists()
+
+
+def test_parameter_changes_recompute_only_affected_stages(tmp_path):
+    _write_working_dir(tmp_path)
+    build_hotspot_pipeline(str(tmp_path)).run()
+
+    thresholds = build_hotspot_pipeline(str(tmp_path), ndwi_threshold=0.1).run()
+    method = build_hotspot_pipeline(str(tmp_path), ndwi_threshold=0.1, method='median').run()
+    sigma = build_hotspot_pipeline(str(tmp_path), sigma=3, ndwi_threshold=0.1, method='median').run(
+        targets=['lst_mean'])
+
+    assert _computed(thresholds) == {'smooth': 0, 'lst_days': 0, 'lst_mean': 0, 'ui_weeks': 2, 'ui_aggregate': 1}
+    assert _computed(method) == {'smooth': 0, 'lst_days': 0, 'lst_mean': 0, 'ui_weeks': 0, 'ui_aggregate': 1}
+    assert _computed(sigma) == {'smooth': 2, 'lst_days': 2, 'lst_mean': 1}
+
+
+def test_changed_or_missing_files_are_recomputed(tmp_path):
+    _write_working_dir(tmp_path)
+    build_hotspot_pipeline(str(tmp_path)).run()
+    with rasterio.open(tmp_path / 'LST_days' / 'LST_2024-06-01.tiff') as src:
+        lst_before = src.read(1)
+
+    _write_raster(str(tmp_path / 'Sentinel-2' / "s2_2024-06-02.tiff"),
+                  np.full((4, 40, 50), 0.3, dtype=np.float32))
+    (tmp_path / 'LST_days' / 'LST_2024-06-01.tiff').unlink()
+    report = build_hotspot_pipeline(str(tmp_path)).run(targets=['lst_mean'], max_workers=2)
+
+    assert _computed(report) == {'smooth': 0, 'lst_days': 2, 'lst_mean': 1}
+    with rasterio.open(tmp_path / 'LST_days' / 'LST_2024-06-01.tiff') as src:
+        np.testing.assert_array_equal(src.read(1), lst_before)
+
+
+def test_lst_mean_averages_only_the_planned_days(tmp_path):
+    _write_working_dir(tmp_path)
+    build_hotspot_pipeline(str(tmp_path)).run()
+    (tmp_path / 'Sentinel-2' / 's2_2024-06-02.tiff').unlink()
+
+    report = build_hotspot_pipeline(str(tmp_path)).run(targets=['lst_mean'])
+
+    assert _computed(report) == {'smooth': 0, 'lst_days': 0, 'lst_mean': 1}
+    # The LST raster of the dropped day is still on disk but no longer part of the mean
+    assert (tmp_path / 'LST_days' / 'LST_2024-06-02.tiff').exists()
+    manifest = json.loads((tmp_path / 'pipeline_manifest.json').read_text())
+    assert manifest['products']['LST_mean.tiff']['inputs'] == ['LST_days/LST_2024-06-01.tiff']
+
+
+def test_ui_aggregate_uses_only_the_planned_weeks(tmp_path):
+    _write_working_dir(tmp_path)
+    build_hotspot_pipeline(str(tmp_path)).run()
+    (tmp_path / 'Sentinel-2-weeks' / 's2_2024-06-10-2024-06-16.tiff').unlink()
+
+    report = build_hotspot_pipeline(str(tmp_path)).run(targets=['ui_aggregate'])
+
+    assert _computed(report) == {'ui_weeks': 0, 'ui_aggregate': 1}
+    assert (tmp_path / 'Sentinel-2-weeks' / 's2_2024-06-10-2024-06-16_ui.tiff').exists()
+    manifest = json.loads((tmp_path / 'pipeline_manifest.json').read_text())
+    assert manifest['products']['aggregated_ui.tiff']['inputs'] == ['Sentinel-2-weeks/s2_2024-06-03-2024-06-09_ui.tiff']
+    with rasterio.open(tmp_path / 'aggregated_ui.tiff') as aggregate, \
+            rasterio.open(tmp_path / 'Sentinel-2-weeks' / 's2_2024-06-03-2024-06-09_ui.tiff') as week:
+        np.testing.assert_allclose(aggregate.read(1), week.read(1))
@@ -0,0 +1,51 @@
+import json
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from src.utils.gis_helpers import save_tiff_and_metadata, smooth_raster
+from src.utils.raster_storage import SCALED_ENCODINGS, decode, encode, read_unscaled, scaled_metadata
+
+
+def test_encode_round_trips_within_half_a_step():
+    encoding = SCALED_ENCODINGS['temperature']
+    values = np.array([0.0, 273.154, 310.5, np.nan, 700.0, -3.0], dtype=np.float32)
+
+    stored = encode(values, encoding)
+
+    assert stored.dtype == np.uint16
+    assert list(stored[3:]) == [65535, 65534, 0]
+    np.testing.assert_allclose(decode(stored, encoding)[:3], values[:3], atol=0.005)
+    assert np.isnan(decode(stored, encoding)[3])
+    # Already stored arrays are kept
+    assert encode(stored, encoding) is stored
+
+
+@pytest.mark.parametrize('output_profile', ['gtiff', 'cog'])
+def test_scaled_raster_is_read_as_values(tmp_path, output_profile):
+    reflectance = np.random.default_rng(0).uniform(0, 1, (40, 30, 4)).astype(np.float32)
+    output_path = str(tmp_path / "s2_2024-06-01.tiff")
+
+    save_tiff_and_metadata(reflectance, from_origin(500000, 5660400, 10, 10), 32633, output_path,
+                           scaled_metadata({"bands": ["B03", "B04", "B08", "B11"]}, 'reflectance'), output_profile)
+
+    with rasterio.open(output_path) as src:
+        assert src.dtypes[0] == 'uint16' and src.scales[0] == 0.0001 and src.nodata == 65535
+        np.testing.assert_allclose(read_unscaled(src), np.moveaxis(reflectance, -1, 0), atol=0.00005)
+    with open(tmp_path / "s2_2024-06-01_metadata.json") as metadata_file:
+        assert json.load(metadata_file) == {"bands": ["B03", "B04", "B08", "B11"], "dtype": "uint16",
+                                            "scale": 0.0001, "offset": 0.0, "nodata": 65535}
+
+
+def test_smoothing_keeps_the_encoding(tmp_path):
+    temperature = np.full((20, 20, 2), 300.0, dtype=np.float32)
+    input_path, output_path = str(tmp_path / "s3.tiff"), str(tmp_path / "smooth" / "s3.tiff")
+    save_tiff_and_metadata(temperature, from_origin(0, 200, 10, 10), 32633, input_path,
+                           scaled_metadata({"bands": ["S8", "S9"]}, 'temperature'))
+
+    smooth_raster(input_path, output_path, sigma=2)
+
+    with rasterio.open(output_path) as src:
+        assert src.dtypes[0] == 'uint16' and src.scales == (0.01, 0.01)
+        np.testing.assert_allclose(read_unscaled(src), 300.0)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import rasterio
+from src.utils.resampling import _interpolation_matrix, coarse_grid, upsample, write_upsampled
+
+
+def test_coarse_grid_is_anchored_and_padded():
+    bbox, size = coarse_grid([500010, 5660020, 500290, 5660180], 100)
+
+    assert bbox == (499800, 5659800, 500500, 5660400)
+    assert size == (7, 6)
+    # Every AOI of a resolution shares the grid
+    assert coarse_grid([500110, 5660020, 500290, 5660180], 100)[0][0] % 100 == 0
+
+
+@pytest.mark.parametrize('kernel', ['nearest', 'bilinear', 'cubic'])
+def test_upsample_identical_grid_keeps_values(kernel):
+    array = np.random.default_rng(0).random((6, 7, 2))
+    bbox = (0, 0, 700, 600)
+
+    np.testing.assert_allclose(upsample(array, bbox, bbox, (7, 6), kernel), array, rtol=1e-6)
+
+
+@pytest.mark.parametrize('kernel', ['bilinear', 'cubic'])
+def test_upsample_reproduces_linear_ramps(kernel):
+    # Values at the pixel centres of a 100 m grid
+    source_bbox, target_bbox = (0, 0, 1000, 1000), (200, 300, 700, 800)
+    centres = np.arange(10) * 100 + 50
+    source = (2 * centres[None, :] + 3 * centres[::-1, None])[:, :, None] * np.ones(2)
+    target_centres = np.arange(50) * 10 + 5
+
+    result = upsample(source, source_bbox, target_bbox, (50, 50), kernel)
+
+    expected = 2 * (200 + target_centres)[None, :] + 3 * (800 - target_centres)[:, None]
+    assert result.shape == (50, 50, 2) and result.dtype == np.float32
+    np.testing.assert_allclose(result[:, :, 1], expected, rtol=1e-5)
+    # Strips of rows match the full raster
+    np.testing.assert_array_equal(upsample(source, source_bbox, target_bbox, (50, 50), kernel, rows=(10, 20)),
+                                  result[10:20])
+
+
+def test_interpolation_matrices_are_cached_per_grid(tmp_path):
+    _interpolation_matrix.cache_clear()
+    source = np.ones((6, 7, 2))
+    for day in range(3):
+        write_upsampled(source * day, (0, 0, 700, 600), (100, 100, 600, 500), (50, 40), 32633,
+                        str(tmp_path / f"s3_{day}.tiff"), {'bands': ['S8', 'S9']}, strip_rows=16)
+
+    # One matrix for the columns and one for the rows, computed once for all strips and dates
+    assert _interpolation_matrix.cache_info().misses == 2
+    with rasterio.open(tmp_path / "s3_2.tiff") as src:
+        assert (src.width, src.height, src.count) == (50, 40, 2)
+        assert src.bounds == (100, 100, 600, 500)
+        np.testing.assert_array_equal(src.read(), 2)
+    with pytest.raises(ValueError):
+        upsample(source, (0, 0, 700, 600), (0, 0, 700, 600), (7, 6), 'lanczos')
+
+
+@pytest.mark.parametrize('kernel', ['nearest', 'bilinear', 'cubic'])
+def test_missing_pixel_only_affects_its_neighbourhood(kernel):
+    source = np.ones((10, 10, 1))
+    source[4, 6] = np.nan
+
+    result = upsample(source, (0, 0, 100, 100), (0, 0, 100, 100), (40, 40), kernel)[:, :, 0]
+
+    rows, cols = np.nonzero(np.isnan(result))
+    # The 4 x 4 output pixels inside the missing 10 m pixel, at most, and some of them
+    assert 0 < len(rows) <= 16
+    assert rows.min() >= 16 and rows.max() < 20 and cols.min() >= 24 and cols.max() < 28
+    np.testing.assert_allclose(result[np.isfinite(result)], 1, rtol=1e-6)
@@ -1,4 +1,5 @@
 import glob
+import os
 
 import pytest
 from src.utils.sentinel_data import SentinelData
@@ -70,3 +71,146 @@ def test_download_data_pack(tmp_path):
     assert len(tiff_files_folder1) > 0, f"No TIFF files found in {folder1}"
     assert len(tiff_files_folder2) > 0, f"No TIFF files found in {folder2}"
 
+
+def _offline_sentinel_data(monkeypatch, latency):
+    """SentinelData whose downloads sleep for `latency` seconds instead of calling the Process API."""
+    import time
+    import numpy as np
+    from sentinelhub import SHConfig
+
+    monkeypatch.setattr("src.utils.sentinel_data.load_config", lambda *args, **kwargs: SHConfig())
+    sentinel_data = SentinelData()
+
+    def fake_download(bands):
+        def download(bbox_coordinates, crs, date_range, resolution):
+            time.sleep(latency)
+            return np.ones((6, 3, bands), dtype=np.float32)
+        return download
+
+    sentinel_data.download_sentinel2_data = fake_download(4)
+    sentinel_data.download_sentinel3_data = fake_download(2)
+    days = [f"2024-06-{day:02d}" for day in range(1, 9)]
+    sentinel_data.search_data = lambda *args, **kwargs: {"common_dates": days}
+    return sentinel_data
+
+
+def _count_downloads(sentinel_data):
+    """Wraps the downloads of `sentinel_data` to count the calls and the peak number of downloads in flight."""
+    import threading
+    stats = {'calls': 0, 'in_flight': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def counting(download):
+        def counting_download(*args):
+            with lock:
+                stats['calls'] += 1
+                stats['in_flight'] += 1
+                stats['peak'] = max(stats['peak'], stats['in_flight'])
+            try:
+                return download(*args)
+            finally:
+                with lock:
+                    stats['in_flight'] -= 1
+        return counting_download
+
+    sentinel_data.download_sentinel2_data = counting(sentinel_data.download_sentinel2_data)
+    sentinel_data.download_sentinel3_data = counting(sentinel_data.download_sentinel3_data)
+    return stats
+
+
+def test_download_data_pack_concurrent(tmp_path, monkeypatch):
+    bbox_coords = [498260, 5666530, 498290, 5666590]
+    sentinel_data = _offline_sentinel_data(monkeypatch, latency=0.1)
+    stats = _count_downloads(sentinel_data)
+
+    sentinel_data.download_s2_s3_data_pack(bbox_coords, 32633, ('2024-06-01', '2024-06-08'), 10, tmp_path / "serial")
+    assert stats == {'calls': 16, 'in_flight': 0, 'peak': 1}
+
+    stats.update(calls=0, peak=0)
+    sentinel_data.download_s2_s3_data_pack(bbox_coords, 32633, ('2024-06-01', '2024-06-08'), 10, tmp_path / "parallel",
+                                           max_workers=8, max_requests_per_host=8)
+    assert stats['calls'] == 16
+    assert 1 < stats['peak'] <= 8
+
+    for folder in ["Sentinel-2", "Sentinel-3"]:
+        serial_files = sorted(os.path.basename(f) for f in glob.glob(str(tmp_path / "serial" / folder / "*.tiff")))
+        parallel_files = sorted(os.path.basename(f) for f in glob.glob(str(tmp_path / "parallel" / folder / "*.tiff")))
+        assert len(serial_files) == 8
+        assert serial_files == parallel_files
+    assert not glob.glob(str(tmp_path / "parallel" / "*" / "*.part"))
+
+
+def test_download_data_pack_respects_host_limit(tmp_path, monkeypatch):
+    sentinel_data = _offline_sentinel_data(monkeypatch, latency=0.05)
+    stats = _count_downloads(sentinel_data)
+
+    sentinel_data.download_s2_s3_data_pack([498260, 5666530, 498290, 5666590], 32633, ('2024-06-01', '2024-06-08'),
+                                           10, tmp_path, max_workers=8, max_requests_per_host=3)
+    assert stats['calls'] == 16
+    assert stats['peak'] <= 3
+
+
+def test_host_semaphores_with_different_limits_share_the_host():
+    import threading
+    from src.utils.sentinel_data import host_semaphore
+
+    entered = threading.Event()
+
+    def strict_request():
+        with host_semaphore("https://limits.example.com/api", 2):
+            entered.set()
+
+    with host_semaphore("https://limits.example.com/api", 8), host_semaphore("https://limits.example.com/x", 8):
+        thread = threading.Thread(target=strict_request)
+        thread.start()
+        assert not entered.wait(0.2)
+    assert entered.wait(5)
+    thread.join()
+
+
+def test_download_served_from_cache(tmp_path, monkeypatch):
+    import numpy as np
+    from sentinelhub import SHConfig, SentinelHubRequest
+    from src.utils.download_cache import DownloadCache
+
+    config = SHConfig()
+    config.sh_base_url = 'https://sh.dataspace.copernicus.eu'
+    monkeypatch.setattr("src.utils.sentinel_data.load_config", lambda *args, **kwargs: config)
+    calls = []
+
+    def fake_get_data(self, *args, **kwargs):
+        calls.append(self)
+        return [np.ones((6, 3, 4), dtype=np.float32)]
+
+    monkeypatch.setattr(SentinelHubRequest, "get_data", fake_get_data)
+    cache = DownloadCache(tmp_path)
+    sentinel_data = SentinelData(cache=cache)
+    bbox_coords = [498260, 5666530, 498290, 5666590]
+
+    first = sentinel_data.download_sentinel2_data(bbox_coords, 32633, ('2020-06-12', '2020-06-13'), 10)
+    second = sentinel_data.download_sentinel2_data(bbox_coords, 32633, ('2020-06-12', '2020-06-13'), 10)
+    sentinel_data.download_sentinel3_data(bbox_coords, 32633, ('2020-06-12', '2020-06-13'), 10)
+
+    np.testing.assert_array_equal(first, second)
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_download_progress_stops_pool_when_cancelled(tmp_path, monkeypatch):
+    from src.utils.background_jobs import JobCancelled
+
+    sentinel_data = _offline_sentinel_data(monkeypatch, latency=0.05)
+    reported = []
+
+    def progress(done, total, item):
+        reported.append((done, total, item))
+        if done == 3:
+            raise JobCancelled()
+
+    with pytest.raises(JobCancelled):
+        sentinel_data.download_s2_s3_data_pack([498260, 5666530, 498290, 5666590], 32633, ('2024-06-01', '2024-06-08'),
+                                               10, tmp_path, max_workers=2, progress=progress)
+
+    assert [done for done, _, _ in reported] == [1, 2, 3]
+    assert all(total == 16 for _, total, _ in reported)
+    assert len(list(tmp_path.glob("Sentinel-*/*.tiff"))) < 16
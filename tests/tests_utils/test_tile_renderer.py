@@ -0,0 +1,78 @@
+import io
+import os
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+from src.utils.helper_functions import file_sha256
+from src.utils.tile_renderer import TileRenderer, colormap_lut, lonlat_to_tile, tile_bounds
+
+
+def _write_raster(path, data):
+    with rasterio.open(path, 'w', driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                       dtype='float32', crs='EPSG:32633', transform=from_origin(480000, 5680000, 10, 10),
+                       tiled=True) as dst:
+        dst.write(data, 1)
+
+
+def test_tile_bounds_match_lonlat_lookup():
+    x, y = lonlat_to_tile(14.988, 51.155, 12)
+    min_x, min_y, max_x, max_y = tile_bounds(12, x, y)
+    # EPSG:3857 coordinates of the position
+    position_x = 14.988 * 20037508.342789244 / 180
+    position_y = np.log(np.tan(np.radians(90 + 51.155) / 2)) * 20037508.342789244 / np.pi
+    assert min_x <= position_x < max_x and min_y <= position_y < max_y
+
+
+def test_render_tile_colourises_valid_pixels_and_caches(tmp_path):
+    data = np.random.default_rng(0).uniform(280, 320, size=(3000, 3000)).astype(np.float32)
+    data[:, 1500:] = np.nan
+    raster_path = str(tmp_path / "LST_mean.tiff")
+    _write_raster(raster_path, data)
+    stat_before, sha256_before = os.stat(raster_path), file_sha256(raster_path)
+
+    renderer = TileRenderer(raster_path, max_tiles=2)
+
+    with rasterio.open(raster_path) as src:
+        assert src.overviews(1), "Overviews should be built for rasters larger than a tile"
+    # The overviews are external, viewing a product does not change it
+    assert os.path.exists(f"{raster_path}.ovr")
+    stat_after = os.stat(raster_path)
+    assert (stat_after.st_mtime_ns, stat_after.st_size) == (stat_before.st_mtime_ns, stat_before.st_size)
+    assert file_sha256(raster_path) == sha256_before
+    assert 280 <= renderer.vmin < renderer.vmax <= 320
+
+    west, south, east, north = renderer.bounds_wgs84()
+    x, y = lonlat_to_tile(west + (east - west) / 4, (south + north) / 2, 14)
+    tile = renderer.render_tile(14, x, y)
+    alpha = np.asarray(tile)[..., 3]
+    assert tile.size == (256, 256)
+    assert (alpha > 0).any()
+    assert renderer.render_tile(14, x, y) is tile
+
+    # Outside of the raster nothing is rendered, older tiles are evicted
+    assert renderer.render_tile(14, 0, 0) is None
+    renderer.render_tile(13, x // 2, y // 2)
+    assert renderer.render_tile(14, x, y) is not tile
+
+    png = renderer.render_tile_bytes(14, x, y)
+    assert Image.open(io.BytesIO(png)).format == 'PNG'
+
+
+def test_low_zoom_tile_covers_raster_with_nodata_transparent(tmp_path):
+    data = np.full((2000, 2000), 1.0, dtype=np.float32)
+    data[:, :1000] = np.nan
+    raster_path = str(tmp_path / "aggregated_ui.tiff")
+    _write_raster(raster_path, data)
+    renderer = TileRenderer(raster_path, vmin=0, vmax=1, opacity=1.0)
+
+    west, south, east, north = renderer.bounds_wgs84()
+    x, y = lonlat_to_tile((west + east) / 2, (south + north) / 2, 9)
+    rgba = np.asarray(renderer.render_tile(9, x, y))
+
+    opaque = rgba[..., 3] == 255
+    assert opaque.any() and (rgba[..., 3] == 0).any()
+    # Valid pixels are coloured with the top of the colormap, nodata pixels stay fully transparent
+    assert set(np.unique(rgba[..., 3])) <= {0, 255}
+    assert (rgba[opaque][:, :3] == colormap_lut('viridis')[255, :3]).all()
@@ -0,0 +1,77 @@
+import json
+import os
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from src.utils.tile_renderer import lonlat_to_tile
+from src.utils.tile_server import TileServer
+
+
+@pytest.fixture
+def tile_server(tmp_path):
+    raster_path = str(tmp_path / "LST_mean.tiff")
+    data = np.random.default_rng(0).uniform(280, 320, size=(1500, 1500)).astype(np.float32)
+    with rasterio.open(raster_path, 'w', driver='GTiff', width=1500, height=1500, count=1, dtype='float32',
+                       crs='EPSG:32633', transform=from_origin(490000, 5672000, 10, 10)) as dst:
+        dst.write(data, 1)
+    server = TileServer({'lst': raster_path}, port=0, cache_dir=str(tmp_path / "tiles"), max_workers=4).start()
+    yield server
+    server.stop()
+
+
+def _get(url, headers=None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+def _center_tile(server, zoom):
+    west, south, east, north = json.loads(_get(f"{server.url}/layers")[2])['lst']['bounds']
+    return lonlat_to_tile((west + east) / 2, (south + north) / 2, zoom)
+
+
+def test_serves_png_and_webp_tiles_with_etags(tile_server, tmp_path):
+    x, y = _center_tile(tile_server, 12)
+
+    status, headers, png = _get(f"{tile_server.url}/lst/12/{x}/{y}.png")
+    assert status == 200 and headers['Content-Type'] == 'image/png' and png.startswith(b'\x89PNG')
+    status, headers_webp, webp = _get(f"{tile_server.url}/lst/12/{x}/{y}.webp")
+    assert status == 200 and webp[8:12] == b'WEBP'
+
+    status, _, body = _get(f"{tile_server.url}/lst/12/{x}/{y}.png", {'If-None-Match': headers['ETag']})
+    assert status == 304 and body == b''
+    assert list((tmp_path / "tiles" / "lst").glob("*/12/*/*.png"))
+
+
+def test_unknown_layer_and_out_of_range_tiles(tile_server):
+    assert _get(f"{tile_server.url}/ui/12/0/0.png")[0] == 404
+    assert _get(f"{tile_server.url}/lst/2/4/0.png")[0] == 404
+    # Tiles outside the raster are transparent
+    status, _, body = _get(f"{tile_server.url}/lst/12/0/0.png")
+    assert status == 200 and body.startswith(b'\x89PNG')
+
+
+def test_concurrent_requests_and_rewritten_raster_changes_etag(tile_server):
+    x, y = _center_tile(tile_server, 13)
+    urls = [f"{tile_server.url}/lst/13/{x + dx}/{y + dy}.png" for dx in range(-1, 2) for dy in range(-1, 2)]
+    stat = os.stat(tile_server.layers['lst'])
+    with ThreadPoolExecutor(max_workers=9) as executor:
+        responses = list(executor.map(_get, urls))
+    assert all(status == 200 for status, _, _ in responses)
+    # Serving a layer leaves its raster untouched
+    assert os.stat(tile_server.layers['lst']).st_mtime_ns == stat.st_mtime_ns
+
+    etag = responses[4][1]['ETag']
+    with rasterio.open(tile_server.layers['lst'], 'r+') as dst:
+        dst.write(np.full((1500, 1500), 300, dtype=np.float32), 1)
+    status, headers, _ = _get(urls[4], {'If-None-Match': etag})
+    assert status == 200 and headers['ETag'] != etag
+    # Only the tiles of the current raster version are kept on disk
+    assert len(os.listdir(os.path.join(tile_server.cache.cache_dir, 'lst'))) == 1
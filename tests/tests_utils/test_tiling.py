@@ -0,0 +1,62 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+from src.utils.tiling import tile_grid
+
+
+def test_tile_grid_covers_raster_without_overlap():
+    transform = from_bounds(0, 0, 5300, 2600, 5300, 2600)
+    tiles = tile_grid(5300, 2600, transform, max_tile_pixels=2500)
+
+    coverage = np.zeros((2600, 5300), dtype=np.uint8)
+    for window, bbox in tiles:
+        assert window.width <= 2500 and window.height <= 2500
+        coverage[window.toslices()] += 1
+        # Tile bounds are aligned to the output pixel grid
+        assert all(float(value).is_integer() for value in bbox)
+    assert len(tiles) == 6
+    assert (coverage == 1).all()
+
+
+def test_tile_grid_single_tile_for_small_aoi():
+    transform = from_bounds(0, 0, 30, 60, 3, 6)
+    tiles = tile_grid(3, 6, transform)
+    assert len(tiles) == 1
+    assert tiles[0][1] == (0, 0, 30, 60)
+
+
+def test_tiled_download_mosaics_seamlessly(tmp_path, monkeypatch):
+    from sentinelhub import SHConfig
+    from src.utils.sentinel_data import SentinelData
+
+    monkeypatch.setattr("src.utils.sentinel_data.load_config", lambda *args, **kwargs: SHConfig())
+    sentinel_data = SentinelData()
+    requested_sizes = []
+
+    def fake_download(bbox_coordinates, crs, date_range, resolution, size=None):
+        # Every pixel stores the x and y coordinate of its centre, so misplaced tiles are detected
+        width, height = size if size else (round((bbox_coordinates[2] - bbox_coordinates[0]) / resolution),
+                                           round((bbox_coordinates[3] - bbox_coordinates[1]) / resolution))
+        requested_sizes.append((width, height))
+        pixel_x = (bbox_coordinates[2] - bbox_coordinates[0]) / width
+        pixel_y = (bbox_coordinates[3] - bbox_coordinates[1]) / height
+        xs = bbox_coordinates[0] + pixel_x * (np.arange(width) + 0.5)
+        ys = bbox_coordinates[3] - pixel_y * (np.arange(height) + 0.5)
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        return np.stack([grid_x, grid_y], axis=-1).astype(np.float64)
+
+    sentinel_data.download_sentinel2_data = fake_download
+    sentinel_data.search_data = lambda *args, **kwargs: {"common_dates": ["2024-06-01"]}
+    sentinel_data.download_sentinel3_data = fake_download
+    bbox_coords = [498260, 5666530, 498330, 5666620]
+    sentinel_data.download_s2_s3_data_pack(bbox_coords, 32633, ("2024-06-01", "2024-06-01"), 10, str(tmp_path),
+                                           max_workers=2, max_tile_pixels=3)
+
+    assert max(max(size) for size in requested_sizes) <= 3
+    with rasterio.open(tmp_path / "Sentinel-2" / "s2_2024-06-01.tiff") as src:
+        assert (src.width, src.height) == (7, 9)
+        rows, cols = np.mgrid[0:src.height, 0:src.width]
+        expected_x, expected_y = rasterio.transform.xy(src.transform, rows, cols)
+        np.testing.assert_allclose(src.read(1), np.asarray(expected_x).reshape(rows.shape))
+        np.testing.assert_allclose(src.read(2), np.asarray(expected_y).reshape(rows.shape))
+    assert (tmp_path / "Sentinel-2" / "s2_2024-06-01_metadata.json").is_file()
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from src.utils.token_manager import TokenManager
+
+
+@pytest.fixture
+def token_server(monkeypatch):
+    """Local identity endpoint counting how many tokens it issued."""
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    issued = {"count": 0, "expires_in": 600}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            issued["count"] += 1
+            body = json.dumps({"access_token": f"token-{issued['count']}", "token_type": "Bearer",
+                               "expires_in": issued["expires_in"]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    issued["url"] = f"http://127.0.0.1:{server.server_port}/token"
+    yield issued
+    server.shutdown()
+
+
+def test_token_is_reused_until_expiry(token_server):
+    manager = TokenManager("client", "secret", token_url=token_server["url"], background_refresh=False)
+    tokens = {manager.get_token()["access_token"] for _ in range(50)}
+    assert tokens == {"token-1"}
+    assert token_server["count"] == 1
+
+
+def test_token_shared_through_disk_cache(token_server, tmp_path):
+    first = TokenManager("client", "secret", token_url=token_server["url"], cache_dir=tmp_path,
+                         background_refresh=False)
+    second = TokenManager("client", "secret", token_url=token_server["url"], cache_dir=tmp_path,
+                          background_refresh=False)
+    assert first.get_token()["access_token"] == second.get_token()["access_token"]
+    assert token_server["count"] == 1
+
+    other_client = TokenManager("other", "secret", token_url=token_server["url"], cache_dir=tmp_path,
+                                background_refresh=False)
+    other_client.get_token()
+    assert token_server["count"] == 2
+
+
+def test_token_refreshed_before_expiry(token_server):
+    token_server["expires_in"] = 30
+    manager = TokenManager("client", "secret", token_url=token_server["url"], refresh_margin=60,
+                           background_refresh=False)
+    assert manager.get_token()["access_token"] == "token-1"
+    # A token expiring within the refresh margin is never handed out
+    assert manager.get_token()["access_token"] == "token-2"
+
+
+def test_background_refresh_replaces_token_without_looping(token_server):
+    manager = TokenManager("client", "secret", token_url=token_server["url"], refresh_margin=60)
+    manager.get_token()
+    # Woken up twice the margin before expiry
+    assert 470 < manager._refresh_timer.interval <= 480
+    manager.close()
+
+    # A token that cannot outlive the margin is not refreshed in the background at all
+    token_server["expires_in"] = 2
+    manager = TokenManager("client", "secret", token_url=token_server["url"], refresh_margin=60)
+    try:
+        manager.get_token()
+        assert manager._refresh_timer is None
+    finally:
+        manager.close()
+
+
+def test_background_refresh_stops_while_token_is_unused(token_server):
+    # Refreshed after max(4 - 2 * 1, 4 / 2) = 2 seconds
+    token_server["expires_in"] = 4
+    manager = TokenManager("client", "secret", token_url=token_server["url"], refresh_margin=1)
+    try:
+        manager.get_token()
+        issued = token_server["count"]
+        time.sleep(4.6)
+        # The used token was refreshed once, the unused refreshed token is not refreshed again
+        assert token_server["count"] == issued + 1
+        assert manager._refresh_timer is None
+
+        assert manager.get_token()["access_token"] == f"token-{issued + 1}"
+        assert manager._refresh_timer is not None
+        assert token_server["count"] == issued + 1
+    finally:
+        manager.close()
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import pytest
+import rasterio
+from src.utils import ui_calculator
+from src.utils.ui_calculator import calculate_ui, calculate_ui_array
+
+
+def _legacy_ui(b03, b04, b08, b11, ndwi_threshold=0.3, mndwi_threshold=0.3):
+    b03, b04, b08, b11 = (band.astype(float) for band in (b03, b04, b08, b11))
+    ndwi = (b03 - b08) / (b03 + b08)
+    mndwi = (b03 - b11) / (b03 + b11)
+    water_mask = (ndwi > ndwi_threshold) | (mndwi > mndwi_threshold)
+    ui = (b04 - b08) / (b04 + b08)
+    ui[water_mask] = -0.5
+    return ui
+
+
+def _bands(shape, seed=0):
+    return [band.astype(np.float32) for band in np.random.default_rng(seed).uniform(0.01, 0.6, size=(4,) + shape)]
+
+
+@pytest.fixture(params=['numexpr', 'numpy'])
+def kernel(request, monkeypatch):
+    """Runs a test with the numexpr kernel and with the chunked numpy fallback."""
+    module = pytest.importorskip('numexpr') if request.param == 'numexpr' else None
+    monkeypatch.setattr(ui_calculator, 'numexpr', module)
+    return request.param
+
+
+def test_ui_kernel_matches_legacy_expression(kernel):
+    bands = _bands((300, 500))
+    expected = _legacy_ui(*bands)
+
+    ui = calculate_ui_array(*bands, precision='float64')
+    assert ui.dtype == np.float64
+    np.testing.assert_array_equal(ui, expected)
+    ui = calculate_ui_array(*bands)
+    assert ui.dtype == np.float32
+    np.testing.assert_allclose(ui, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_ui_kernel_benchmark(kernel, capsys):
+    """Reports the time of the fused kernel against the legacy expression. Timings vary too much to assert on."""
+    bands = _bands((2000, 2000))
+
+    def best_of(function, repeat=3):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(*bands)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    legacy_seconds = best_of(_legacy_ui)
+    fused_seconds = best_of(calculate_ui_array)
+    with capsys.disabled():
+        print(f"\nUI of 2000 x 2000 pixels: legacy {legacy_seconds:.3f}s, fused {kernel} {fused_seconds:.3f}s, "
+              f"speedup {legacy_seconds / fused_seconds:.1f}x")
+
+
+def test_calculate_ui_writes_float32_ui(tmp_path):
+    weeks_dir = tmp_path / 'Sentinel-2-weeks'
+    weeks_dir.mkdir()
+    bands = np.stack(_bands((60, 80)))
+    with rasterio.open(weeks_dir / "s2_2024-06-01-2024-06-07.tiff", 'w', driver='GTiff', width=80, height=60,
+                       count=4, dtype='float32') as dst:
+        dst.write(bands)
+
+    calculate_ui(str(tmp_path))
+
+    with rasterio.open(weeks_dir / "s2_2024-06-01-2024-06-07_ui.tiff") as src:
+        assert src.dtypes[0] == 'float32'
+        np.testing.assert_allclose(src.read(1), _legacy_ui(*bands), rtol=1e-5, atol=1e-6)